@@ -0,0 +1,265 @@
+# ----- imports -----
+import io
+import os
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from flask import current_app
+import geo
+import versions
+
+
+# ----- settings -----
+# columns of the snapshot with their NumPy type; NULLs are loaded as NaN (floats) or -1 (integers)
+COLUMNS = [
+    ('price', 'f8'),
+    ('area', 'f8'),
+    ('rooms', 'i4'),
+    ('year', 'i4'),
+    ('grid_cell', 'i4'),
+]
+
+# the same columns in SQL, cast to exactly these binary types so every COPY row has the same width
+SNAPSHOT_QUERY = '''
+    SELECT p.price::float8, COALESCE(p.area_size::float8, 'NaN'), COALESCE(p.number_of_rooms, -1),
+           COALESCE(p.building_year, -1), COALESCE(l.grid_cell, -1)
+    FROM property p
+    LEFT JOIN location l ON l.location_id = p.location_id
+'''
+
+# tables the snapshot is read from; a write to either makes it stale
+SNAPSHOT_TABLES = ('property', 'location')
+
+# binary COPY header: signature, flags and the length of a header extension (which follows it)
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_HEADER = np.dtype([('signature', 'V11'), ('flags', '>i4'), ('extension', '>i4')])
+
+# groupings offered by report()
+GROUPS = ('rooms', 'year', 'grid')
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+# ----- loading -----
+# the columns of every property as arrays, tagged with the table versions they were read at;
+# `orders` holds, per measure, the indices of its known values in ascending order
+Snapshot = namedtuple('Snapshot', ['tag', 'columns', 'orders', 'rows', 'loaded_at', 'load_seconds'])
+
+# measures summarized by report()
+MEASURES = ('price', 'price_m2')
+
+
+# function to return the NumPy type of one binary COPY row of `columns`: the field count,
+# then the length and big-endian value of every field
+def row_dtype(columns):
+    return np.dtype([('fields', '>i2')] + [field for name, kind in columns
+                                           for field in ((f'{name}_length', '>i4'), (name, '>' + kind))])
+
+
+# function to turn binary COPY output into one native array per column
+def parse_copy(data, columns=COLUMNS):
+    """Decode the output of ``COPY ... TO STDOUT WITH (FORMAT binary)`` with the given ``(name, type)`` columns.
+
+    The query must produce every field with exactly that fixed-width type and
+    no NULLs, so the rows are read as one structured array straight from the
+    buffer instead of row by row.
+    """
+    dtype = row_dtype(columns)
+    header = np.frombuffer(data, dtype=COPY_HEADER, count=1)[0]
+    if bytes(header['signature']) != COPY_SIGNATURE:
+        raise ValueError('not a binary COPY stream')
+    offset = COPY_HEADER.itemsize + int(header['extension'])
+    body = len(data) - offset - 2 # the stream ends with a field count of -1
+    if body % dtype.itemsize:
+        raise ValueError('unexpected row width in binary COPY stream')
+    rows = np.frombuffer(data, dtype=dtype, offset=offset, count=body // dtype.itemsize)
+    return {name: rows[name].astype(kind) for name, kind in columns}
+
+
+# function to run a query through binary COPY and return its columns as arrays
+def copy_columns(cur, query, columns, params=None):
+    if params is not None:
+        query = cur.mogrify(query, params).decode() # COPY takes no parameters of its own
+    buffer = io.BytesIO()
+    cur.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT binary)', buffer)
+    return parse_copy(buffer.getbuffer(), columns)
+
+
+# function to read the snapshot columns from the database
+def load_snapshot(conn):
+    started = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        # the versions are read first: if a write lands in between, the snapshot is newer than its tag and is reloaded once more
+        tag = versions.version_tag(versions.table_versions(cur, SNAPSHOT_TABLES))
+        columns = copy_columns(cur, SNAPSHOT_QUERY, COLUMNS)
+    finally:
+        cur.close()
+    columns['price_m2'] = price_per_m2(columns)
+    # sorting the values once per snapshot leaves only a stable sort by group key for each report
+    orders = {}
+    for measure in MEASURES:
+        known = np.flatnonzero(~np.isnan(columns[measure]))
+        orders[measure] = known[np.argsort(columns[measure][known])]
+    return Snapshot(tag, columns, orders, len(columns['price']), time.time(), time.perf_counter() - started)
+
+
+# ----- statistics -----
+# function to compute count, mean and quantiles of `values` per distinct key
+def grouped_stats(keys, values, order, quantiles=QUANTILES):
+    """Return ``{'key', 'count', 'mean', <quantile>: ...}`` arrays, one entry per group.
+
+    ``order`` lists the indices of the values to use in ascending value
+    order. A stable sort by key keeps that order inside every group, so each
+    group becomes a contiguous, sorted run: sums come from ``np.add.reduceat``
+    and each quantile is a linear interpolation between two positions of the
+    run, for all groups at once.
+    """
+    order = order[np.argsort(keys[order], kind='stable')]
+    keys, values = keys[order], values[order]
+    if not len(keys):
+        return {'key': keys, 'count': np.zeros(0, dtype=np.int64), 'mean': values, **{q: values for q in quantiles}}
+
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    stats = {'key': keys[starts], 'count': counts, 'mean': np.add.reduceat(values, starts) / counts}
+    for q in quantiles:
+        position = starts + (counts - 1) * q
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        stats[q] = values[low] + (values[high] - values[low]) * (position - low)
+    return stats
+
+
+# function to return price per square metre, NaN where the area is unknown or not positive
+def price_per_m2(columns):
+    area = columns['area']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(area > 0, columns['price'] / area, np.nan)
+
+
+# function to compute the group key of every property for one grouping
+def group_keys(columns, group, band=10, cell_degrees=1.0):
+    if group == 'rooms':
+        return columns['rooms']
+    if group == 'year':
+        year = columns['year']
+        return np.where(year >= 0, year // band * band, -1)
+    # grid: merge cell_degrees / 0.1° of the location grid cells in each direction
+    factor = max(1, round(cell_degrees * geo.GRID_CELLS_PER_DEGREE))
+    cell = columns['grid_cell']
+    keys = (cell // geo.GRID_COLUMNS // factor) * geo.GRID_COLUMNS + (cell % geo.GRID_COLUMNS) // factor
+    return np.where(cell >= 0, keys, -1)
+
+
+# function to describe one group key for display
+def group_label(group, key, band=10, cell_degrees=1.0):
+    if key < 0:
+        return {'label': 'unknown'}
+    if group == 'rooms':
+        return {'label': f'{key} rooms', 'rooms': int(key)}
+    if group == 'year':
+        return {'label': f'{key}-{key + band - 1}', 'from_year': int(key), 'to_year': int(key + band - 1)}
+    size = max(1, round(cell_degrees * geo.GRID_CELLS_PER_DEGREE)) / geo.GRID_CELLS_PER_DEGREE
+    lat = (key // geo.GRID_COLUMNS) * size - 90 + size / 2
+    lon = (key % geo.GRID_COLUMNS) * size - 180 + size / 2
+    return {'label': f'{lat:.2f}, {lon:.2f}', 'lat': round(lat, 4), 'lon': round(lon, 4)}
+
+
+# function to turn the stats of one group into a plain dict (rounded, JSON ready)
+def stats_row(stats, index, prefix):
+    return {
+        f'{prefix}_mean': round(float(stats['mean'][index]), 2),
+        f'{prefix}_p25': round(float(stats[0.25][index]), 2),
+        f'{prefix}_median': round(float(stats[0.5][index]), 2),
+        f'{prefix}_p75': round(float(stats[0.75][index]), 2),
+    }
+
+
+# function to compute price and price/m² statistics of a snapshot, overall or per group
+def report(snapshot, group=None, band=10, cell_degrees=1.0, min_count=1):
+    """Return a list of rows with count, price and price/m² mean and quartiles.
+
+    Without ``group`` there is one row for all properties; otherwise one row
+    per room count, per ``band``-year building band or per grid cell of
+    ``cell_degrees`` degrees (unknown values form their own group, except
+    for the grid). Groups with fewer than ``min_count`` properties are left out.
+    """
+    columns = snapshot.columns
+    keys = group_keys(columns, group, band, cell_degrees) if group else np.zeros(snapshot.rows, dtype=np.int32)
+    prices = grouped_stats(keys, columns['price'], snapshot.orders['price'])
+    per_m2 = grouped_stats(keys, columns['price_m2'], snapshot.orders['price_m2'])
+
+    rows = []
+    # groups without a single known area get no price/m² figures
+    m2_index = {int(key): i for i, key in enumerate(per_m2['key'])}
+    for i, key in enumerate(prices['key']):
+        key, count = int(key), int(prices['count'][i])
+        if count < min_count or (group == 'grid' and key < 0):
+            continue
+        row = group_label(group, key, band, cell_degrees) if group else {'label': 'all properties'}
+        row['count'] = count
+        row.update(stats_row(prices, i, 'price'))
+        if key in m2_index:
+            row['m2_count'] = int(per_m2['count'][m2_index[key]])
+            row.update(stats_row(per_m2, m2_index[key], 'price_m2'))
+        rows.append(row)
+
+    # the grid is listed busiest cell first, the other groupings in key order
+    if group == 'grid':
+        rows.sort(key=lambda row: row['count'], reverse=True)
+    return rows
+
+
+# ----- cache -----
+class AnalyticsCache:
+    """The current snapshot plus the reports computed from it.
+
+    Before use the snapshot's tag is compared with the current versions of
+    ``property`` and ``location`` (one primary key lookup); after any write
+    the next request reloads the snapshot, once per process, while
+    concurrent requests wait for it instead of loading it again.
+    """
+
+    def __init__(self, max_reports=64):
+        self.max_reports = max_reports
+        self.snapshot = None
+        self._reports = {}
+        self._lock = threading.Lock()
+
+    def get_snapshot(self, conn):
+        cur = conn.cursor()
+        tag = versions.version_tag(versions.table_versions(cur, SNAPSHOT_TABLES))
+        cur.close()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.tag == tag:
+            return snapshot
+        with self._lock:
+            if self.snapshot is None or self.snapshot.tag != tag:
+                self.snapshot = load_snapshot(conn)
+                self._reports = {}
+            return self.snapshot
+
+    def report(self, conn, group=None, band=10, cell_degrees=1.0, min_count=1):
+        snapshot = self.get_snapshot(conn)
+        key = (snapshot.tag, group, band, cell_degrees, min_count)
+        rows = self._reports.get(key)
+        if rows is None:
+            rows = report(snapshot, group, band, cell_degrees, min_count)
+            if len(self._reports) >= self.max_reports:
+                self._reports.clear()
+            self._reports[key] = rows
+        return snapshot, rows
+
+
+# ----- flask integration -----
+# function to return the analytics cache of the current app
+def get_cache():
+    return current_app.extensions['analytics']
+
+
+# function to register the analytics cache with an app
+def init_app(app):
+    app.config.setdefault('ANALYTICS_MAX_REPORTS', int(os.environ.get('ANALYTICS_MAX_REPORTS', 64)))
+    app.extensions['analytics'] = AnalyticsCache(max_reports=app.config['ANALYTICS_MAX_REPORTS'])
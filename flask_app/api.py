@@ -0,0 +1,165 @@
+# ----- imports -----
+import datetime
+from flask import Blueprint, jsonify, make_response, request
+from flask.json.provider import DefaultJSONProvider
+import comparables
+import versions
+from db import get_db_connection, replica_reads
+from pagination import fetch_page
+from queries import LIST_QUERIES, LIST_TABLES
+
+
+# read-only JSON API over the show_* list queries
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+# ----- serialization -----
+# JSON provider writing dates and timestamps as ISO 8601 (2022-01-05, 2022-01-05T10:30:00+00:00), the format
+# the from/to filters accept, instead of Flask's RFC 822 default; everything else as Flask does
+class JSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.date, datetime.datetime)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+
+# ----- helpers -----
+# function to build a JSON error response
+def error(message, status):
+    return jsonify(error=message), status
+
+
+# function to round a change time up to the next whole second, the resolution of Last-Modified
+def http_time(changed_at):
+    if changed_at is None or not changed_at.microsecond:
+        return changed_at
+    return changed_at.replace(microsecond=0) + datetime.timedelta(seconds=1)
+
+
+# function to tell whether the client already has the representation identified by etag/last_modified
+def not_modified(etag, last_modified):
+    # If-None-Match wins over If-Modified-Since, which only has second resolution; last_modified is
+    # rounded up (http_time), so a change later within the same second as the stored one is never hidden
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+# function to add the validators to a response; clients must revalidate, which costs one version lookup
+def conditional(response, etag, last_modified):
+    response.set_etag(etag, weak=True) # weak: the same data may be sent gzip, brotli or uncompressed
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+# function to keep only the requested ?fields= (comma separated) of every row
+def project(rows, columns):
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    if not fields:
+        return rows, None
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        return None, f"unknown fields {', '.join(unknown)}; available: {', '.join(columns)}"
+    return [{field: row[field] for field in fields} for row in rows], None
+
+
+# function to check the versions of an entity's tables and answer 304 when nothing changed
+def versions_or_304(cur, entity, *extra):
+    table_versions = versions.table_versions(cur, LIST_TABLES[entity])
+    etag = versions.version_tag(table_versions, entity, *extra)
+    last_modified = http_time(versions.last_changed(table_versions))
+    if not_modified(etag, last_modified):
+        return etag, last_modified, conditional(make_response('', 304), etag, last_modified)
+    return etag, last_modified, None
+
+
+# function to read the target of a comparables query: a property (?property_id=), a location (?location_id=)
+# or a point (?lat=&lon=), with ?area=, ?rooms= and ?year= overriding or adding features
+def comparables_target(cur):
+    args = request.args
+    property_id, location_id = args.get('property_id', type=int), args.get('location_id', type=int)
+    if property_id is not None or location_id is not None:
+        target = comparables.read_target(cur, property_id=property_id, location_id=location_id)
+        if target is None:
+            return None, property_id, error('property or location not found', 404)
+    elif args.get('lat', type=float) is not None and args.get('lon', type=float) is not None:
+        target = {'latitude': args.get('lat', type=float), 'longitude': args.get('lon', type=float),
+                  'area': None, 'rooms': None, 'year': None}
+    else:
+        return None, None, error('give property_id, location_id, or lat and lon', 400)
+    for feature in ('area', 'rooms', 'year'):
+        if args.get(feature, type=float) is not None:
+            target[feature] = args.get(feature, type=float)
+    return target, property_id, None
+
+
+# ----- routes -----
+# one keyset page of an entity (?after=, ?before=, ?page_size=, ?fields=)
+@bp.route('/<entity>')
+@replica_reads
+def list_entity(entity):
+    if entity not in LIST_QUERIES:
+        return error(f'unknown entity {entity}', 404)
+    query, key = LIST_QUERIES[entity]
+
+    cur = get_db_connection().cursor()
+    # the tag covers every query parameter, since each one changes the body
+    etag, last_modified, response = versions_or_304(cur, entity, sorted(request.args.items(multi=True)))
+    if response is not None:
+        cur.close()
+        return response
+    page = fetch_page(cur, query, key)
+    columns = [desc[0] for desc in cur.description]
+    cur.close()
+
+    rows, message = project(page.rows, columns)
+    if message:
+        return error(message, 400)
+    response = jsonify(data=rows, next=page.next_token, prev=page.prev_token,
+                       next_url=page.next_url, prev_url=page.prev_url)
+    return conditional(response, etag, last_modified)
+
+
+# the k most similar properties to a property, location or point, with a suggested price (?k=, at most 50)
+@bp.route('/comparables')
+def list_comparables():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    target, property_id, response = comparables_target(cur)
+    cur.close()
+    if response is not None:
+        return response
+    k = max(1, min(request.args.get('k', 10, type=int), 50))
+    result = comparables.get_cache().find(conn, target, k=k, exclude_id=property_id)
+    return jsonify(target=target, **result)
+
+
+# one row of an entity by id (?fields=)
+@bp.route('/<entity>/<int:entity_id>')
+@replica_reads
+def get_entity(entity, entity_id):
+    if entity not in LIST_QUERIES:
+        return error(f'unknown entity {entity}', 404)
+    query, key = LIST_QUERIES[entity]
+
+    cur = get_db_connection().cursor()
+    etag, last_modified, response = versions_or_304(cur, entity, entity_id, request.args.get('fields', ''))
+    if response is not None:
+        cur.close()
+        return response
+    cur.execute(f'{query} WHERE {key} = %s', (entity_id,))
+    columns = [desc[0] for desc in cur.description]
+    row = cur.fetchone()
+    cur.close()
+
+    if row is None:
+        return error(f'{entity} {entity_id} not found', 404)
+    rows, message = project([dict(zip(columns, row))], columns)
+    if message:
+        return error(message, 400)
+    return conditional(jsonify(data=rows[0]), etag, last_modified)
@@ -1,15 +1,47 @@
 # ----- imports -----
 import os
+import subprocess
+import sys
+import time
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from flask import Flask, render_template, request, url_for, redirect
+from flask import (Blueprint, Flask, Response, current_app, render_template, stream_template, stream_with_context, request,
+                   url_for, redirect, jsonify, abort)
 import logging
+import click
+import analytics
+import api
+import assets
+import benchmark
+import bulk_import
+import comparables
+import compression
+import db
+import export
+import facets
+import geo
+import listings
+import lookups
+import metrics
+import migrations
+import partitions
+import payments
+import person_search
+import query_log
+import query_plans
+import reports
+import response_cache
+import synthetic
+from db import get_db_connection, iter_rows
+from pagination import date_conditions, date_range_args, fetch_page
+from queries import (ADDRESS_LIST_QUERY, PERSON_LIST_QUERY, OWNER_LIST_QUERY, AGENT_LIST_QUERY, CLIENT_LIST_QUERY,
+                     LOCATION_LIST_QUERY, PROPERTY_LIST_QUERY, CONTRACT_LIST_QUERY, PAYMENT_LIST_QUERY)
 
 
 # ----- set-up -----
 basedir = os.path.abspath(os.path.dirname(__file__)) # get the base directory
-app = Flask(__name__) # create the flask app
-app.logger.setLevel(logging.DEBUG) # set the logging level to DEBUG
+
+# routes and commands; registered on the app by create_app(), so importing this module has no side effects
+bp = Blueprint('main', __name__, cli_group=None)
 
 
 # connection parameters
@@ -19,159 +51,38 @@ DATABASE_URL = POSTGRES_URL + '/' + DATABASE_NAME
 
 
 # ----- definitions -----
-# function to open a connection to the database
-def get_db_connection():
+# function to create the database if needed, apply pending schema migrations (never drops data) and create
+# the payment partitions of this year and the next ones; returns the names of the partitions it created
+def setup_db():
+    applied = migrations.migrate_if_needed(DATABASE_URL, POSTGRES_URL + '/postgres', DATABASE_NAME)
+    if applied:
+        current_app.logger.info(f"Applied schema migrations: {applied}")
+
+    # a connection of its own: this runs in the gunicorn master, whose pool the workers must not inherit
     conn = psycopg2.connect(DATABASE_URL)
-    return conn
-
-# function to create the database tables
-def setup_db(): 
-    create_database(DATABASE_NAME) # create the database
-    conn = get_db_connection() # open a connection to the database
-    cur = conn.cursor() # create a cursor object
-
-    # create address table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS address (
-            address_id SERIAL PRIMARY KEY,
-            street_number INTEGER,
-            address_line VARCHAR(255),
-            country VARCHAR(100),
-            postal_code VARCHAR(20)
-        );
-    ''')
-
-    # create person table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS person (
-            person_id SERIAL PRIMARY KEY,
-            first_name VARCHAR(100) NOT NULL,
-            last_name VARCHAR(100) NOT NULL,
-            date_of_birth DATE NOT NULL,
-            phone_number VARCHAR(20),
-            email VARCHAR(255),
-            address_id INTEGER,
-            FOREIGN KEY (address_id) REFERENCES address(address_id)
-        );
-    ''')
-
-    # create owner table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS owner (
-            owner_id SERIAL PRIMARY KEY,
-            person_id INTEGER NOT NULL,
-            resident_status VARCHAR(50),
-            acquisition_date DATE,
-            FOREIGN KEY (person_id) REFERENCES person(person_id)
-        );
-    ''')
-
-    # create agent table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS agent (
-            agent_id SERIAL PRIMARY KEY,
-            person_id INTEGER NOT NULL,
-            employment_date DATE NOT NULL,
-            FOREIGN KEY (person_id) REFERENCES person(person_id)
-        );
-    ''')
-
-    # create client table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS client (
-            client_id SERIAL PRIMARY KEY,
-            person_id INTEGER NOT NULL,
-            purchase_date DATE,
-            FOREIGN KEY (person_id) REFERENCES person(person_id)
-        );
-    ''')
-
-    # create location table
-    cur.execute('''
-            CREATE TABLE IF NOT EXISTS location (
-                location_id SERIAL PRIMARY KEY,
-                latitude DECIMAL NOT NULL,
-                longitude DECIMAL NOT NULL
-            );
-        ''')
-
-    # create property table with a foreign key reference to the location table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS property (
-            property_id SERIAL PRIMARY KEY,
-            number_of_rooms INTEGER,
-            building_year INTEGER,
-            area_size DECIMAL,
-            price DECIMAL NOT NULL,
-            location_id INTEGER, -- Foreign key reference to location table
-            owner_id INTEGER NOT NULL, -- New column for owner_id
-            FOREIGN KEY (location_id) REFERENCES location(location_id),
-            FOREIGN KEY (owner_id) REFERENCES owner(owner_id) -- Foreign key reference to owner table
-        );
-    ''')
-
-    # create contract table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS contract (
-            contract_id SERIAL PRIMARY KEY,
-            sign_date DATE NOT NULL,
-            agent_id INTEGER NOT NULL,
-            client_id INTEGER NOT NULL,
-            property_id INTEGER NOT NULL,
-            FOREIGN KEY (agent_id) REFERENCES agent(agent_id),
-            FOREIGN KEY (client_id) REFERENCES client(client_id),
-            FOREIGN KEY (property_id) REFERENCES property(property_id)
-        );
-    ''')
-
-    # create payment table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS payment (
-            payment_id SERIAL PRIMARY KEY,
-            amount DECIMAL NOT NULL,
-            date DATE NOT NULL,
-            contract_id INTEGER NOT NULL,
-            FOREIGN KEY (contract_id) REFERENCES contract(contract_id)
-        );
-    ''')
-
-    # commt the changes to the database and close the connection
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-# function to create a new database with PostgreSQL
-def create_database(db_name):
-    conn_string = POSTGRES_URL + '/postgres' # connection string to connect with the default 'postgres' database
-
-    # connect to the PostgreSQL server
-    conn = psycopg2.connect(conn_string)
-    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT) 
-    cursor = conn.cursor() # create a cursor object
-
-    # check if the database already exists
-    cursor.execute("SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (db_name,))
-    exists = cursor.fetchone()
-
-    # if the database exists, drop it (remove the database)
-    if exists:
-        cursor.execute(f"DROP DATABASE {db_name}")
-
-    # if the database does not exist, then create it
-    cursor.execute(f"CREATE DATABASE {db_name}")
-
-    cursor.close()
-    conn.close()
+    try:
+        created = partitions.ensure(conn)
+    finally:
+        conn.close()
+    if created:
+        current_app.logger.info(f"Created payment partitions: {created}")
+    return created
 
 
 # function to fill database
 def seed_db():
+    cur = None
     try:
         # establish a connection to the database
         conn = get_db_connection()
         cur = conn.cursor()
 
+        # the fixture uses fixed ids, so only seed an empty database
+        cur.execute('SELECT EXISTS (SELECT 1 FROM address)')
+        if cur.fetchone()[0]:
+            print("Database already contains data, skipping seed.")
+            return
+
         # insert data into the address table
         address_values = [
             (101, 'First St', 'Wonderland', '12345'),
@@ -297,283 +208,452 @@ def seed_db():
         print(f"An unexpected error occurred while seeding the database: {e}")
         raise e
     finally:
-        # ensure that the cursor and connection are closed properly
+        # ensure that the cursor is closed properly (the connection goes back to the pool on teardown)
         if cur is not None:
             cur.close()
-        if conn is not None:
-            conn.close()
+
+
+# ------- debug stuff -------
+# show connection pool saturation counters
+@bp.route('/debug/pool')
+def debug_pool():
+    stats = db.get_pool().stats()
+    if db.get_replicas() is not None:
+        stats['read_replicas'] = db.get_replicas().stats()
+    return jsonify(stats)
+
+
+# hit/miss counters of the create_* option list cache
+@bp.route('/debug/lookups')
+def debug_lookups():
+    return jsonify(lookups.get_cache().stats())
+
+
+# request latency, DB/render time, rows per query and pool counters in the Prometheus text format
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+
+# top statements by total and mean time, and the latest slow statements with their plans (POST resets)
+@bp.route('/debug/queries', methods=['GET', 'POST'])
+def debug_queries():
+    log = query_log.get_log()
+    if request.method == 'POST':
+        log.reset()
+        return redirect(url_for('main.debug_queries'))
+
+    by_total, by_mean, slow = log.top('total'), log.top('mean'), list(reversed(log.slow))
+    if request.args.get('format') == 'json':
+        return jsonify(by_total=by_total, by_mean=by_mean, slow=slow)
+    return render_template('debug_queries.html', by_total=by_total, by_mean=by_mean, slow=slow,
+                           slow_ms=current_app.config['QUERY_LOG_SLOW_MS'])
+
+
+# hit/miss counters and memory use of the show_* response cache
+@bp.route('/debug/cache')
+def debug_cache():
+    return jsonify(response_cache.get_cache().stats())
 
 
 # ------- show stuff -------
 # show home
-@app.route('/')
+@bp.route('/')
 def home():
     # redirect to about-us
     return redirect('/about-us ')
 
 # show about-us
-@app.route('/about-us')
+@bp.route('/about-us')
 def about_us():
     return render_template('about_us.html')
 
 # show address
-@app.route('/show_address')
+@bp.route('/show_address')
+@db.replica_reads
+@response_cache.cached('address')
 def show_address():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all address entries
-    cur.execute('SELECT * FROM address;')
-    rows = cur.fetchall() # fetch all rows returned by the query
+    # select one page of address entries
+    page = fetch_page(cur, ADDRESS_LIST_QUERY, 'a.address_id')
 
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    address_entries = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_address.html', address_entries=address_entries)
+    return render_template('show_address.html', address_entries=page.rows, page=page)
 
 
 # show person
-@app.route('/show_person')
+@bp.route('/show_person')
+@db.replica_reads
+@response_cache.cached('person')
 def show_person():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all person entries and relevant columns from the address table, joining them on the address_id
-    cur.execute('''
-        SELECT p.*, a.address_line, a.country, a.postal_code 
-        FROM person p
-        JOIN address a ON p.address_id = a.address_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
+    # select one page of person entries and relevant columns from the address table, joining them on the address_id
+    page = fetch_page(cur, PERSON_LIST_QUERY, 'p.person_id')
 
-    # combine the column names and row values into a list of dictionaries
-    persons = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_person.html', persons=persons)
+    return render_template('show_person.html', persons=page.rows, page=page)
 
 
 # show owner
-@app.route('/show_owner')
+@bp.route('/show_owner')
+@db.replica_reads
+@response_cache.cached('owner')
 def show_owner():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all owner entries and relevant columns from the person and address table, joining them on the person_id and address_id
-    cur.execute('''
-        SELECT o.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line 
-        FROM owner o
-        JOIN person p ON o.person_id = p.person_id
-        JOIN address a ON p.address_id = a.address_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
+    # select one page of owner entries and relevant columns from the person and address table, joining them on the person_id and address_id
+    page = fetch_page(cur, OWNER_LIST_QUERY, 'o.owner_id')
 
-    # combine the column names and row values into a list of dictionaries
-    owners = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_owner.html', owners=owners)
+    return render_template('show_owner.html', owners=page.rows, page=page)
 
 
 # show agent
-@app.route('/show_agent')
+@bp.route('/show_agent')
+@db.replica_reads
+@response_cache.cached('agent')
 def show_agent():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all agent entries and relevant columns from the person and address table, joining them on the person_id and address_id
-    cur.execute('''
-        SELECT ag.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line 
-        FROM agent ag
-        JOIN person p ON ag.person_id = p.person_id
-        JOIN address a ON p.address_id = a.address_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    agents = [dict(zip(columns, row)) for row in rows]
+    # select one page of agent entries and relevant columns from the person and address table, joining them on the person_id and address_id
+    page = fetch_page(cur, AGENT_LIST_QUERY, 'ag.agent_id')
 
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_agent.html', agents=agents)
+    return render_template('show_agent.html', agents=page.rows, page=page)
 
 
 # show client
-@app.route('/show_client')
+@bp.route('/show_client')
+@db.replica_reads
+@response_cache.cached('client')
 def show_client():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all client entries and relevant columns from the person and address table, joining them on the person_id and address_id
-    cur.execute('''
-        SELECT cl.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line 
-        FROM client cl
-        JOIN person p ON cl.person_id = p.person_id
-        JOIN address a ON p.address_id = a.address_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    clients = [dict(zip(columns, row)) for row in rows]
+    # select one page of client entries and relevant columns from the person and address table, joining them on the person_id and address_id
+    page = fetch_page(cur, CLIENT_LIST_QUERY, 'cl.client_id')
 
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_client.html', clients=clients)
+    return render_template('show_client.html', clients=page.rows, page=page)
 
 
 # show location
-@app.route('/show_location')
+@bp.route('/show_location')
+@db.replica_reads
+@response_cache.cached('location')
 def show_location():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
 
-    # select all location entries
-    cur.execute('SELECT * FROM location;')
-    rows = cur.fetchall() # fetch all rows returned by the query
+    # select one page of location entries
+    page = fetch_page(cur, LOCATION_LIST_QUERY, 'l.location_id')
 
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    locations = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_location.html', locations=locations)
+    return render_template('show_location.html', locations=page.rows, page=page)
 
 
 # show property
-@app.route('/show_property')
+@bp.route('/show_property')
+@db.replica_reads
+@response_cache.cached('property')
 def show_property():
     # establish a database connection and create a cursor object
     conn = get_db_connection()
     cur = conn.cursor()
     
-    # select all property entries and relevant columns from the location, owner, and person table, joining them on the location_id, owner_id, and person_id
-    cur.execute('''
-        SELECT p.*, per.first_name, per.last_name, l.latitude, l.longitude
-        FROM property p
-        JOIN location l ON p.location_id = l.location_id
-        JOIN owner o ON p.owner_id = o.owner_id
-        JOIN person per ON o.person_id = per.person_id;  -- Join with person table to get owner name
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    properties = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # select one page of property entries and relevant columns from the location, owner, and person table, joining them on the location_id, owner_id, and person_id
+    page = fetch_page(cur, PROPERTY_LIST_QUERY, 'p.property_id')
+
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_property.html', properties=properties)
+    return render_template('show_property.html', properties=page.rows, page=page)
 
 # show contract
-@app.route('/show_contract')
+@bp.route('/show_contract')
+@db.replica_reads
+@response_cache.cached('contract')
 def show_contract():
-    # establish a database connection and create a cursor object
+    # ?from= and ?to= limit the list to contracts signed in that date range
+    try:
+        conditions, params = date_conditions('c.sign_date', *date_range_args())
+    except ValueError as e:
+        abort(400, str(e))
+    where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    # establish a database connection
     conn = get_db_connection()
+
+    # ?all=1 streams every contract through a server-side cursor instead of rendering one page
+    if request.args.get('all') == '1':
+        contracts = iter_rows(conn, CONTRACT_LIST_QUERY + where + ' ORDER BY c.contract_id', params, name='show_contract')
+        return Response(stream_template('show_contract.html', contracts=contracts, page=None))
+
+    # select one page of contract entries with the agent and client names and the property coordinates
     cur = conn.cursor()
+    page = fetch_page(cur, CONTRACT_LIST_QUERY, 'c.contract_id', params, conditions)
 
-    # select all contract entries and relevant columns from the agent, client, property, and location table, joining them on the agent_id, client_id, property_id, and location_id
-    cur.execute('''
-        SELECT c.contract_id, c.sign_date, 
-               a.first_name AS agent_first_name, a.last_name AS agent_last_name, 
-               cl.first_name AS client_first_name, cl.last_name AS client_last_name, 
-               p.property_id, l.latitude, l.longitude
-        FROM contract c
-        JOIN agent ag ON c.agent_id = ag.agent_id
-        JOIN person a ON ag.person_id = a.person_id
-        JOIN client clt ON c.client_id = clt.client_id
-        JOIN person cl ON clt.person_id = cl.person_id
-        JOIN property p ON c.property_id = p.property_id
-        JOIN location l ON p.location_id = l.location_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
-
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
-
-    # combine the column names and row values into a list of dictionaries
-    contracts = [dict(zip(columns, row)) for row in rows]
-
-    # close the cursor and connection
+    # close the cursor
     cur.close()
-    conn.close()
 
-    return render_template('show_contract.html', contracts=contracts)
+    return render_template('show_contract.html', contracts=page.rows, page=page)
 
 # show payment
-@app.route('/show_payment')
+@bp.route('/show_payment')
+@db.replica_reads
+@response_cache.cached('payment')
 def show_payment():
-    # establish a database connection and create a cursor object
+    # ?from= and ?to= limit the list to payments in that date range, read from the partitions of those years only
+    try:
+        conditions, params = date_conditions('p.date', *date_range_args())
+    except ValueError as e:
+        abort(400, str(e))
+    where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    # establish a database connection
     conn = get_db_connection()
+
+    # ?all=1 streams every payment through a server-side cursor instead of rendering one page
+    if request.args.get('all') == '1':
+        payments = iter_rows(conn, PAYMENT_LIST_QUERY + where + ' ORDER BY p.payment_id', params, name='show_payment')
+        return Response(stream_template('show_payment.html', payments=payments, page=None))
+
+    # select one page of payment entries and relevant columns from the contract table, joining them on the contract_id
     cur = conn.cursor()
+    page = fetch_page(cur, PAYMENT_LIST_QUERY, 'p.payment_id', params, conditions)
+
+    # close the cursor
+    cur.close()
 
-    # select all payment entries and relevant columns from the contract table, joining them on the contract_id
-    cur.execute('''
-        SELECT p.*, c.contract_id 
-        FROM payment p
-        JOIN contract c ON p.contract_id = c.contract_id;
-    ''')
-    rows = cur.fetchall() # fetch all rows returned by the query
+    return render_template('show_payment.html', payments=page.rows, page=page)
+
+
+# ------- search stuff -------
+# search properties by price/area/year/rooms/owner filters with facet counts,
+# or within a radius of a point or inside a bounding box, nearest first
+@bp.route('/search_property')
+@db.replica_reads
+def search_property():
+    args = request.args
+    lat, lon, radius_km = args.get('lat', type=float), args.get('lon', type=float), args.get('radius_km', type=float)
+    box = [args.get(name, type=float) for name in ('min_lat', 'max_lat', 'min_lon', 'max_lon')]
+    limit = max(1, min(args.get('limit', 50, type=int), 500))
+    geo_args = [args.get(name) for name in ('lat', 'lon', 'radius_km', 'min_lat', 'max_lat', 'min_lon', 'max_lon')]
+    filters = facets.read_filters(args)
+    conditions = facets.filter_conditions(filters)
+    properties, page, facet, error = None, None, None, None
+
+    if lat is not None and lon is not None and radius_km is not None:
+        # radius search: box around the circle for the index, exact haversine distance for the result
+        if not 0 < radius_km <= 500:
+            error = 'radius_km must be between 0 and 500'
+        else:
+            box = geo.bounding_box(lat, lon, radius_km)
+    elif None not in box:
+        # box search: results are sorted by their distance to the centre of the box
+        if box[0] > box[1] or box[2] > box[3]:
+            error = 'min_lat/min_lon must not be larger than max_lat/max_lon'
+        lat, lon, radius_km = (box[0] + box[1]) / 2, (box[2] + box[3]) / 2, None
+    elif any(geo_args):
+        error = 'give lat, lon and radius_km, or min_lat, max_lat, min_lon and max_lon'
+
+    cur = get_db_connection().cursor()
+    if error is None and None not in box:
+        properties = geo.search_properties(cur, lat, lon, box, radius_km=radius_km, limit=limit,
+                                           conditions=conditions, params=filters)
+    elif error is None and filters:
+        # filter search: one keyset page of matches plus facet counts from the aggregate table
+        page = fetch_page(cur, PROPERTY_LIST_QUERY, 'p.property_id', filters, conditions)
+        properties = page.rows
+        facet = facets.facet_counts(cur, filters)
+    cur.close()
 
-    # extract the column names from the cursor object
-    columns = [desc[0] for desc in cur.description]
+    if args.get('format') == 'json':
+        if error:
+            return jsonify(error=error), 400
+        result = {'properties': properties or []}
+        if page is not None:
+            result.update(next=page.next_token, prev=page.prev_token, facets=facet)
+        return jsonify(result)
+    return render_template('search_property.html', properties=properties, page=page, facets=facet, error=error)
+
+
+
+# find persons by name, email or phone number (?q=, optionally ?role=owner|agent|client), best matches first
+@bp.route('/search_person')
+@db.replica_reads
+def search_person():
+    q = request.args.get('q', '')
+    role = request.args.get('role') or None
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    if role is not None and role not in person_search.ROLES:
+        error = f"role must be one of {', '.join(person_search.ROLES)}"
+        if request.args.get('format') == 'json':
+            return jsonify(error=error), 400
+        return render_template('search_person.html', persons=None, roles=person_search.ROLES, error=error)
+
+    cur = get_db_connection().cursor()
+    persons = person_search.search(cur, q, role=role, limit=limit)
+    cur.close()
 
-    # combine the column names and row values into a list of dictionaries
-    payments = [dict(zip(columns, row)) for row in rows]
+    if request.args.get('format') == 'json':
+        return jsonify(persons=persons)
+    return render_template('search_person.html', persons=persons if q.strip() else None, roles=person_search.ROLES, error=None)
+
+# ------- reports -------
+# overview of the reports with the revenue of the latest month
+@bp.route('/reports')
+@db.replica_reads
+def reports_index():
+    cur = get_db_connection().cursor()
+    month = reports.latest_month(cur)
+    total = reports.month_total(cur, month) if month else None
+    cur.close()
+    return render_template('reports.html', month=month, total=total)
 
-    # close the cursor and connection
+
+# paid-to-date and outstanding balance per contract, one keyset page at a time
+@bp.route('/reports/balances')
+@db.replica_reads
+def report_balances():
+    # ?from= and ?to= keep contracts signed in that date range, ?outstanding=1 only those that are not fully paid
+    try:
+        conditions, params = date_conditions('c.sign_date', *date_range_args())
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify(error=str(e)), 400
+        abort(400, str(e))
+    if request.args.get('outstanding'):
+        conditions.append('pr.price - b.paid > 0')
+
+    cur = get_db_connection().cursor()
+    page = fetch_page(cur, reports.CONTRACT_BALANCE_QUERY, 'b.contract_id', params, conditions)
     cur.close()
-    conn.close()
 
-    return render_template('show_payment.html', payments=payments)
+    if request.args.get('format') == 'json':
+        return jsonify(balances=page.rows, next=page.next_token, prev=page.prev_token)
+    return render_template('report_balances.html', balances=page.rows, page=page)
 
 
+# revenue per agent for one month (?month=YYYY-MM, latest by default), or the monthly history of one agent (?agent_id=,
+# optionally limited to the months of ?from= and ?to=)
+@bp.route('/reports/agent_revenue')
+@db.replica_reads
+def report_agent_revenue():
+    agent_id = request.args.get('agent_id', type=int)
+    month, total, page, revenue = None, None, None, []
+    try:
+        date_from, date_to = date_range_args()
+    except ValueError as e:
+        if request.args.get('format') == 'json':
+            return jsonify(error=str(e)), 400
+        abort(400, str(e))
+
+    cur = get_db_connection().cursor()
+    if agent_id is not None:
+        revenue = reports.agent_history(cur, agent_id, date_from=date_from, date_to=date_to)
+    else:
+        month = reports.read_month(request.args.get('month')) or reports.latest_month(cur)
+        if month is not None:
+            page = fetch_page(cur, reports.AGENT_REVENUE_QUERY, 'r.agent_id', (month,), ['r.month = %s', 'r.payments > 0'])
+            revenue = page.rows
+            total = reports.month_total(cur, month)
+    cur.close()
+
+    if request.args.get('format') == 'json':
+        result = {'month': month, 'total': total, 'revenue': revenue}
+        if page is not None:
+            result.update(next=page.next_token, prev=page.prev_token)
+        return jsonify(result)
+    return render_template('report_agent_revenue.html', revenue=revenue, month=month, total=total, page=page)
+
+
+
+# market statistics: price and price/m² quartiles overall and per room count (?group=rooms),
+# building-year band (?group=year&band=10) or grid cell (?group=grid&cell=1.0, busiest first)
+@bp.route('/analytics')
+def market_analytics():
+    group = request.args.get('group', 'rooms')
+    band = max(1, min(request.args.get('band', 10, type=int), 100))
+    cell = max(0.1, min(request.args.get('cell', 1.0, type=float), 30.0))
+    min_count = max(1, request.args.get('min_count', 1, type=int))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 10000))
+    if group not in analytics.GROUPS:
+        error = f"group must be one of {', '.join(analytics.GROUPS)}"
+        if request.args.get('format') == 'json':
+            return jsonify(error=error), 400
+        group = 'rooms'
+
+    cache = analytics.get_cache()
+    conn = get_db_connection()
+    snapshot, summary = cache.report(conn)
+    _, rows = cache.report(conn, group, band=band, cell_degrees=cell, min_count=min_count)
+
+    info = {'properties': snapshot.rows, 'loaded_at': snapshot.loaded_at, 'load_seconds': round(snapshot.load_seconds, 3)}
+    if request.args.get('format') == 'json':
+        return jsonify(snapshot=info, summary=summary[0] if summary else None, group=group, rows=rows[:limit])
+    return render_template('analytics.html', snapshot=info, summary=summary[0] if summary else None, group=group,
+                           rows=rows[:limit], groups=analytics.GROUPS)
+
+# the most similar properties to one property (?k=, at most 50), with the price they suggest
+@bp.route('/property/<int:property_id>/comparables')
+def property_comparables(property_id):
+    k = max(1, min(request.args.get('k', 10, type=int), 50))
+    conn = get_db_connection()
+    cur = conn.cursor()
+    target = comparables.read_target(cur, property_id=property_id)
+    cur.close()
+    if target is None:
+        abort(404)
+
+    result = comparables.get_cache().find(conn, target, k=k, exclude_id=property_id)
+    if request.args.get('format') == 'json':
+        return jsonify(property_id=property_id, target=target, **result)
+    return render_template('property_comparables.html', property_id=property_id, target=target, **result)
+
+# download a whole table (contract, payment) as CSV or Parquet (?format=parquet), streamed straight from COPY;
+# ?gzip=1 compresses the file, ?from= and ?to= limit it to a date range (to is exclusive)
+@bp.route('/export/<entity>')
+@db.replica_reads
+def export_entity(entity):
+    try:
+        chunks, filename, media_type = export.export_chunks(
+            get_db_connection(), entity, format=request.args.get('format', 'csv'),
+            compress=request.args.get('gzip') == '1',
+            date_from=export.parse_date(request.args.get('from'), 'from'),
+            date_to=export.parse_date(request.args.get('to'), 'to'))
+    except export.ExportError as e:
+        return jsonify(error=str(e)), 404 if entity not in export.EXPORTS else 400
+    return Response(stream_with_context(chunks), mimetype=media_type,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 # ------- create stuff --------
 # create address
-@app.route('/create_address', methods=['GET', 'POST'])
+@bp.route('/create_address', methods=['GET', 'POST'])
 def create_address():
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
@@ -591,16 +671,15 @@ def create_address():
         cur.execute('INSERT INTO address (street_number, address_line, country, postal_code) VALUES (%s, %s, %s, %s)',
                     (street_number, address_line, country, postal_code))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_address'))
+        return redirect(url_for('main.show_address'))
     return render_template('create_address.html')
 
 # create person
-@app.route('/create_person', methods=['GET', 'POST'])
+@bp.route('/create_person', methods=['GET', 'POST'])
 def create_person():
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
@@ -622,29 +701,19 @@ def create_person():
             VALUES (%s, %s, %s, %s, %s, %s)
         ''', (first_name, last_name, date_of_birth, phone_number, email, address_id))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_person'))
-  
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
+        return redirect(url_for('main.show_person'))
 
-    # select all address entries from the address table
-    cur.execute('SELECT address_id, address_line FROM address;')
+    # address options, cached between requests
+    addresses = lookups.options('addresses')
 
-    # fetch all rows returned by the query and close the cursor and connection
-    addresses = cur.fetchall()
-    cur.close()
-    conn.close()
-    
     return render_template('create_person.html', addresses=addresses)
 
 # create owner
-@app.route('/create_owner', methods=['GET', 'POST'])
+@bp.route('/create_owner', methods=['GET', 'POST'])
 def create_owner():
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
@@ -663,89 +732,71 @@ def create_owner():
             VALUES (%s, %s, %s)
         ''', (person_id, resident_status, acquisition_date))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_owner'))
-
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
+        return redirect(url_for('main.show_owner'))
 
-    # select all person entries from the person table
-    cur.execute('SELECT person_id, first_name, last_name FROM person;')
+    # person options, cached between requests
+    persons = lookups.options('persons')
 
-    # fetch all rows returned by the query and close the cursor and connection
-    persons = cur.fetchall()
-    cur.close()
-    conn.close()
-    
     return render_template('create_owner.html', persons=persons)
 
 # create agent
-@app.route('/create_agent', methods=['GET', 'POST'])
+@bp.route('/create_agent', methods=['GET', 'POST'])
 def create_agent():
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
-
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
         # retrieve form data from the request object
         person_id = request.form['person_id']
         employment_date = request.form['employment_date']
 
+        # establish a database connection and create a cursor object
+        conn = get_db_connection()
+        cur = conn.cursor()
+
         # insert the form data into the agent table
         cur.execute('''
             INSERT INTO agent (person_id, employment_date) 
             VALUES (%s, %s)
         ''', (person_id, employment_date))
         conn.commit() # commit changes to the database
+        cur.close()
 
-    # select all person entries from the person table
-    cur.execute('SELECT person_id, first_name, last_name FROM person;')
-
-    # fetch all rows returned by the query and close the cursor and connection
-    persons = cur.fetchall()
-    cur.close()
-    conn.close()
+    # person options, cached between requests
+    persons = lookups.options('persons')
 
     return render_template('create_agent.html', persons=persons)
 
 # create client
-@app.route('/create_client', methods=['GET', 'POST'])
+@bp.route('/create_client', methods=['GET', 'POST'])
 def create_client():
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # select all person entries from the person table
-    cur.execute('SELECT person_id, first_name, last_name FROM person;')
-    persons = cur.fetchall() # fetch all rows returned by the query
-
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
         # retrieve form data from the request object
         person_id = request.form['person_id']
         purchase_date = request.form['purchase_date']
 
+        # establish a database connection and create a cursor object
+        conn = get_db_connection()
+        cur = conn.cursor()
+
         # insert the form data into the client table
         cur.execute('''
             INSERT INTO client (person_id, purchase_date) 
             VALUES (%s, %s)
         ''', (person_id, purchase_date))
         conn.commit() # commit changes to the database
+        cur.close()
 
-    # close the cursor and connection
-    cur.close()
-    conn.close()
+    # person options, cached between requests
+    persons = lookups.options('persons')
 
     return render_template('create_client.html', persons=persons)
 
 # create location
-@app.route('/create_location', methods=['GET', 'POST'])
+@bp.route('/create_location', methods=['GET', 'POST'])
 def create_location():
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
@@ -761,33 +812,16 @@ def create_location():
         cur.execute('INSERT INTO location (latitude, longitude) VALUES (%s, %s)',
                     (latitude, longitude))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_location')) 
+        return redirect(url_for('main.show_location')) 
     return render_template('create_location.html')
 
 # create property
-@app.route('/create_property', methods=['GET', 'POST'])
+@bp.route('/create_property', methods=['GET', 'POST'])
 def create_property():
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # select all location entries from the location table
-    cur.execute('SELECT location_id, latitude, longitude FROM location;')
-    locations = cur.fetchall() # fetch all rows returned by the query
-
-    # select all owner entries from the owner table
-    cur.execute('''
-        SELECT o.owner_id, p.first_name || ' ' || p.last_name AS owner_name
-        FROM owner o
-        JOIN person p ON o.person_id = p.person_id;
-    ''')
-    owners = cur.fetchall() # fetch all rows returned by the query
-    
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
         # retrieve form data from the request object
@@ -798,28 +832,31 @@ def create_property():
         location_id = request.form['location_id']
         owner_id = request.form['owner_id'] 
 
+        # establish a database connection and create a cursor object
+        conn = get_db_connection()
+        cur = conn.cursor()
+
         # insert the form data into the property table
         cur.execute('''
             INSERT INTO property (number_of_rooms, building_year, area_size, price, location_id, owner_id) 
             VALUES (%s, %s, %s, %s, %s, %s)
         ''', (number_of_rooms, building_year, area_size, price, location_id, owner_id))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_property'))
+        return redirect(url_for('main.show_property'))
 
-    # close the cursor and connection
-    cur.close()
-    conn.close()
+    # location and owner options, cached between requests
+    locations = lookups.options('locations')
+    owners = lookups.options('owners')
 
     return render_template('create_property.html', locations=locations, owners=owners)
 
 
 # create contract
-@app.route('/create_contract', methods=['GET', 'POST'])
+@bp.route('/create_contract', methods=['GET', 'POST'])
 def create_contract():
     # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
@@ -839,43 +876,31 @@ def create_contract():
             VALUES (%s, %s, %s, %s)
         ''', (sign_date, agent_id, client_id, property_id))
 
-        # commit changes to the database and close the cursor and connection
+        # commit changes to the database and close the cursor
         conn.commit()
         cur.close()
-        conn.close()
         
-        return redirect(url_for('show_contract'))
-
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
+        return redirect(url_for('main.show_contract'))
 
-    # select all agent, client and property entries from the agent, client and property tables
-    cur.execute('SELECT agent_id, first_name, last_name FROM agent JOIN person ON agent.person_id = person.person_id;')
-    agents = cur.fetchall()
-    cur.execute('SELECT client_id, first_name, last_name FROM client JOIN person ON client.person_id = person.person_id;')
-    clients = cur.fetchall()
-    cur.execute('SELECT property_id, location FROM property;')
-
-    # fetch all rows returned by the query and close the cursor and connection
-    properties = cur.fetchall()
-    cur.close()
-    conn.close()
+    # agent, client and property options, cached between requests
+    agents = lookups.options('agents')
+    clients = lookups.options('clients')
+    properties = lookups.options('properties')
 
     return render_template('create_contract.html', agents=agents, clients=clients, properties=properties)
 
 # create payment
-@app.route('/create_payment', methods=['GET', 'POST'])
+@bp.route('/create_payment', methods=['GET', 'POST'])
 def create_payment():
-    # establish a database connection and create a cursor object
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    # select all contract entries from the contract table
+    # check if the request method is POST, which means the form has been submitted
     if request.method == 'POST':
         amount = request.form['amount']
         date = request.form['date']
         contract_id = request.form['contract_id']
+
+        # establish a database connection and create a cursor object
+        conn = get_db_connection()
+        cur = conn.cursor()
         
         # insert the form data into the payment table
         cur.execute('''
@@ -883,21 +908,381 @@ def create_payment():
             VALUES (%s, %s, %s)
         ''', (amount, date, contract_id))
         conn.commit() # commit changes to the database
+        cur.close()
+
+    # contract options, cached between requests
+    contracts = lookups.options('contracts')
 
-    # select all contract entries from the contract table
-    cur.execute('SELECT contract_id FROM contract;')
-    contracts = cur.fetchall() # fetch all rows returned by the query
+    return render_template('create_payment.html', contracts=contracts)
+
+
+# function to tell whether a batch/schedule request wants a JSON answer (JSON or CSV body, or ?format=json)
+def wants_json():
+    return request.is_json or request.mimetype == 'text/csv' or request.args.get('format') == 'json'
+
+
+# enter many payments at once: form rows, a JSON body or CSV (upload or body), inserted with one statement
+@bp.route('/create_payments', methods=['GET', 'POST'])
+def create_payments():
+    rows, result, error = [], None, None
 
-    # close the cursor and connection
+    if request.method == 'POST':
+        try:
+            if request.is_json:
+                rows = payments.rows_from_json(request.get_json(silent=True))
+            elif request.mimetype == 'text/csv':
+                rows = payments.rows_from_csv(request.get_data(as_text=True))
+            elif request.files.get('file'):
+                rows = payments.rows_from_csv(request.files['file'].read().decode('utf-8-sig'))
+            else:
+                rows = payments.rows_from_form(request.form)
+            result = payments.insert_batch(get_db_connection(), rows)
+        except ValueError as e:
+            error = str(e)
+
+        if wants_json():
+            if error:
+                return jsonify(error=error), 400
+            return jsonify(inserted=result['inserted'],
+                           rejected=[{'row': row, 'reason': reason} for row, reason in result['rejected']]), \
+                201 if result['inserted'] else 422
+
+    # rejected batches are shown again so they can be corrected; accepted ones start from empty rows
+    if result is None or not result['rejected']:
+        rows = []
+    return render_template('create_payments.html', contracts=lookups.options('contracts'), rows=rows,
+                           result=result, error=error, frequencies=payments.FREQUENCIES)
+
+
+# generate the installments of a contract (contract_id, installments, start, frequency, optional total)
+@bp.route('/create_schedule', methods=['POST'])
+def create_schedule():
+    fields = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(fields, dict):
+        return jsonify(error='expected a JSON object'), 400
+    schedule = payments.create_schedule(get_db_connection(), fields.get('contract_id'), fields.get('installments'),
+                                        fields.get('start'), fields.get('frequency'), fields.get('total'))
+
+    if wants_json():
+        if schedule['errors']:
+            return jsonify(errors=schedule['errors']), 422
+        return jsonify(inserted=[{'payment_id': payment_id, 'amount': amount, 'date': date.isoformat()}
+                                 for payment_id, amount, date in schedule['inserted']]), 201
+    return render_template('create_payments.html', contracts=lookups.options('contracts'), rows=[],
+                           schedule=schedule, frequencies=payments.FREQUENCIES)
+
+
+# typeahead for option lists too long to inline in a form
+@bp.route('/lookup/<name>')
+def lookup(name):
+    if name not in lookups.LOOKUPS:
+        return jsonify({'error': f'unknown lookup {name}'}), 404
+    rows = lookups.search(name, request.args.get('q', ''), after=request.args.get('after', type=int),
+                          limit=max(1, min(request.args.get('limit', 20, type=int), 100)))
+    return jsonify([{'id': row[0], 'label': row[1]} for row in rows])
+
+
+# ------- bulk import --------
+# import persons, properties or payments from an uploaded CSV file
+@bp.route('/import', methods=['GET', 'POST'])
+def import_csv():
+    result = None
+    error = None
+    selected = request.form.get('entity')
+
+    # check if the request method is POST, which means a file has been uploaded
+    if request.method == 'POST':
+        try:
+            # the upload is streamed into COPY, it is never read into memory as a whole
+            result = bulk_import.import_csv(get_db_connection(), selected, request.files['file'].stream)
+        except (bulk_import.CSVImportError, psycopg2.Error) as e:
+            error = str(e)
+
+    return render_template('import_csv.html', imports=bulk_import.IMPORTS, selected=selected, result=result, error=error)
+
+
+# ------- commands -------
+# flask migrate: apply pending schema migrations
+@bp.cli.command('migrate')
+def migrate_command():
+    created = setup_db()
+    print(f"Database schema is at version {migrations.LATEST_VERSION}.")
+    if created:
+        print(f"Created payment partitions: {', '.join(created)}.")
+
+# flask rebuild-reports: recompute the reporting aggregates from payment/contract
+@bp.cli.command('rebuild-reports')
+def rebuild_reports_command():
+    contracts, months = reports.rebuild(get_db_connection())
+    print(f"Rebuilt balances of {contracts} contracts and {months} agent/month revenue rows.")
+
+# flask rebuild-listings: recompute the property and contract listing projections from their base tables
+@bp.cli.command('rebuild-listings')
+def rebuild_listings_command():
+    rows = listings.rebuild(get_db_connection())
+    print(f"Rebuilt {rows['property_listing']} property and {rows['contract_listing']} contract listing rows.")
+
+# flask check-listings: fail when a listing projection has drifted from its base tables
+@bp.cli.command('check-listings')
+def check_listings_command():
+    drifted = False
+    for table, drift in listings.check(get_db_connection()).items():
+        for kind, count in drift['counts'].items():
+            if count:
+                drifted = True
+                print(f"{table}: {count} {kind} row(s), e.g. ids {', '.join(map(str, drift[kind]))}")
+    if drifted:
+        print("Run `flask rebuild-listings` to repair the projections.")
+        raise SystemExit(1)
+    print(f"All {len(listings.PROJECTIONS)} listing projections match their base tables.")
+
+# flask create-partitions: create the payment partitions of the coming years; start-up already does, so a yearly cron
+# run is only a backstop for servers that stay up across New Year
+@bp.cli.command('create-partitions')
+@click.option('--ahead', type=int, help='years after the current one, default PAYMENT_PARTITIONS_AHEAD')
+def create_partitions_command(ahead):
+    created = partitions.ensure(get_db_connection(), years_ahead=ahead)
+    print(f"Created {len(created)} payment partition(s){': ' + ', '.join(created) if created else ''}.")
+    for partition in partitions.list_partitions(get_db_connection().cursor()):
+        print(f"{partition['name']}: {partition['bounds']}, ~{partition['rows']} rows, {partition['bytes'] / 1024 / 1024:.1f} MB")
+
+# flask archive-payments YEAR: detach the payments of one year into the payment_archive schema (or drop them)
+@bp.cli.command('archive-payments')
+@click.argument('year', type=int)
+@click.option('--drop', is_flag=True, help='drop the partition instead of keeping it in payment_archive')
+def archive_payments_command(year, drop):
+    try:
+        rows = partitions.archive(get_db_connection(), year, drop=drop)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    where = 'Dropped' if drop else f'Moved to {partitions.ARCHIVE_SCHEMA}.{partitions.partition_name(year)}:'
+    print(f"{where} {rows} payment(s) of {year}.")
+
+# flask benchmark-partitions: show that date-bounded payment queries stay flat while the history grows
+@bp.cli.command('benchmark-partitions')
+@click.option('--years', default=8, show_default=True, help='years of history to add, one at a time')
+@click.option('--rows-per-year', default=250000, show_default=True, help='synthetic payments per added year')
+@click.option('--runs', default=5, show_default=True, help='timed runs per query and step (median)')
+def benchmark_partitions_command(years, rows_per_year, runs):
+    try:
+        partitions.benchmark(get_db_connection(), years=years, rows_per_year=rows_per_year, runs=runs)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+# flask seed-db: fill an empty database with the sample data (opt-in, never runs on start-up)
+@bp.cli.command('seed-db')
+def seed_db_command():
+    setup_db()
+    seed_db()
+    # the sample payments are from past years, which start-up does not create partitions for
+    partitions.ensure(get_db_connection())
+
+# flask check-plans: fail when a route query regresses to a sequential scan on a large dataset (used in CI)
+@bp.cli.command('check-plans')
+@click.option('--rows', default=50000, show_default=True, help='synthetic rows per table, rolled back afterwards')
+def check_plans_command(rows):
+    failures = query_plans.check_plans(get_db_connection(), n=rows)
+    for name, tables in failures:
+        print(f"FAIL {name}: sequential scan on {', '.join(tables)}")
+    if failures:
+        raise SystemExit(1)
+    print(f"All {len(query_plans.PLAN_CHECKS)} query plans use index scans.")
+
+# flask import-csv ENTITY PATH: bulk import a CSV file through COPY
+@bp.cli.command('import-csv')
+@click.argument('entity', type=click.Choice(list(bulk_import.IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_csv_command(entity, path):
+    result = bulk_import.import_file(get_db_connection(), entity, path)
+    for line, reason in result['rejected']:
+        print(f"line {line}: {reason}")
+    rate = result['inserted'] / result['seconds'] if result['seconds'] else 0
+    print(f"Imported {result['inserted']} {entity} row(s), rejected {len(result['rejected'])} "
+          f"in {result['seconds']:.2f}s ({rate:,.0f} rows/s).")
+
+# flask export ENTITY PATH: write a table to a CSV or Parquet file through COPY
+@bp.cli.command('export')
+@click.argument('entity', type=click.Choice(list(export.EXPORTS)))
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'format_', type=click.Choice(export.FORMATS), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='gzip the file')
+@click.option('--from', 'date_from', type=click.DateTime(['%Y-%m-%d']), help='first date to include')
+@click.option('--to', 'date_to', type=click.DateTime(['%Y-%m-%d']), help='first date to leave out')
+def export_command(entity, path, format_, compress, date_from, date_to):
+    started = time.perf_counter()
+    chunks, _, _ = export.export_chunks(get_db_connection(), entity, format=format_, compress=compress,
+                                        date_from=date_from and date_from.date(), date_to=date_to and date_to.date())
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+    print(f"Exported {entity} to {path} ({size / 1e6:,.1f} MB) in {time.perf_counter() - started:.2f}s.")
+
+# flask build-assets: fingerprint the static files, resize images and precompress text assets
+@bp.cli.command('build-assets')
+def build_assets_command():
+    manifest = assets.build(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR'])
+    for name, entry in manifest.items():
+        variants = ', '.join(f"{v['width']}w {v['type'].split('/')[1]} {v['bytes'] / 1024:.0f} KB"
+                             for v in entry.get('variants', []))
+        print(f"{name} -> {entry['path']} ({entry['bytes'] / 1024:.0f} KB){': ' + variants if variants else ''}")
+    print(f"Built {len(manifest)} asset(s) into {current_app.config['ASSETS_BUILD_DIR']}.")
+
+# flask check-replicas: show whether every read replica is reachable, in recovery, and how far it lags
+@bp.cli.command('check-replicas')
+def check_replicas_command():
+    failed = False
+    for dsn in current_app.config['DATABASE_REPLICA_URLS']:
+        try:
+            conn = psycopg2.connect(dsn, connect_timeout=5)
+            cur = conn.cursor()
+            cur.execute('''
+                SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text,
+                       EXTRACT(epoch FROM now() - pg_last_xact_replay_timestamp())
+            ''')
+            standby, lsn, lag = cur.fetchone()
+            conn.close()
+        except psycopg2.Error as e:
+            print(f"{db.redact(dsn)}: unreachable ({str(e).strip()})")
+            failed = True
+            continue
+        if standby:
+            print(f"{db.redact(dsn)}: standby, replayed up to {lsn}, last replayed transaction {lag or 0:.1f}s ago")
+        else:
+            print(f"{db.redact(dsn)}: not a standby; reads after a write stay on the primary")
+    if not current_app.config['DATABASE_REPLICA_URLS']:
+        print("No read replicas configured (DATABASE_REPLICA_URLS).")
+    if failed:
+        raise SystemExit(1)
+
+# flask generate-data: load a synthetic, referentially consistent dataset through COPY
+@bp.cli.command('generate-data')
+@click.option('--scale', type=click.Choice(list(synthetic.SCALES)), default='small', show_default=True,
+              help='small = 10k, medium = 1M, large = 10M properties')
+@click.option('--properties', type=int, help='number of properties, overrides --scale')
+@click.option('--seed', default=1, show_default=True, help='random seed, the same seed gives the same dataset')
+def generate_data_command(scale, properties, seed):
+    properties = properties or synthetic.SCALES[scale]
+    print(f"Generating {properties} properties: {synthetic.DatasetGenerator(properties).counts()}")
+    # partitions for the whole history first, so the payments are not copied out of payment_default afterwards
+    partitions.ensure(get_db_connection(), first_year=synthetic.FIRST_SIGN_DATE.year)
+    synthetic.load_dataset(get_db_connection(), properties, seed=seed)
+
+# flask benchmark: drive every route and report latency percentiles, throughput and RSS
+@bp.cli.command('benchmark')
+@click.option('--requests', 'requests_per_route', default=100, show_default=True, help='requests per route')
+@click.option('--concurrency', default=1, show_default=True, help='concurrent client threads')
+@click.option('--url', help='benchmark a running server (e.g. http://localhost:5001) instead of the test client')
+@click.option('--server-pid', type=int, help='pid of the server process whose RSS is reported (with --url)')
+@click.option('--streaming', is_flag=True, help='also drive the full-table ?all=1 views')
+@click.option('--route', 'routes', multiple=True, help='only drive these routes (repeatable)')
+@click.option('--output', type=click.Path(dir_okay=False), help='save the results as JSON')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='compare against a saved JSON run')
+def benchmark_command(requests_per_route, concurrency, url, server_pid, streaming, routes, output, baseline):
+    # paginated routes are also measured deep into the table
+    cur = get_db_connection().cursor()
+    middle = {}
+    for table in ('person', 'property', 'contract', 'payment'):
+        cur.execute(f'SELECT COALESCE((MIN({table}_id) + MAX({table}_id)) / 2, 0) FROM {table}')
+        middle[f'middle_{table}'] = cur.fetchone()[0]
     cur.close()
-    conn.close()
+    get_db_connection().rollback()
+    routes = [route.format(**middle) for route in (routes or benchmark.ROUTES + (benchmark.STREAMING_ROUTES if streaming else []))]
 
-    return render_template('create_payment.html', contracts=contracts)
+    get = benchmark.http_driver(url) if url else benchmark.test_client_driver(current_app._get_current_object())
+    result = benchmark.run(get, routes, requests_per_route=requests_per_route, concurrency=concurrency, server_pid=server_pid)
+    result['meta'].update(mode='http' if url else 'test_client', url=url, dataset=middle)
+
+    if output:
+        benchmark.save(result, output)
+        print(f"Saved results to {output}")
+    if baseline:
+        benchmark.compare(benchmark.load(baseline), result)
+
+# flask check-startup: measure the cold start of a fresh interpreter (import and create_app) against the budget
+@bp.cli.command('check-startup')
+@click.option('--runs', default=5, show_default=True, help='fresh interpreters to start')
+def check_startup_command(runs):
+    budget = current_app.config['STARTUP_BUDGET_MS']
+    probe = 'import time; t = time.perf_counter(); import app; app.create_app(); print((time.perf_counter() - t) * 1000)'
+    timings = sorted(float(subprocess.check_output([sys.executable, '-c', probe], cwd=basedir, text=True))
+                     for _ in range(runs))
+    print(f"Cold start over {runs} runs: median {timings[len(timings) // 2]:.0f}ms, max {timings[-1]:.0f}ms "
+          f"(budget {budget}ms)")
+    if timings[len(timings) // 2] > budget:
+        raise SystemExit(1)
+
+
+# ----- application factory -----
+# function to create and configure an app; does no I/O, database connections are opened on first use
+def create_app(config=None):
+    """Build the Flask app for the dev server, ``flask`` commands and the WSGI server.
+
+    Nothing here touches the database, so the app can be imported and
+    preloaded in a pre-forking server: each worker opens its own pool
+    connections lazily after the fork. Schema migrations run separately
+    (``flask migrate``, or once in the gunicorn master before workers start).
+    """
+    started = time.perf_counter()
+    app = Flask(__name__) # create the flask app
+    app.logger.setLevel(logging.DEBUG) # set the logging level to DEBUG
+    app.config['DATABASE_URL'] = DATABASE_URL
+    app.config.setdefault('STARTUP_BUDGET_MS', int(os.environ.get('STARTUP_BUDGET_MS', 1000)))
+    app.config.update(config or {})
+
+    # connection pool: one checkout per request, returned to the pool on app context teardown
+    db.init_app(app)
+
+    # cached option lists of the create_* forms, see lookups.py
+    lookups.init_app(app)
+
+    # size limits of batch payment entry and installment schedules
+    payments.init_app(app)
+
+    # chunk and row group sizes of the streamed /export downloads
+    export.init_app(app)
+
+    # years of payment partitions created ahead by `flask migrate` and `flask create-partitions`
+    partitions.init_app(app)
+
+    # in-memory property snapshot for /analytics
+    analytics.init_app(app)
+
+    # array-backed nearest-neighbour index of properties for comparables and suggested prices
+    comparables.init_app(app)
+
+    # request, render, query and pool metrics for /metrics
+    metrics.init_app(app)
+
+    # per-statement timings and slow query log for /debug/queries
+    query_log.init_app(app)
+
+    # rendered show_* pages, reused until one of their tables changes
+    response_cache.init_app(app)
+
+    # gzip/brotli for large responses
+    compression.init_app(app)
+
+    # fingerprinted static files and image variants from `flask build-assets`, see assets.py
+    assets.init_app(app)
+
+    # ISO 8601 dates in every JSON response (the API and the ?format=json views)
+    app.json = api.JSONProvider(app)
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(assets.bp)
 
+    # time to build the app, the interpreter start and imports come on top (see flask check-startup)
+    app.config['STARTUP_MS'] = (time.perf_counter() - started) * 1000
+    if app.config['STARTUP_MS'] > app.config['STARTUP_BUDGET_MS']:
+        app.logger.warning(f"create_app took {app.config['STARTUP_MS']:.0f}ms, over the {app.config['STARTUP_BUDGET_MS']}ms budget")
+    return app
 
-with app.app_context():
-    setup_db()  # set up the database and create tables
-    seed_db()   # seed the database with initial data
 
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        setup_db()  # single schema version check, migrates only when the schema is behind; creates due payment partitions
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,263 @@
+# ----- imports -----
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+import threading
+from flask import Blueprint, current_app, request, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# Pillow is optional; without it images are fingerprinted but get no resized or WebP variants
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# brotli is optional; without it text assets are precompressed with gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ----- settings -----
+# widths of the resized image variants; widths above the original are skipped
+IMAGE_WIDTHS = (160, 320, 640, 1280)
+
+# image types that get variants, with the Pillow format and save options of their own-format copies
+IMAGE_FORMATS = {
+    '.jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    '.jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    '.png': ('PNG', {'optimize': True}),
+}
+WEBP_OPTIONS = {'quality': 80, 'method': 6}
+
+# text assets stored precompressed next to the original
+TEXT_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.map', '.html')
+
+# served fingerprinted files never change, so clients may keep them for a year without revalidating
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+MANIFEST = 'manifest.json'
+
+
+# ----- build -----
+# function to return the fingerprinted name of a file: name.<first 12 hex digits of its sha256>.ext
+def fingerprint(name, data, suffix=''):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}{ext}'
+
+
+# function to write a file below the build directory, creating its directory
+def write_file(build_dir, name, data):
+    path = os.path.join(build_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+# function to encode an image in a format with Pillow
+def encode_image(image, image_format, options):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+# function to build the resized and WebP variants of an image, returning their manifest entries
+def image_variants(build_dir, name, data, widths=IMAGE_WIDTHS):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    width, height = image.size
+    image_format, options = IMAGE_FORMATS[os.path.splitext(name)[1].lower()]
+    stem = os.path.splitext(name)[0]
+
+    variants = []
+    for w in sorted({w for w in widths if w < width} | {width}):
+        resized = image if w == width else image.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+        encoded = [('image/webp', encode_image(resized, 'WEBP', WEBP_OPTIONS), '.webp')]
+        if w < width: # the original already serves the full width in its own format
+            encoded.append((Image.MIME[image_format], encode_image(resized, image_format, options), os.path.splitext(name)[1]))
+        for media_type, variant, ext in encoded:
+            path = fingerprint(stem + ext, variant, suffix=f'.{w}w')
+            write_file(build_dir, path, variant)
+            variants.append({'path': path, 'width': w, 'type': media_type, 'bytes': len(variant)})
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+# function to store the precompressed encodings of a text asset that are smaller than the original
+def precompress(build_dir, path, data):
+    encodings = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(data, quality=11)
+    kept = []
+    for encoding, encoded in encodings.items():
+        if len(encoded) < len(data):
+            write_file(build_dir, path + ('.br' if encoding == 'br' else '.gz'), encoded)
+            kept.append(encoding)
+    return kept
+
+
+# function to build the fingerprinted copies, image variants and precompressed text assets of a static directory
+def build(static_dir, build_dir, widths=IMAGE_WIDTHS):
+    """Rebuild ``build_dir`` from the files in ``static_dir`` and return the manifest.
+
+    Every file is copied under a name that contains a hash of its content,
+    so its URL changes whenever the file does and it can be cached forever.
+    Images also get resized and WebP variants (with Pillow), text assets a
+    gzip/brotli copy. ``manifest.json`` maps every original name to its
+    fingerprinted file and variants; it is written last, so a server never
+    sees a manifest that points at missing files.
+    """
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and os.path.join(root, d) != build_dir)
+        for filename in sorted(files):
+            if filename.startswith('.'):
+                continue
+            name = os.path.relpath(os.path.join(root, filename), static_dir).replace(os.sep, '/')
+            with open(os.path.join(root, filename), 'rb') as f:
+                data = f.read()
+
+            path = fingerprint(name, data)
+            entry = {'path': path, 'bytes': write_file(build_dir, path, data)}
+            ext = os.path.splitext(name)[1].lower()
+            if ext in IMAGE_FORMATS and Image is not None:
+                entry.update(image_variants(build_dir, name, data, widths))
+            elif ext in TEXT_EXTENSIONS:
+                entry['encodings'] = precompress(build_dir, path, data)
+            manifest[name] = entry
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+# ----- manifest -----
+class AssetManifest:
+    """The build manifest of one process, read once on first use.
+
+    Templates resolve asset names through it in memory, without touching
+    the file system. Without a build (``flask build-assets`` was not run)
+    the manifest is empty and assets fall back to the plain ``/static`` URLs.
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self._entries = None
+        self._encodings = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._entries is None:
+                try:
+                    with open(os.path.join(self.build_dir, MANIFEST)) as f:
+                        entries = json.load(f)
+                except FileNotFoundError:
+                    entries = {}
+                # every servable file with its precompressed encodings
+                self._encodings = {}
+                for entry in entries.values():
+                    self._encodings[entry['path']] = entry.get('encodings', [])
+                    self._encodings.update((variant['path'], []) for variant in entry.get('variants', []))
+                self._entries = entries
+        return self._entries
+
+    def get(self, name):
+        entries = self._entries if self._entries is not None else self._load()
+        return entries.get(name)
+
+    def encodings(self, path):
+        if self._entries is None:
+            self._load()
+        return self._encodings.get(path)
+
+
+# ----- template helpers -----
+# function to return the URL of a static asset, fingerprinted when it was built
+def asset_url(name):
+    entry = get_manifest().get(name)
+    if entry is None:
+        return url_for('static', filename=name)
+    return url_for('assets.asset', filename=entry['path'])
+
+
+# function to render a responsive <picture> of an image: WebP and own-format srcsets of every built width
+def picture(name, alt, class_=None, sizes='100vw', lazy=True):
+    entry = get_manifest().get(name)
+    attributes = f' alt="{escape(alt)}"'
+    if class_:
+        attributes += f' class="{escape(class_)}"'
+    if lazy:
+        attributes += ' loading="lazy" decoding="async"'
+    if entry is None or not entry.get('variants'):
+        return Markup(f'<img src="{escape(asset_url(name))}"{attributes}>')
+
+    def srcset(variants):
+        return ', '.join(f"{url_for('assets.asset', filename=v['path'])} {v['width']}w" for v in variants)
+
+    webp = [v for v in entry['variants'] if v['type'] == 'image/webp']
+    own = [v for v in entry['variants'] if v['type'] != 'image/webp']
+    own.append({'path': entry['path'], 'width': entry['width']})
+    return Markup(
+        f'<picture>'
+        f'<source type="image/webp" srcset="{srcset(webp)}" sizes="{escape(sizes)}">'
+        f'<img src="{asset_url(name)}" srcset="{srcset(own)}" sizes="{escape(sizes)}"'
+        f' width="{entry["width"]}" height="{entry["height"]}"{attributes}>'
+        f'</picture>'
+    )
+
+
+# ----- serving -----
+bp = Blueprint('assets', __name__, url_prefix='/assets')
+
+
+# a fingerprinted file, cached for a year; precompressed when the client accepts it, Range requests answered with 206
+@bp.route('/<path:filename>')
+def asset(filename):
+    manifest = get_manifest()
+    encodings = manifest.encodings(filename)
+    if encodings is None:
+        raise NotFound()
+    path = safe_join(manifest.build_dir, filename)
+
+    encoding = None
+    if 'Range' not in request.headers: # ranges are served from the identity file
+        encoding = next((e for e in ('br', 'gzip') if e in encodings and request.accept_encodings[e]), None)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if encoding is not None:
+        path += '.br' if encoding == 'br' else '.gz'
+
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=31536000)
+    response.headers['Cache-Control'] = IMMUTABLE
+    if encodings:
+        response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# ----- flask integration -----
+# function to return the asset manifest of the current app
+def get_manifest():
+    return current_app.extensions['assets']
+
+
+# function to register the asset manifest and template helpers with an app
+def init_app(app):
+    app.config.setdefault('ASSETS_BUILD_DIR', os.environ.get('ASSETS_BUILD_DIR', os.path.join(app.static_folder, 'build')))
+    app.extensions['assets'] = AssetManifest(app.config['ASSETS_BUILD_DIR'])
+    app.add_template_global(asset_url)
+    app.add_template_global(picture)
@@ -0,0 +1,211 @@
+# ----- imports -----
+import json
+import os
+import platform
+import resource
+import statistics
+import threading
+import time
+
+
+# ----- routes -----
+# GET routes driven by the benchmark; {middle_<entity>} is replaced by an id from the middle of that table
+ROUTES = [
+    '/about-us',
+    '/show_address',
+    '/show_person',
+    '/show_person?after={middle_person}',
+    '/show_owner',
+    '/show_agent',
+    '/show_client',
+    '/show_location',
+    '/show_property',
+    '/show_property?after={middle_property}',
+    '/show_contract',
+    '/show_contract?after={middle_contract}',
+    '/show_payment',
+    '/show_payment?after={middle_payment}',
+    '/show_payment?from=2010-01-01&to=2010-02-01',
+    '/search_person?q=meier',
+    '/search_person?q=schmdi',
+    '/search_person?q=07123',
+    '/search_person?q=ke&role=owner',
+    '/create_address',
+    '/create_person',
+    '/create_owner',
+    '/create_agent',
+    '/create_client',
+    '/create_location',
+    '/create_property',
+    '/create_contract',
+    '/create_payment',
+]
+
+# full-table streaming views, only driven on request because they scale with the table
+STREAMING_ROUTES = [
+    '/show_contract?all=1',
+    '/show_payment?all=1',
+]
+
+
+# ----- measurements -----
+# function to return the resident set size of a process in MiB (Linux /proc, peak RSS elsewhere)
+def rss_mib(pid=None):
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+    return None
+
+
+# function to return the p-th percentile (0-100) of a sorted list
+def percentile(values, p):
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+# function to summarise the latencies (seconds) of one route
+def summarise(latencies, errors, elapsed, rss_before, rss_after):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(statistics.fmean(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1]) if latencies else None,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'rss_mib': round(rss_after, 1) if rss_after is not None else None,
+        'rss_delta_mib': round(rss_after - rss_before, 1) if None not in (rss_before, rss_after) else None,
+    }
+
+
+# ----- drivers -----
+# function to build a request function for the Flask test client (in-process)
+def test_client_driver(app):
+    local = threading.local()
+
+    def get(path):
+        # one test client per thread, the client is not thread-safe
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        response = local.client.get(path)
+        body = response.get_data() # drain streamed responses as well
+        return response.status_code, len(body)
+    return get
+
+
+# function to build a request function for a running HTTP server
+def http_driver(base_url):
+    import requests
+
+    local = threading.local()
+
+    def get(path):
+        # one keep-alive session per thread
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        response = local.session.get(base_url.rstrip('/') + path)
+        return response.status_code, len(response.content)
+    return get
+
+
+# ----- harness -----
+# function to drive every route and return the results as a JSON-serialisable dict
+def run(get, routes, requests_per_route=100, concurrency=1, warmup=5, server_pid=None, echo=print):
+    """Send ``requests_per_route`` GETs to every route with ``concurrency`` threads.
+
+    Latency is measured per request around the full response (including
+    draining streamed bodies). RSS is measured in this process for the test
+    client, or in ``server_pid`` when benchmarking a separate server.
+    """
+    results = {}
+    for path in routes:
+        for _ in range(warmup):
+            get(path)
+
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        remaining = [requests_per_route]
+
+        def worker():
+            while True:
+                with lock:
+                    if remaining[0] == 0:
+                        return
+                    remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    status, _ = get(path)
+                    failed = status >= 400
+                except Exception:
+                    failed = True
+                duration = time.perf_counter() - started
+                with lock:
+                    if failed:
+                        errors[0] += 1
+                    else:
+                        latencies.append(duration)
+
+        rss_before = rss_mib(server_pid)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        results[path] = summarise(latencies, errors[0], elapsed, rss_before, rss_mib(server_pid))
+        r = results[path]
+        echo(f"{path:45} p50 {r['p50_ms']}ms  p95 {r['p95_ms']}ms  p99 {r['p99_ms']}ms  "
+             f"{r['throughput_rps']} req/s  rss {r['rss_mib']} MiB  errors {r['errors']}")
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'pid': os.getpid(),
+            'requests_per_route': requests_per_route,
+            'concurrency': concurrency,
+        },
+        'routes': results,
+    }
+
+
+# function to print how the routes of a run changed against a saved baseline run
+def compare(baseline, current, echo=print):
+    for path, now in current['routes'].items():
+        before = baseline['routes'].get(path)
+        if not before or not before.get('p50_ms') or not now.get('p50_ms'):
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            change = (now[metric] - before[metric]) / before[metric] * 100
+            changes.append(f'{metric[:-3]} {before[metric]} -> {now[metric]}ms ({change:+.0f}%)')
+        echo(f'{path:45} ' + '  '.join(changes))
+
+
+# function to write a run to a JSON file
+def save(result, path):
+    with open(path, 'w') as out:
+        json.dump(result, out, indent=2)
+
+
+# function to read a saved run
+def load(path):
+    with open(path) as source:
+        return json.load(source)
@@ -0,0 +1,243 @@
+# ----- imports -----
+import csv
+import time
+
+
+# ----- import definitions -----
+# every importable entity: CSV columns (in any order, optional unless required) with their PostgreSQL types, required columns, extra id columns
+# of the staging table, the tables it writes to, and the ordered steps that validate the rows and load them set-wise.
+# A step is either ('check', condition, message), rejecting every still-valid row where the condition
+# holds, or ('sql', statement). `s` is the staging table alias in checks.
+IMPORTS = {
+    # persons with their address; a row that has resident_status or acquisition_date also becomes an owner
+    'person': {
+        'columns': {
+            'first_name': 'varchar(100)',
+            'last_name': 'varchar(100)',
+            'date_of_birth': 'date',
+            'phone_number': 'varchar(20)',
+            'email': 'varchar(255)',
+            'street_number': 'integer',
+            'address_line': 'varchar(255)',
+            'country': 'varchar(100)',
+            'postal_code': 'varchar(20)',
+            'resident_status': 'varchar(50)',
+            'acquisition_date': 'date',
+        },
+        'required': ['first_name', 'last_name', 'date_of_birth'],
+        'ids': ['address_id', 'person_id'],
+        'tables': ['address', 'person', 'owner'],
+        'steps': [
+            ('check', 'EXISTS (SELECT 1 FROM person p WHERE p.email = s.email)', 'email already exists'),
+            # one window pass instead of a correlated lookup per row, which is quadratic on the unindexed staging table;
+            # the first line of every email is kept
+            ('sql', '''
+                UPDATE {staging} s SET error = 'duplicate email in file'
+                FROM (
+                    SELECT line_no, row_number() OVER (PARTITION BY email ORDER BY line_no) AS n
+                    FROM {staging}
+                    WHERE email IS NOT NULL
+                ) d
+                WHERE d.line_no = s.line_no AND d.n > 1 AND s.error IS NULL
+            '''),
+
+            # give every distinct address of the accepted rows one new address_id
+            ('sql', '''
+                UPDATE {staging} s SET address_id = a.address_id
+                FROM (
+                    SELECT d.*, nextval('address_address_id_seq') AS address_id
+                    FROM (
+                        SELECT DISTINCT street_number, address_line, country, postal_code
+                        FROM {staging}
+                        WHERE error IS NULL AND num_nonnulls(street_number, address_line, country, postal_code) > 0
+                    ) d
+                ) a
+                WHERE s.error IS NULL
+                  AND COALESCE(s.street_number, '') = COALESCE(a.street_number, '')
+                  AND COALESCE(s.address_line, '') = COALESCE(a.address_line, '')
+                  AND COALESCE(s.country, '') = COALESCE(a.country, '')
+                  AND COALESCE(s.postal_code, '') = COALESCE(a.postal_code, '')
+            '''),
+            ('sql', '''
+                INSERT INTO address (address_id, street_number, address_line, country, postal_code)
+                SELECT DISTINCT address_id, street_number::integer, address_line, country, postal_code
+                FROM {staging}
+                WHERE error IS NULL AND address_id IS NOT NULL
+            '''),
+
+            # persons get their ids up front so the owner rows can reference them without a lookup
+            ('sql', "UPDATE {staging} SET person_id = nextval('person_person_id_seq') WHERE error IS NULL"),
+            ('sql', '''
+                INSERT INTO person (person_id, first_name, last_name, date_of_birth, phone_number, email, address_id)
+                SELECT person_id, first_name, last_name, date_of_birth::date, phone_number, email, address_id
+                FROM {staging}
+                WHERE error IS NULL
+            '''),
+            ('sql', '''
+                INSERT INTO owner (person_id, resident_status, acquisition_date)
+                SELECT person_id, resident_status, acquisition_date::date
+                FROM {staging}
+                WHERE error IS NULL AND num_nonnulls(resident_status, acquisition_date) > 0
+            '''),
+        ],
+    },
+
+    # properties with their coordinates; the owner is identified by the email of the owning person
+    'property': {
+        'columns': {
+            'number_of_rooms': 'integer',
+            'building_year': 'integer',
+            'area_size': 'numeric',
+            'price': 'numeric',
+            'latitude': 'numeric',
+            'longitude': 'numeric',
+            'owner_email': 'varchar(255)',
+        },
+        'required': ['price', 'latitude', 'longitude', 'owner_email'],
+        'ids': ['owner_id', 'location_id'],
+        'tables': ['location', 'property'],
+        'steps': [
+            # resolve owners with one join instead of one lookup per row
+            ('sql', '''
+                UPDATE {staging} s SET owner_id = o.owner_id
+                FROM person p
+                JOIN owner o ON o.person_id = p.person_id
+                WHERE s.error IS NULL AND p.email = s.owner_email
+            '''),
+            ('check', 's.owner_id IS NULL', 'unknown owner_email'),
+
+            # one new location per distinct coordinate pair
+            ('sql', '''
+                UPDATE {staging} s SET location_id = l.location_id
+                FROM (
+                    SELECT d.*, nextval('location_location_id_seq') AS location_id
+                    FROM (SELECT DISTINCT latitude, longitude FROM {staging} WHERE error IS NULL) d
+                ) l
+                WHERE s.error IS NULL AND s.latitude = l.latitude AND s.longitude = l.longitude
+            '''),
+            ('sql', '''
+                INSERT INTO location (location_id, latitude, longitude)
+                SELECT DISTINCT location_id, latitude::numeric, longitude::numeric
+                FROM {staging}
+                WHERE error IS NULL
+            '''),
+            ('sql', '''
+                INSERT INTO property (number_of_rooms, building_year, area_size, price, location_id, owner_id)
+                SELECT number_of_rooms::integer, building_year::integer, area_size::numeric, price::numeric, location_id, owner_id
+                FROM {staging}
+                WHERE error IS NULL
+            '''),
+        ],
+    },
+
+    # payments of existing contracts
+    'payment': {
+        'columns': {
+            'amount': 'numeric',
+            'date': 'date',
+            'contract_id': 'integer',
+        },
+        'required': ['amount', 'date', 'contract_id'],
+        'ids': [],
+        'tables': ['payment'],
+        'steps': [
+            ('check', 'NOT EXISTS (SELECT 1 FROM contract c WHERE c.contract_id = s.contract_id::integer)', 'unknown contract_id'),
+            ('sql', '''
+                INSERT INTO payment (amount, date, contract_id)
+                SELECT amount::numeric, date::date, contract_id::integer
+                FROM {staging}
+                WHERE error IS NULL
+            '''),
+        ],
+    },
+}
+
+
+# ----- errors -----
+# raised for files that cannot be imported at all (as opposed to single rejected rows)
+class CSVImportError(ValueError):
+    pass
+
+
+# ----- runner -----
+# function to read the header of a CSV stream and return the column names
+def read_header(stream, entity):
+    line = stream.readline()
+    if isinstance(line, bytes):
+        line = line.decode('utf-8-sig')
+    header = [name.strip() for name in next(csv.reader([line]), [])]
+
+    columns = IMPORTS[entity]['columns']
+    unknown = [name for name in header if name not in columns]
+    if unknown:
+        raise CSVImportError(f"unknown column(s) for {entity}: {', '.join(unknown)}")
+    missing = [name for name in IMPORTS[entity]['required'] if name not in header]
+    if missing:
+        raise CSVImportError(f"missing required column(s) for {entity}: {', '.join(missing)}")
+    return header
+
+
+# function to bulk import a CSV stream (header line first) for one entity in a single transaction
+def import_csv(conn, entity, stream):
+    """COPY ``stream`` into a staging table, validate and load it set-wise.
+
+    Invalid rows are rejected with a reason and everything else is inserted;
+    the whole import commits or rolls back as one transaction. Returns a dict
+    with the number of inserted rows, the rejected ``(line, reason)`` pairs
+    and the elapsed time.
+    """
+    if entity not in IMPORTS:
+        raise CSVImportError(f'cannot import {entity}, choose one of: {", ".join(IMPORTS)}')
+    spec = IMPORTS[entity]
+    staging = f'import_{entity}'
+    started = time.perf_counter()
+
+    header = read_header(stream, entity)
+    cur = conn.cursor()
+    try:
+        # staging columns are text so COPY never fails on a bad value; validation happens in SQL
+        columns = ', '.join(f'{name} TEXT' for name in spec['columns'])
+        ids = ''.join(f', {name} BIGINT' for name in spec['ids'])
+        cur.execute(f'CREATE TEMP TABLE {staging} (line_no BIGSERIAL, error TEXT, {columns}{ids}) ON COMMIT DROP')
+        # FORCE_NULL turns quoted empty strings into NULL as well, so blanks count as missing values
+        cur.copy_expert(f"COPY {staging} ({', '.join(header)}) FROM STDIN "
+                        f"WITH (FORMAT csv, FORCE_NULL ({', '.join(header)}))", stream)
+
+        # required columns and type checks (pg_input_is_valid also enforces varchar lengths)
+        checks = [('check', f'{name} IS NULL', f'{name} is required') for name in spec['required']]
+        checks += [('check', f'{name} IS NOT NULL AND NOT pg_input_is_valid({name}, %s)', f'invalid {name}', pg_type)
+                   for name, pg_type in spec['columns'].items() if name in header and pg_type != 'text']
+
+        for step in checks + spec['steps']:
+            if step[0] == 'check':
+                params = [step[2]] + list(step[3:])
+                # CASE makes sure conditions only ever see rows that passed every earlier check
+                cur.execute(f'UPDATE {staging} s SET error = %s WHERE CASE WHEN s.error IS NULL THEN ({step[1]}) ELSE false END'
+                            .format(staging=staging), params)
+            else:
+                cur.execute(step[1].format(staging=staging))
+
+        cur.execute(f'SELECT count(*) FROM {staging} WHERE error IS NULL')
+        inserted = cur.fetchone()[0]
+        # line numbers count the header, so they match what a spreadsheet shows
+        cur.execute(f'SELECT line_no + 1, error FROM {staging} WHERE error IS NOT NULL ORDER BY line_no')
+        rejected = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    return {
+        'entity': entity,
+        'inserted': inserted,
+        'rejected': rejected,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+# function to import a CSV file from disk
+def import_file(conn, entity, path):
+    with open(path, 'rb') as stream:
+        return import_csv(conn, entity, stream)
@@ -0,0 +1,306 @@
+# ----- imports -----
+import math
+import os
+import threading
+import time
+import numpy as np
+from flask import current_app
+import geo
+import versions
+from analytics import copy_columns
+
+
+# ----- settings -----
+# columns of the index with their NumPy type; unknown area is NaN, unknown rooms/year -1
+COLUMNS = [
+    ('property_id', 'i4'),
+    ('latitude', 'f8'),
+    ('longitude', 'f8'),
+    ('area', 'f8'),
+    ('rooms', 'i4'),
+    ('year', 'i4'),
+    ('price', 'f8'),
+]
+
+# properties with a location, as fixed-width binary COPY fields; {where} selects new rows only
+INDEX_QUERY = '''
+    SELECT p.property_id, l.latitude::float8, l.longitude::float8, COALESCE(p.area_size::float8, 'NaN'),
+           COALESCE(p.number_of_rooms, -1), COALESCE(p.building_year, -1), p.price::float8
+    FROM property p
+    JOIN location l ON l.location_id = p.location_id
+    {where}
+'''
+
+# tables the index is read from
+INDEX_TABLES = ('property', 'location')
+
+# how much of each feature counts as one unit of dissimilarity; the score is the euclidean
+# norm of the scaled differences, so 2 km away weighs as much as 20 m² larger or 1 room more
+SCALES = {
+    'km': 2.0,
+    'area': 20.0,
+    'rooms': 1.0,
+    'year': 15.0,
+}
+
+# a feature the candidate does not have counts as this many units
+MISSING_PENALTY = 1.0
+
+# kilometres per degree of latitude
+KM_PER_DEGREE = math.pi * geo.EARTH_RADIUS_KM / 180
+
+
+# ----- geometry -----
+# function to compute the great-circle distance from one point to arrays of points, in kilometres
+def haversine_km(lat, lon, lats, lons):
+    phi1, phi2 = math.radians(lat), np.radians(lats)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lons - lon) / 2) ** 2
+    return 2 * geo.EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+# function to compute the grid cells of arrays of points, same formula as geo.grid_cell()
+def grid_cells(lats, lons):
+    rows = np.minimum(np.floor((lats + 90) * geo.GRID_CELLS_PER_DEGREE), 180 * geo.GRID_CELLS_PER_DEGREE - 1)
+    columns = np.minimum(np.floor((lons + 180) * geo.GRID_CELLS_PER_DEGREE), geo.GRID_COLUMNS - 1)
+    return (rows * geo.GRID_COLUMNS + columns).astype(np.int64)
+
+
+# ----- index -----
+class ComparablesIndex:
+    """Property features in arrays, sorted by location grid cell.
+
+    A square of grid cells around the target maps to one contiguous slice
+    per grid row, found by binary search, so a query only scores properties
+    near the target: the square grows until the k-th best score is below the
+    score any property outside it could reach. Properties added later go to
+    a small unsorted delta that is scored in full and merged into the sorted
+    arrays once it grows past ``merge_threshold``.
+    """
+
+    def __init__(self, columns, tag, max_id, merge_threshold=10000):
+        self.tag = tag
+        self.max_id = max_id
+        self.merge_threshold = merge_threshold
+        self.loaded_at = time.time()
+        # (sorted cells, sorted columns, delta columns), replaced as a whole so queries never see half an update
+        self._arrays = self._sort(columns) + (self._empty(),)
+
+    @staticmethod
+    def _empty():
+        return {name: np.empty(0, dtype=kind) for name, kind in COLUMNS}
+
+    @staticmethod
+    def _sort(columns):
+        cells = grid_cells(columns['latitude'], columns['longitude'])
+        order = np.argsort(cells, kind='stable')
+        return cells[order], {name: values[order] for name, values in columns.items()}
+
+    def __len__(self):
+        cells, _, delta = self._arrays
+        return len(cells) + len(delta['property_id'])
+
+    def add(self, columns):
+        cells, base, delta = self._arrays
+        delta = {name: np.concatenate((delta[name], columns[name])) for name, _ in COLUMNS}
+        if len(delta['property_id']) >= self.merge_threshold:
+            self._arrays = self._sort({name: np.concatenate((base[name], delta[name])) for name, _ in COLUMNS}) + (self._empty(),)
+        else:
+            self._arrays = (cells, base, delta)
+        if len(columns['property_id']):
+            self.max_id = max(self.max_id, int(columns['property_id'].max()))
+
+    @staticmethod
+    def _square(cells, cell, radius):
+        # slices of the sorted arrays covering the (2 * radius + 1)² cells around `cell`, one or two per grid row:
+        # columns wrap around the antimeridian, so a square over the edge continues on the other side
+        row, column = divmod(cell, geo.GRID_COLUMNS)
+        rows = np.arange(max(0, row - radius), min(180 * geo.GRID_CELLS_PER_DEGREE - 1, row + radius) + 1)
+        if 2 * radius + 1 >= geo.GRID_COLUMNS:
+            columns = [(0, geo.GRID_COLUMNS - 1)]
+        elif column - radius < 0:
+            columns = [(0, column + radius), (column - radius + geo.GRID_COLUMNS, geo.GRID_COLUMNS - 1)]
+        elif column + radius >= geo.GRID_COLUMNS:
+            columns = [(column - radius, geo.GRID_COLUMNS - 1), (0, column + radius - geo.GRID_COLUMNS)]
+        else:
+            columns = [(column - radius, column + radius)]
+        slices = []
+        for first_column, last_column in columns:
+            starts = np.searchsorted(cells, rows * geo.GRID_COLUMNS + first_column, side='left')
+            ends = np.searchsorted(cells, rows * geo.GRID_COLUMNS + last_column, side='right')
+            slices += [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+        return slices
+
+    def query(self, target, k=10, exclude_id=None):
+        """Return ``(arrays, scores, distances)`` of the ``k`` most similar properties to ``target``.
+
+        ``target`` is a dict with ``latitude`` and ``longitude`` and optionally
+        ``area``, ``rooms`` and ``year``; missing target features are ignored.
+        """
+        cells, base_arrays, delta = self._arrays
+        lat, lon = target['latitude'], target['longitude']
+        cell = int(grid_cells(np.array([lat]), np.array([lon]))[0])
+        cell_km = KM_PER_DEGREE / geo.GRID_CELLS_PER_DEGREE
+        max_radius = 180 * geo.GRID_CELLS_PER_DEGREE
+
+        radius = 1
+        while True:
+            slices = self._square(cells, cell, radius)
+            near = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+            arrays = {name: np.concatenate((base_arrays[name][near], delta[name])) for name, _ in COLUMNS}
+            scores, distances = score(arrays, target)
+            if exclude_id is not None:
+                scores[arrays['property_id'] == exclude_id] = np.inf
+            found = min(k, int(np.isfinite(scores).sum()))
+
+            # anything outside the square is at least `radius` cells away (in longitude, at the far latitude)
+            far_lat = min(89.9, abs(lat) + radius / geo.GRID_CELLS_PER_DEGREE)
+            outside = radius * cell_km * math.cos(math.radians(far_lat)) / SCALES['km']
+            best = np.argpartition(scores, found - 1)[:found] if found else np.empty(0, dtype=np.int64)
+            kth = scores[best].max() if found else np.inf
+            if (found == k and kth <= outside) or radius >= max_radius:
+                best = best[np.argsort(scores[best], kind='stable')]
+                return {name: values[best] for name, values in arrays.items()}, scores[best], distances[best]
+            radius *= 2
+
+
+# function to score arrays of properties against a target: (scores, distances in km)
+def score(arrays, target):
+    distances = haversine_km(target['latitude'], target['longitude'], arrays['latitude'], arrays['longitude'])
+    squared = (distances / SCALES['km']) ** 2
+    for feature, missing in (('area', np.isnan(arrays['area'])), ('rooms', arrays['rooms'] < 0), ('year', arrays['year'] < 0)):
+        if target.get(feature) is None:
+            continue
+        difference = np.where(missing, MISSING_PENALTY, (arrays[feature] - target[feature]) / SCALES[feature])
+        squared += difference ** 2
+    return np.sqrt(squared), distances
+
+
+# ----- valuation -----
+# function to suggest a price from the comparables, weighting closer matches more
+def suggest_price(target, arrays, scores):
+    """Return ``{'price', 'low', 'high', 'method'}`` or None without comparables.
+
+    With a target area and comparables of known area the estimate is the
+    weighted price per m² times the area, otherwise the weighted price. The
+    range spans the prices the individual comparables imply.
+    """
+    if not len(scores):
+        return None
+    weights = 1.0 / (0.1 + scores)
+    known_area = arrays['area'] > 0
+    if target.get('area') and known_area.any():
+        implied = arrays['price'][known_area] / arrays['area'][known_area] * target['area']
+        weights, method = weights[known_area], 'price per m²'
+    else:
+        implied, method = arrays['price'], 'price'
+    return {
+        'price': round(float(np.average(implied, weights=weights)), 2),
+        'low': round(float(implied.min()), 2),
+        'high': round(float(implied.max()), 2),
+        'method': method,
+    }
+
+
+# ----- database -----
+# function to read index columns, all of them or only properties with an id above `after_id`
+def read_columns(cur, after_id=None):
+    if after_id is None:
+        return copy_columns(cur, INDEX_QUERY.format(where=''), COLUMNS)
+    return copy_columns(cur, INDEX_QUERY.format(where='WHERE p.property_id > %s'), COLUMNS, (after_id,))
+
+
+# function to read the features of a property or a location as a query target (None when it does not exist)
+def read_target(cur, property_id=None, location_id=None):
+    if property_id is not None:
+        cur.execute('''
+            SELECT l.latitude, l.longitude, p.area_size, p.number_of_rooms, p.building_year
+            FROM property p
+            JOIN location l ON l.location_id = p.location_id
+            WHERE p.property_id = %s
+        ''', (property_id,))
+    else:
+        cur.execute('SELECT latitude, longitude, NULL, NULL, NULL FROM location WHERE location_id = %s', (location_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {name: float(value) if value is not None else None
+            for name, value in zip(('latitude', 'longitude', 'area', 'rooms', 'year'), row)}
+
+
+# ----- cache -----
+class ComparablesCache:
+    """The index of one process, kept in step with the property table.
+
+    Each query compares the index's tag with the current versions of
+    ``property`` and ``location``. After a change, the properties with ids
+    beyond the last indexed one are read and added (inserts are the common
+    write); updates and deletes of indexed rows are picked up by a full
+    reload once the index is older than ``max_age`` seconds. Results are
+    re-read from the database, so they always show current values.
+    """
+
+    def __init__(self, max_age=600.0, merge_threshold=10000):
+        self.max_age = max_age
+        self.merge_threshold = merge_threshold
+        self.index = None
+        self._lock = threading.Lock()
+
+    def get_index(self, conn):
+        cur = conn.cursor()
+        try:
+            tag = versions.version_tag(versions.table_versions(cur, INDEX_TABLES))
+            index = self.index
+            if index is not None and index.tag == tag and time.time() - index.loaded_at < self.max_age:
+                return index
+            with self._lock:
+                index = self.index
+                if index is None or time.time() - index.loaded_at >= self.max_age:
+                    columns = read_columns(cur)
+                    max_id = int(columns['property_id'].max()) if len(columns['property_id']) else 0
+                    self.index = ComparablesIndex(columns, tag, max_id, self.merge_threshold)
+                elif index.tag != tag:
+                    index.add(read_columns(cur, after_id=index.max_id))
+                    index.tag = tag
+                return self.index
+        finally:
+            cur.close()
+
+    def find(self, conn, target, k=10, exclude_id=None):
+        """Return the ``k`` comparables of ``target`` as dicts, best first, with a suggested price."""
+        index = self.get_index(conn)
+        arrays, scores, distances = index.query(target, k, exclude_id)
+
+        # current values of the matches; rows deleted since the index was loaded drop out
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT p.property_id, p.number_of_rooms, p.building_year, p.area_size, p.price, l.latitude, l.longitude
+            FROM property p
+            JOIN location l ON l.location_id = p.location_id
+            WHERE p.property_id = ANY(%s)
+        ''', ([int(property_id) for property_id in arrays['property_id']],))
+        columns = [desc[0] for desc in cur.description]
+        current = {row[0]: dict(zip(columns, row)) for row in cur.fetchall()}
+        cur.close()
+
+        keep = np.array([int(property_id) in current for property_id in arrays['property_id']], dtype=bool)
+        comparables = [dict(current[int(property_id)], score=round(float(s), 3), distance_km=round(float(d), 2))
+                       for property_id, s, d in zip(arrays['property_id'][keep], scores[keep], distances[keep])]
+        return {
+            'comparables': comparables,
+            'suggested_price': suggest_price(target, {name: values[keep] for name, values in arrays.items()}, scores[keep]),
+            'indexed': len(index),
+        }
+
+
+# ----- flask integration -----
+# function to return the comparables cache of the current app
+def get_cache():
+    return current_app.extensions['comparables']
+
+
+# function to register the comparables index with an app
+def init_app(app):
+    app.config.setdefault('COMPARABLES_MAX_AGE', float(os.environ.get('COMPARABLES_MAX_AGE', 600)))
+    app.config.setdefault('COMPARABLES_MERGE_THRESHOLD', int(os.environ.get('COMPARABLES_MERGE_THRESHOLD', 10000)))
+    app.extensions['comparables'] = ComparablesCache(max_age=app.config['COMPARABLES_MAX_AGE'],
+                                                     merge_threshold=app.config['COMPARABLES_MERGE_THRESHOLD'])
@@ -0,0 +1,62 @@
+# ----- imports -----
+import gzip
+import os
+from flask import request
+
+# brotli is optional; without it responses are gzip-compressed only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ----- negotiation -----
+# function to pick the best encoding the client accepts ('br', 'gzip' or None)
+def choose_encoding(accept_encoding):
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+# function to compress a finished response in place when it is large enough and the client accepts it
+def compress_response(response, min_size, gzip_level=6, brotli_quality=5):
+    """Compress the body of ``response`` with brotli or gzip.
+
+    Streamed bodies (the ``?all=1`` views) and responses that are already
+    encoded, tiny, or not successful are passed through unchanged. The
+    quality settings trade a little ratio for speed, since this runs on
+    every large response.
+    """
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.content_length is None
+            or response.content_length < min_size):
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if encoding == 'br':
+        body = brotli.compress(body, quality=brotli_quality)
+    else:
+        body = gzip.compress(body, compresslevel=gzip_level)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# ----- flask integration -----
+# function to compress the responses of an app
+def init_app(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.environ.get('COMPRESS_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESS_GZIP_LEVEL', int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)))
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5)))
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config['COMPRESS_MIN_SIZE'],
+                                 gzip_level=app.config['COMPRESS_GZIP_LEVEL'],
+                                 brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'])
@@ -0,0 +1,465 @@
+# ----- imports -----
+import functools
+import itertools
+import os
+import re
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from flask import current_app, g, request
+
+
+# ----- instrumentation -----
+# callables hook(cursor, query, params, seconds) run after every statement of a pooled connection (see metrics.py)
+QUERY_HOOKS = []
+
+
+# cursor of the pooled connections; times every statement and hands it to the QUERY_HOOKS
+class InstrumentedCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        if not QUERY_HOOKS:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - started
+            for hook in QUERY_HOOKS:
+                hook(self, query, vars, seconds)
+
+    def executemany(self, query, vars_list):
+        if not QUERY_HOOKS:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            seconds = time.perf_counter() - started
+            for hook in QUERY_HOOKS:
+                hook(self, query, None, seconds)
+
+
+# cookie holding the primary's WAL position after the client's last write
+READ_YOUR_WRITES_COOKIE = 'db_lsn'
+
+# textual form of a pg_lsn ('16/B374D848'); anything else in the cookie is ignored
+LSN_PATTERN = re.compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+
+# ----- errors -----
+# raised when no connection becomes free before the checkout timeout runs out
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+# ----- connection pool -----
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily (never at import time), handed out LIFO so
+    the warmest connection is reused first, health checked on checkout and
+    capped at ``maxconn``. Callers that find the pool saturated wait up to
+    ``timeout`` seconds before ``PoolTimeout`` is raised.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, health_check_interval=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()  # pool belongs to the process that created it
+
+        self._idle = []  # list of (connection, time it was returned)
+        self._size = 0   # open connections, idle and checked out
+        self._cond = threading.Condition()
+
+        # saturation counters
+        self._stats = {
+            'checkouts': 0,              # successful checkouts
+            'connects': 0,               # physical connections opened
+            'connect_time': 0.0,         # seconds spent opening them
+            'waits': 0,                  # checkouts that found the pool full and had to wait
+            'wait_time': 0.0,            # seconds spent waiting for a free connection
+            'timeouts': 0,               # checkouts that gave up after the timeout
+            'health_check_failures': 0,  # stale connections replaced on checkout
+            'in_use': 0,                 # connections currently checked out
+            'peak_in_use': 0,            # highest concurrent checkouts seen
+        }
+
+    def _connect(self):
+        started = time.perf_counter()
+        conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        with self._cond:
+            self._stats['connects'] += 1
+            self._stats['connect_time'] += time.perf_counter() - started
+        return conn
+
+    def _is_healthy(self, conn, returned_at):
+        # connections the driver already knows are broken are never reused
+        if conn.closed or conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        # only ping connections that sat idle long enough to have been dropped by the server
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+
+        with self._cond:
+            # open the minimum number of connections the first time the pool is used
+            warm_up = self._size == 0 and self.minconn > 1
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1  # reserve a slot, the connection is opened outside the lock
+                    conn, returned_at = None, None
+                    break
+
+                # the pool is saturated, wait for a connection to be returned
+                now = time.monotonic()
+                if waited_since is None:
+                    waited_since = now
+                    self._stats['waits'] += 1
+                if now >= deadline:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time'] += now - waited_since
+                    raise PoolTimeout(f'no database connection available after {self.timeout}s '
+                                      f'({self._size} of {self.maxconn} in use)')
+                self._cond.wait(deadline - now)
+
+            if waited_since is not None:
+                self._stats['wait_time'] += time.monotonic() - waited_since
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+
+        try:
+            if conn is not None and not self._is_healthy(conn, returned_at):
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            # give the reserved slot back so waiters are not starved
+            with self._cond:
+                self._size -= 1
+                self._stats['in_use'] -= 1
+                self._cond.notify()
+            raise
+
+        if warm_up:
+            self._warm_up()
+        return conn
+
+    def _warm_up(self):
+        # open idle connections up to minconn so the next requests skip the handshake
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                return
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def putconn(self, conn, close=False):
+        # never hand out a connection with an open transaction
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            self._stats['in_use'] -= 1
+            if close or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+            snapshot['minconn'] = self.minconn
+            snapshot['maxconn'] = self.maxconn
+        return snapshot
+
+
+# ----- read replicas -----
+class ReplicaSet:
+    """Pools of the read replicas, balanced round robin with failover.
+
+    A replica whose connection fails is left out for ``retry_after``
+    seconds, so a dead replica costs one failed connect per interval rather
+    than one per request. ``getconn`` can require a minimum replayed WAL
+    position (read-your-writes); replicas that have not caught up are
+    skipped. When no replica qualifies it returns None and the caller reads
+    from the primary.
+    """
+
+    def __init__(self, pools, retry_after=30.0):
+        self.pools = pools
+        self.retry_after = retry_after
+        self._next = itertools.count()
+        self._down_until = [0.0] * len(pools)
+        self._lock = threading.Lock()
+        self._stats = {'reads': 0, 'failovers': 0, 'behind': 0, 'primary_fallbacks': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def getconn(self, min_lsn=None):
+        # a position that is not an LSN cannot be compared, so those reads go to the primary
+        if min_lsn is not None and not LSN_PATTERN.fullmatch(min_lsn):
+            self._count('primary_fallbacks')
+            return None
+
+        # rotate over the replicas that are up, so the load of a failed one spreads evenly over the rest
+        now = time.monotonic()
+        up = [i for i in range(len(self.pools)) if self._down_until[i] <= now]
+        start = next(self._next)
+        for offset in range(len(up)):
+            i = up[(start + offset) % len(up)]
+            pool = self.pools[i]
+            try:
+                conn = pool.getconn()
+            except psycopg2.Error:
+                self._down_until[i] = time.monotonic() + self.retry_after
+                self._count('failovers')
+                continue
+            if min_lsn is not None and not self._caught_up(pool, conn, min_lsn):
+                self._count('behind')
+                continue
+            self._count('reads')
+            return conn, pool
+        self._count('primary_fallbacks')
+        return None
+
+    # function to tell whether a replica has replayed the WAL up to `lsn`; hands the connection back if not
+    def _caught_up(self, pool, conn, lsn):
+        try:
+            cur = conn.cursor()
+            # NULL on a server that is not a standby, which therefore never counts as caught up
+            cur.execute('SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, false)', (lsn,))
+            caught_up = cur.fetchone()[0]
+            cur.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # the connection itself is broken
+            pool.putconn(conn, close=True)
+            return False
+        except psycopg2.Error:
+            # the query failed but the connection is fine; putconn rolls it back
+            pool.putconn(conn)
+            return False
+        if not caught_up:
+            pool.putconn(conn)
+        return caught_up
+
+    def closeall(self):
+        for pool in self.pools:
+            pool.closeall()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['replicas'] = [dict(pool.stats(), dsn=redact(pool.dsn), down=self._down_until[i] > now)
+                                for i, pool in enumerate(self.pools)]
+        return snapshot
+
+
+# function to describe a DSN without its credentials
+def redact(dsn):
+    params = extensions.parse_dsn(dsn)
+    return f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+
+
+# ----- flask integration -----
+# serializes the lazy creation of the pools, so threads racing on the first request share one pool
+_pool_lock = threading.Lock()
+
+
+# function to tell whether a pool is missing or was inherited through fork() (it then shares sockets with the parent)
+def _needs_pool(pool):
+    return pool is None or pool.pid != os.getpid()
+
+
+# function to return the pool of the current app, created on first use in this process
+def get_pool():
+    pool = current_app.extensions.get('db_pool')
+    if _needs_pool(pool):
+        with _pool_lock:
+            # another thread may have created it while this one waited for the lock
+            pool = current_app.extensions.get('db_pool')
+            if _needs_pool(pool):
+                pool = ConnectionPool(
+                    current_app.config['DATABASE_URL'],
+                    minconn=current_app.config['DB_POOL_MINCONN'],
+                    maxconn=current_app.config['DB_POOL_MAXCONN'],
+                    timeout=current_app.config['DB_POOL_TIMEOUT'],
+                    health_check_interval=current_app.config['DB_POOL_HEALTH_CHECK_INTERVAL'],
+                )
+                current_app.extensions['db_pool'] = pool
+    return pool
+
+
+# function to return the replica pools of the current app (None without replicas), created on first use in this process
+def get_replicas():
+    dsns = current_app.config['DATABASE_REPLICA_URLS']
+    if not dsns:
+        return None
+    replicas = current_app.extensions.get('db_replicas')
+    if _needs_pool(replicas and replicas.pools[0]):
+        with _pool_lock:
+            replicas = current_app.extensions.get('db_replicas')
+            if _needs_pool(replicas and replicas.pools[0]):
+                pools = [ConnectionPool(dsn, minconn=current_app.config['DB_POOL_MINCONN'],
+                                        maxconn=current_app.config['DB_POOL_MAXCONN'],
+                                        timeout=current_app.config['DB_POOL_TIMEOUT'],
+                                        health_check_interval=current_app.config['DB_POOL_HEALTH_CHECK_INTERVAL'])
+                         for dsn in dsns]
+                replicas = ReplicaSet(pools, retry_after=current_app.config['DB_REPLICA_RETRY_SECONDS'])
+                current_app.extensions['db_replicas'] = replicas
+    return replicas
+
+
+# decorator routing the queries of a read-only route to a replica (see get_db_connection)
+def replica_reads(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# function to check out the connection of a request: a replica for replica_reads routes when one is up
+# and has caught up with the client's last write, the primary otherwise
+def checkout():
+    if g.get('db_replica_reads'):
+        replicas = get_replicas()
+        if replicas is not None:
+            found = replicas.getconn(min_lsn=request.cookies.get(READ_YOUR_WRITES_COOKIE) or None)
+            if found is not None:
+                return found
+    pool = get_pool()
+    return pool.getconn(), pool
+
+
+# function to return the connection of the current app context (one checkout per request)
+def get_db_connection():
+    if 'db_conn' not in g:
+        started = time.perf_counter()
+        g.db_conn, g.db_conn_pool = checkout()
+        g.db_checkout_seconds = time.perf_counter() - started # waiting for the pool plus any connect
+    return g.db_conn
+
+
+# function to return the connection of the current app context to the pool
+def release_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        g.pop('db_conn_pool').putconn(conn)
+
+
+# function to remember the primary's WAL position after a write, so the client's next reads wait for a replica
+# that has replayed it (or use the primary) for DB_READ_YOUR_WRITES_SECONDS
+def remember_write(response):
+    if (request.method in ('GET', 'HEAD', 'OPTIONS') or 'db_conn' not in g or g.db_conn_pool is not get_pool()
+            or not current_app.config['DATABASE_REPLICA_URLS'] or response.status_code >= 400):
+        return response
+    try:
+        cur = g.db_conn.cursor()
+        cur.execute('SELECT pg_current_wal_lsn()::text')
+        lsn = cur.fetchone()[0]
+        cur.close()
+        g.db_conn.rollback()
+    except psycopg2.Error:
+        return response
+    response.set_cookie(READ_YOUR_WRITES_COOKIE, lsn, max_age=current_app.config['DB_READ_YOUR_WRITES_SECONDS'],
+                        httponly=True, samesite='Lax')
+    return response
+
+
+# function to stream the rows of a query through a server-side cursor as dictionaries
+def iter_rows(conn, query, params=(), name='stream', batch_size=None):
+    """Yield the rows of ``query`` one dictionary at a time.
+
+    A named (server-side) cursor keeps the result set in PostgreSQL and only
+    ``batch_size`` rows are held in Python at once, so memory stays flat no
+    matter how many rows the query returns.
+    """
+    batch_size = batch_size or current_app.config['STREAM_BATCH_SIZE']
+    cur = conn.cursor(name=name) # server-side cursors live inside the current transaction
+    try:
+        cur.execute(query, params)
+        columns = None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            if columns is None:
+                # a named cursor only knows its columns after the first fetch
+                columns = [desc[0] for desc in cur.description]
+            for row in rows:
+                yield dict(zip(columns, row))
+    finally:
+        cur.close()
+
+
+# function to register the pool configuration and teardown with an app
+def init_app(app):
+    app.config.setdefault('DB_POOL_MINCONN', int(os.environ.get('DB_POOL_MINCONN', 1)))
+    app.config.setdefault('DB_POOL_MAXCONN', int(os.environ.get('DB_POOL_MAXCONN', 10)))
+    app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 5.0)))
+    app.config.setdefault('DB_POOL_HEALTH_CHECK_INTERVAL', float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30.0)))
+    app.config.setdefault('STREAM_BATCH_SIZE', int(os.environ.get('STREAM_BATCH_SIZE', 1000)))
+    app.config.setdefault('DATABASE_REPLICA_URLS', [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                                                    if dsn.strip()])
+    app.config.setdefault('DB_REPLICA_RETRY_SECONDS', float(os.environ.get('DB_REPLICA_RETRY_SECONDS', 30.0)))
+    app.config.setdefault('DB_READ_YOUR_WRITES_SECONDS', int(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', 10)))
+    app.after_request(remember_write)
+    app.teardown_appcontext(release_db_connection)
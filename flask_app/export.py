@@ -0,0 +1,288 @@
+# ----- imports -----
+import datetime
+import io
+import os
+import queue
+import threading
+import zlib
+from flask import current_app
+from pagination import date_conditions
+
+# pyarrow is optional; without it only CSV exports are offered
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# ----- export definitions -----
+# every exportable entity: its query, the date column the from/to filters apply to, and its columns
+# with their Parquet types. Amounts are exported with two decimals so CSV and Parquet agree.
+EXPORTS = {
+    'contract': {
+        'query': '''
+            SELECT c.contract_id, c.sign_date, c.agent_id, c.client_id, c.property_id, p.price::numeric(18, 2) AS price
+            FROM contract c
+            JOIN property p ON p.property_id = c.property_id
+        ''',
+        'date': 'c.sign_date',
+        'order': 'c.contract_id',
+        'columns': [
+            ('contract_id', 'int32'),
+            ('sign_date', 'date32'),
+            ('agent_id', 'int32'),
+            ('client_id', 'int32'),
+            ('property_id', 'int32'),
+            ('price', 'decimal'),
+        ],
+    },
+    'payment': {
+        'query': '''
+            SELECT p.payment_id, p.contract_id, p.amount::numeric(18, 2) AS amount, p.date
+            FROM payment p
+        ''',
+        'date': 'p.date',
+        'order': 'p.payment_id',
+        'columns': [
+            ('payment_id', 'int32'),
+            ('contract_id', 'int32'),
+            ('amount', 'decimal'),
+            ('date', 'date32'),
+        ],
+    },
+}
+
+FORMATS = ('csv', 'parquet')
+
+# content type of every format
+MEDIA_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+
+# ----- errors -----
+# raised for an export that cannot be produced (unknown entity or format, bad date)
+class ExportError(ValueError):
+    pass
+
+
+# ----- queries -----
+# function to build the COPY statement of an export, optionally limited to a date range (from inclusive, to exclusive)
+def copy_statement(cur, entity, date_from=None, date_to=None):
+    spec = EXPORTS[entity]
+    conditions, params = date_conditions(spec['date'], date_from, date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f"{spec['query']} {where} ORDER BY {spec['order']}"
+    query = cur.mogrify(query, params).decode() # COPY takes no parameters of its own
+    return f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)'
+
+
+# function to parse an optional ISO date argument
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'{name} must be a date (YYYY-MM-DD)') from None
+
+
+# ----- streaming -----
+class CopyStream:
+    """The output of one ``COPY ... TO STDOUT``, read in chunks while it runs.
+
+    psycopg2 only copies into a file, so the COPY runs in a background
+    thread that writes into this object; full ``chunk_size`` chunks are
+    handed over through a queue of at most ``max_chunks``, which makes the
+    COPY wait for a slow client and keeps memory flat. Closing the stream
+    early (a client that disconnects) cancels the statement.
+    """
+
+    def __init__(self, conn, statement, chunk_size=65536, max_chunks=16):
+        self.conn = conn
+        self.statement = statement
+        self.chunk_size = chunk_size
+        self.error = None
+        self._queue = queue.Queue(max_chunks)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='export-copy', daemon=True)
+
+    # file interface for copy_expert: one call per row
+    def write(self, data):
+        if self._cancelled.is_set():
+            return
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        cur = self.conn.cursor()
+        try:
+            cur.copy_expert(self.statement, self)
+            if self._buffer:
+                self._put(bytes(self._buffer))
+        except Exception as e:
+            self.error = e
+        finally:
+            cur.close()
+            self._put(None) # end of stream
+
+    def __iter__(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.close()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._cancelled.set()
+            self.conn.cancel()
+            self._thread.join()
+
+
+# file-like reader over an iterator of chunks, for pyarrow's streaming CSV reader
+class ChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+# file-like sink that collects what pyarrow writes until it is taken
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+# function to return the pyarrow schema of an export
+def arrow_schema(entity):
+    types = {'int32': pyarrow.int32(), 'date32': pyarrow.date32(), 'decimal': pyarrow.decimal128(18, 2)}
+    return pyarrow.schema([(name, types[kind]) for name, kind in EXPORTS[entity]['columns']])
+
+
+# function to convert a CSV stream into Parquet, written in row groups of `row_group_size` rows
+def parquet_chunks(csv_chunks, entity, row_group_size):
+    """Yield a Parquet file built from the CSV chunks of ``entity``.
+
+    pyarrow parses the CSV incrementally into record batches with the
+    export's column types; batches are gathered into row groups, and each
+    row group is handed on as soon as it is written, so only one row group
+    is held in memory at a time.
+    """
+    schema = arrow_schema(entity)
+    reader = pyarrow.csv.open_csv(ChunkReader(csv_chunks),
+                                  convert_options=pyarrow.csv.ConvertOptions(column_types=schema))
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema, compression='snappy')
+
+    batches, rows = [], 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= row_group_size:
+            # only whole row groups are written; the rest waits for the next batches
+            table = pyarrow.Table.from_batches(batches, schema)
+            full = rows // row_group_size * row_group_size
+            writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+            batches, rows = table.slice(full).to_batches(), rows - full
+            yield sink.take()
+    if batches:
+        writer.write_table(pyarrow.Table.from_batches(batches, schema), row_group_size=row_group_size)
+    writer.close()
+    yield sink.take()
+
+
+# function to gzip a stream of chunks
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# function to stream an export as CSV or Parquet, optionally gzipped
+def export_chunks(conn, entity, format='csv', compress=False, date_from=None, date_to=None):
+    """Return ``(chunks, filename, media type)`` for an export.
+
+    CSV comes straight from ``COPY ... TO STDOUT``; Parquet is converted
+    from that same stream. Nothing but the current chunk (or row group) is
+    held in memory, whatever the size of the table.
+    """
+    if entity not in EXPORTS:
+        raise ExportError(f'unknown export {entity}')
+    if format not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if format == 'parquet' and pyarrow is None:
+        raise ExportError('Parquet export needs pyarrow')
+
+    config = current_app.config
+    cur = conn.cursor()
+    statement = copy_statement(cur, entity, date_from, date_to)
+    cur.close()
+
+    stream = CopyStream(conn, statement, chunk_size=config['EXPORT_CHUNK_SIZE'])
+    chunks, filename, media_type = stream, f'{entity}.{format}', MEDIA_TYPES[format]
+    if format == 'parquet':
+        chunks = parquet_chunks(chunks, entity, config['EXPORT_ROW_GROUP_SIZE'])
+    if compress:
+        chunks = gzip_chunks(chunks, config['EXPORT_GZIP_LEVEL'])
+        filename, media_type = filename + '.gz', 'application/gzip'
+
+    # the COPY is stopped as soon as the consumer closes the stream, not whenever the generators are collected
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            stream.close()
+    return generate(), filename, media_type
+
+
+# ----- flask integration -----
+# function to register the export settings with an app
+def init_app(app):
+    app.config.setdefault('EXPORT_CHUNK_SIZE', int(os.environ.get('EXPORT_CHUNK_SIZE', 65536)))
+    app.config.setdefault('EXPORT_ROW_GROUP_SIZE', int(os.environ.get('EXPORT_ROW_GROUP_SIZE', 500000)))
+    app.config.setdefault('EXPORT_GZIP_LEVEL', int(os.environ.get('EXPORT_GZIP_LEVEL', 6)))
@@ -0,0 +1,125 @@
+# ----- settings -----
+# bucket edges of the property_facet table; must match property_price_bucket()/property_area_bucket()
+# from migration 5 (bucket n holds values in [edge n-1, edge n), bucket 0 everything below the first edge)
+PRICE_EDGES = [100000, 200000, 300000, 500000, 750000, 1000000, 1500000, 2000000, 3000000, 5000000]
+AREA_EDGES = [50, 75, 100, 150, 200, 300]
+MAX_ROOMS = 10 # rooms above this are counted as MAX_ROOMS ("10+")
+
+# range filters: query parameter prefix -> property column
+RANGE_FILTERS = {
+    'price': 'p.price',
+    'area': 'p.area_size',
+    'year': 'p.building_year',
+    'rooms': 'p.number_of_rooms',
+}
+
+
+# ----- filters -----
+# function to read the search filters of a request into a dict of float/int/str values
+def read_filters(args):
+    filters = {}
+    for name in RANGE_FILTERS:
+        for bound in ('min', 'max'):
+            value = args.get(f'{bound}_{name}', type=float)
+            if value is not None:
+                filters[f'{bound}_{name}'] = value
+    owner_id = args.get('owner_id', type=int)
+    if owner_id is not None:
+        filters['owner_id'] = owner_id
+    owner_last_name = args.get('owner_last_name', '').strip()
+    if owner_last_name:
+        filters['owner_last_name'] = owner_last_name.lower()
+    return filters
+
+
+# function to translate filters into SQL conditions on the property_listing projection (alias p)
+def filter_conditions(filters):
+    conditions = []
+    for name, column in RANGE_FILTERS.items():
+        if f'min_{name}' in filters:
+            conditions.append(f'{column} >= %(min_{name})s')
+        if f'max_{name}' in filters:
+            conditions.append(f'{column} <= %(max_{name})s')
+    if 'owner_id' in filters:
+        conditions.append('p.owner_id = %(owner_id)s')
+    if 'owner_last_name' in filters:
+        conditions.append('lower(p.last_name) = %(owner_last_name)s')
+    return conditions
+
+
+# ----- buckets -----
+# function to return the bucket of a value, same as width_bucket(value, edges) in SQL
+def bucket(value, edges):
+    return sum(1 for edge in edges if value >= edge)
+
+
+# function to return a readable label for every bucket of a list of edges
+def bucket_labels(edges):
+    labels = {0: f'< {edges[0]:,}'}
+    for i in range(1, len(edges)):
+        labels[i] = f'{edges[i - 1]:,} - {edges[i]:,}'
+    labels[len(edges)] = f'>= {edges[-1]:,}'
+    return labels
+
+
+# ----- facet counts -----
+# function to return facet counts (price buckets, room counts, decades) for the filtered properties
+def facet_counts(cur, filters):
+    """Return ``{'total': n, 'price': {...}, 'rooms': {...}, 'decade': {...}}``.
+
+    Counts come from the trigger-maintained ``property_facet`` table, which
+    has one row per (price bucket, area bucket, rooms, decade) combination, so
+    the cost depends on the number of combinations and not on the number of
+    properties. Range filters are applied at bucket granularity there. Owner
+    filters cannot be expressed on the aggregate; they select few properties,
+    so those counts are computed exactly from the owner's rows instead.
+    """
+    if 'owner_id' in filters or 'owner_last_name' in filters:
+        conditions = filter_conditions(filters)
+        source = f'''
+            SELECT property_price_bucket(p.price) AS price_bucket,
+                   COALESCE(LEAST(p.number_of_rooms, {MAX_ROOMS}), -1) AS rooms,
+                   COALESCE(p.building_year / 10 * 10, -1) AS decade, 1 AS count
+            FROM property_listing p
+            WHERE {' AND '.join(conditions)}
+        '''
+        params = filters
+    else:
+        conditions, params = [], {}
+        bounds = {
+            'price': ('price_bucket', lambda v: bucket(v, PRICE_EDGES)),
+            'area': ('area_bucket', lambda v: bucket(v, AREA_EDGES)),
+            'year': ('decade', lambda v: int(v) // 10 * 10),
+            'rooms': ('rooms', lambda v: min(int(v), MAX_ROOMS)),
+        }
+        for name, (column, to_bucket) in bounds.items():
+            for bound, op in (('min', '>='), ('max', '<=')):
+                if f'{bound}_{name}' in filters:
+                    conditions.append(f'{column} {op} %({bound}_{name})s')
+                    params[f'{bound}_{name}'] = to_bucket(filters[f'{bound}_{name}'])
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        source = f'SELECT price_bucket, rooms, decade, count FROM property_facet {where}'
+
+    # one pass over the (small) source for all three facets
+    cur.execute(f'''
+        SELECT price_bucket, rooms, decade, SUM(count)
+        FROM ({source}) f
+        GROUP BY GROUPING SETS ((price_bucket), (rooms), (decade), ())
+        ORDER BY price_bucket, rooms, decade
+    ''', params)
+
+    labels = bucket_labels(PRICE_EDGES)
+    result = {'total': 0, 'price': {}, 'rooms': {}, 'decade': {}}
+    for price_bucket, rooms, decade, count in cur.fetchall():
+        count = int(count)
+        if count <= 0:
+            continue
+        if price_bucket is not None:
+            result['price'][labels[price_bucket]] = count
+        elif rooms is not None:
+            result['rooms'][f'{MAX_ROOMS}+' if rooms == MAX_ROOMS else ('unknown' if rooms < 0 else str(rooms))] = count
+        elif decade is not None:
+            result['decade']['unknown' if decade < 0 else f'{decade}s'] = count
+        else:
+            result['total'] = count
+    return result
@@ -0,0 +1,121 @@
+# ----- imports -----
+import math
+
+
+# ----- settings -----
+EARTH_RADIUS_KM = 6371.0
+
+# location.grid_cell divides the globe into cells of 1/GRID_CELLS_PER_DEGREE degrees (0.1° ~ 11 km);
+# must match the generated column created by migration 4
+GRID_CELLS_PER_DEGREE = 10
+GRID_COLUMNS = 360 * GRID_CELLS_PER_DEGREE
+
+# above this many grid rows a box is filtered on latitude/longitude alone, one range per row stops paying off
+MAX_GRID_ROWS = 100
+
+
+# ----- geometry -----
+# function to return the great-circle distance between two points in kilometres
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# function to return the (min_lat, max_lat, min_lon, max_lon) box that contains a circle
+def bounding_box(lat, lon, radius_km):
+    """Return the box around the circle of ``radius_km`` around (lat, lon).
+
+    Longitudes wrap: a circle crossing the antimeridian gets a box with
+    ``min_lon > max_lon`` (e.g. 179.5 to -179.5), see ``longitude_spans``.
+    Near the poles the box spans every longitude.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    # meridians converge towards the poles, so the same distance spans more degrees of longitude
+    cos_lat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if dlon >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, (lon - dlon + 180) % 360 - 180, (lon + dlon + 180) % 360 - 180
+
+
+# function to split the longitudes of a box into one or two (min_lon, max_lon) spans that do not cross ±180
+def longitude_spans(min_lon, max_lon):
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+# function to return the grid cell of a point, same formula as the location.grid_cell column
+def grid_cell(lat, lon):
+    row = min(math.floor((lat + 90) * GRID_CELLS_PER_DEGREE), 180 * GRID_CELLS_PER_DEGREE - 1)
+    column = min(math.floor((lon + 180) * GRID_CELLS_PER_DEGREE), GRID_COLUMNS - 1)
+    return row * GRID_COLUMNS + column
+
+
+# function to return the grid cell ranges covering a box, one contiguous range per grid row
+def grid_ranges(min_lat, max_lat, min_lon, max_lon):
+    first, last = grid_cell(min_lat, min_lon), grid_cell(max_lat, max_lon)
+    first_row, last_row = first // GRID_COLUMNS, last // GRID_COLUMNS
+    first_column, last_column = first % GRID_COLUMNS, last % GRID_COLUMNS
+    return [(row * GRID_COLUMNS + first_column, row * GRID_COLUMNS + last_column)
+            for row in range(first_row, last_row + 1)]
+
+
+# ----- search -----
+# distance in kilometres between listing `p` and the point (%(lat)s, %(lon)s), computed in SQL
+HAVERSINE_SQL = '''
+    2 * 6371.0 * asin(least(1.0, sqrt(
+        power(sin(radians(p.latitude - %(lat)s) / 2), 2)
+        + cos(radians(%(lat)s)) * cos(radians(p.latitude)) * power(sin(radians(p.longitude - %(lon)s) / 2), 2)
+    )))
+'''
+
+
+# function to find properties in a box, optionally within a radius of (lat, lon), nearest first
+def search_properties(cur, lat, lon, box, radius_km=None, limit=50, conditions=(), params=None):
+    """Return property rows with a ``distance_km`` column, nearest to (lat, lon) first.
+
+    The box is translated into grid cell ranges so PostgreSQL reads only the
+    matching slices of the ``property_listing_grid_cell_idx`` B-tree, then the exact
+    box and (for radius searches) the haversine distance refine the result.
+    Extra SQL ``conditions`` on ``p`` are ANDed with their ``params``. A box
+    with ``min_lon > max_lon`` crosses the antimeridian (see ``bounding_box``).
+    """
+    min_lat, max_lat, min_lon, max_lon = box
+    values = dict(params or {}, lat=lat, lon=lon, min_lat=min_lat, max_lat=max_lat, radius=radius_km, limit=limit)
+
+    # a box crossing the antimeridian is searched as two boxes, one on each side
+    spans = longitude_spans(min_lon, max_lon)
+    longitudes = []
+    ranges = []
+    for i, (span_min, span_max) in enumerate(spans):
+        longitudes.append(f'p.longitude BETWEEN %(min_lon_{i})s AND %(max_lon_{i})s')
+        values[f'min_lon_{i}'], values[f'max_lon_{i}'] = span_min, span_max
+        ranges += grid_ranges(min_lat, max_lat, span_min, span_max)
+    where = ['p.latitude BETWEEN %(min_lat)s AND %(max_lat)s', '(' + ' OR '.join(longitudes) + ')']
+    if len(ranges) <= MAX_GRID_ROWS * len(spans):
+        cells = []
+        for i, (low, high) in enumerate(ranges):
+            cells.append(f'p.grid_cell BETWEEN %(cell_low_{i})s AND %(cell_high_{i})s')
+            values[f'cell_low_{i}'], values[f'cell_high_{i}'] = low, high
+        where.insert(0, '(' + ' OR '.join(cells) + ')')
+    if radius_km is not None:
+        where.append(f'{HAVERSINE_SQL} <= %(radius)s')
+    where += list(conditions)
+
+    cur.execute(f'''
+        SELECT p.property_id, p.number_of_rooms, p.building_year, p.area_size, p.price, p.location_id, p.owner_id,
+               p.first_name, p.last_name, p.latitude, p.longitude, {HAVERSINE_SQL} AS distance_km
+        FROM property_listing p
+        WHERE {' AND '.join(where)}
+        ORDER BY distance_km, p.property_id
+        LIMIT %(limit)s
+    ''', values)
+
+    # combine the column names and row values into a list of dictionaries
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
@@ -0,0 +1,52 @@
+# ----- imports -----
+import multiprocessing
+import os
+import time
+
+
+# ----- server -----
+# gunicorn settings, overridable through the environment; `gunicorn -c gunicorn.conf.py` serves app:create_app()
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# pre-forked worker processes with a thread pool each; a request holds one pool connection while it runs
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# every thread may need a connection at the same time, so size the per-worker pool to the thread count
+os.environ.setdefault('DB_POOL_MAXCONN', str(threads))
+
+# importing the app in the master lets workers share its memory and fork in milliseconds; kill -HUP then
+# restarts the workers gracefully but keeps the preloaded code, so deploys of new code need a full restart
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+# finish in-flight requests on reload/shutdown, recycle workers now and then to bound memory growth
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+# ----- hooks -----
+# migrate and create the due payment partitions once in the master before any worker starts, so workers never race on the schema
+def on_starting(server):
+    from app import create_app, setup_db
+
+    started = time.perf_counter()
+    app = create_app()
+    with app.app_context():
+        setup_db()
+    server.log.info('Schema checked in %.0fms', (time.perf_counter() - started) * 1000)
+
+
+# the pool is created lazily per process (see db.get_pool), so a worker inherits no connection from the master
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+# log how long each worker took to become ready
+def post_worker_init(worker):
+    worker.log.info('Worker %s ready %.0fms after fork', worker.pid, (time.perf_counter() - worker.forked_at) * 1000)
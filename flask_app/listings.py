@@ -0,0 +1,68 @@
+# ----- settings -----
+# every listing projection of migration 9: its key and the view with the rows it must hold
+PROJECTIONS = {
+    'property_listing': ('property_id', 'property_listing_source'),
+    'contract_listing': ('contract_id', 'contract_listing_source'),
+}
+
+# base tables the projections are joined from; locked while they are rebuilt
+SOURCE_TABLES = ('property', 'location', 'owner', 'agent', 'client', 'person', 'contract')
+
+# ids listed per kind of drift by check()
+MAX_SAMPLE = 10
+
+
+# ----- consistency -----
+# function to compare every projection with the rows it is built from
+def check(conn):
+    """Return ``{projection: {'missing': [...], 'stale': [...], 'orphaned': [...], 'counts': {...}}}``.
+
+    ``missing`` rows exist in the base tables but not in the projection,
+    ``stale`` rows differ from their base rows and ``orphaned`` rows no
+    longer have base rows. Only the first ``MAX_SAMPLE`` ids of each kind are
+    listed, ``counts`` has the totals. Both sides are read in one snapshot,
+    so concurrent writes are never reported as drift.
+    """
+    cur = conn.cursor()
+    cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+    result = {}
+    for table, (key, source) in PROJECTIONS.items():
+        cur.execute(f'''
+            WITH expected AS (SELECT * FROM {source} EXCEPT ALL SELECT * FROM {table}),
+                 actual AS (SELECT * FROM {table} EXCEPT ALL SELECT * FROM {source})
+            SELECT CASE WHEN a.{key} IS NULL THEN 'missing' WHEN e.{key} IS NULL THEN 'orphaned' ELSE 'stale' END,
+                   COALESCE(e.{key}, a.{key})
+            FROM expected e
+            FULL JOIN actual a ON a.{key} = e.{key}
+            ORDER BY 2
+        ''')
+        drift = {'missing': [], 'stale': [], 'orphaned': []}
+        counts = dict.fromkeys(drift, 0)
+        for kind, id in cur.fetchall():
+            counts[kind] += 1
+            if len(drift[kind]) < MAX_SAMPLE:
+                drift[kind].append(id)
+        result[table] = dict(drift, counts=counts)
+    conn.rollback()
+    cur.close()
+    return result
+
+
+# function to recompute every projection from scratch
+def rebuild(conn):
+    """Refill ``property_listing`` and ``contract_listing`` from the base tables.
+
+    Runs in one transaction with the base tables locked against concurrent
+    writers; list and search readers wait for the new rows to commit.
+    Returns the number of rows written per projection.
+    """
+    cur = conn.cursor()
+    cur.execute(f"LOCK TABLE {', '.join(SOURCE_TABLES)} IN SHARE MODE")
+    cur.execute(f"TRUNCATE {', '.join(PROJECTIONS)}")
+    rows = {}
+    for table, (_, source) in PROJECTIONS.items():
+        cur.execute(f'INSERT INTO {table} SELECT * FROM {source}')
+        rows[table] = cur.rowcount
+    conn.commit()
+    cur.close()
+    return rows
@@ -0,0 +1,165 @@
+# ----- imports -----
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app
+import versions
+from db import get_db_connection
+from person_search import SEARCH_TEXT as PERSON_SEARCH_TEXT
+
+
+# ----- lookup lists -----
+# option lists of the create_* forms: name -> (id column, label expression, FROM clause, tables it reads)
+LOOKUPS = {
+    'addresses': ('a.address_id', "concat_ws(' ', a.street_number, a.address_line, a.postal_code, a.country)",
+                  'address a', ('address',)),
+    'persons': ('p.person_id', "p.first_name || ' ' || p.last_name",
+                'person p', ('person',)),
+    'owners': ('o.owner_id', "p.first_name || ' ' || p.last_name",
+               'owner o JOIN person p ON o.person_id = p.person_id', ('owner', 'person')),
+    'agents': ('ag.agent_id', "p.first_name || ' ' || p.last_name",
+               'agent ag JOIN person p ON ag.person_id = p.person_id', ('agent', 'person')),
+    'clients': ('cl.client_id', "p.first_name || ' ' || p.last_name",
+                'client cl JOIN person p ON cl.person_id = p.person_id', ('client', 'person')),
+    'locations': ('l.location_id', "l.latitude || ', ' || l.longitude",
+                  'location l', ('location',)),
+    'properties': ('pr.property_id', "'Property #' || pr.property_id || ' (' || pr.number_of_rooms || ' rooms, ' || pr.price || ')'",
+                   'property pr', ('property',)),
+    'contracts': ('c.contract_id', "'Contract #' || c.contract_id || ' (' || c.sign_date || ')'",
+                  'contract c', ('contract',)),
+}
+
+# lookups of persons, searched through the trigram-indexed person search text (name, email, phone) instead of the label
+PERSON_LOOKUPS = ('persons', 'owners', 'agents', 'clients')
+
+# what a form gets for one lookup: the (id, label) rows, or typeahead=True when the list is too long to inline
+Lookup = namedtuple('Lookup', ['rows', 'typeahead'])
+
+
+# ----- cache -----
+class LookupCache:
+    """LRU cache of lookup results with a TTL and bounds on entries and total rows.
+
+    Every entry remembers the version tag of the tables it was read from
+    (see versions.py) and is only served while the tag still matches. The
+    versions are bumped by triggers, so a write through any worker, an
+    import or ``psql`` makes every worker re-read the list on its next use.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=256, max_rows=200_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict() # key -> (expires, tag, rows, value)
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, tag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != tag:
+                if entry is not None:
+                    self._drop(key)
+                    if entry[1] != tag:
+                        self._stats['invalidations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[3]
+
+    def put(self, key, tag, value, rows):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tag, rows, value)
+            self._rows += rows
+            # evict least recently used entries until both bounds hold again
+            while len(self._entries) > self.max_entries or (self._rows > self.max_rows and len(self._entries) > 1):
+                self._drop(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _drop(self, key):
+        self._rows -= self._entries.pop(key)[2]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), rows=self._rows)
+
+
+# ----- flask integration -----
+# function to return the lookup cache of the current app
+def get_cache():
+    return current_app.extensions['lookup_cache']
+
+
+# function to return the version tag of the tables a lookup reads (one primary key lookup)
+def lookup_tag(cur, name):
+    return versions.version_tag(versions.table_versions(cur, LOOKUPS[name][3]))
+
+
+# function to return the options of a create_* form field, cached until one of its tables changes
+def options(name):
+    key = ('options', name)
+    cur = get_db_connection().cursor()
+    tag = lookup_tag(cur, name)
+    lookup = get_cache().get(key, tag)
+    if lookup is None:
+        id_column, label, source, _ = LOOKUPS[name]
+        threshold = current_app.config['LOOKUP_TYPEAHEAD_THRESHOLD']
+
+        # read one row more than the threshold to find out whether the list is short enough to inline
+        cur.execute(f'SELECT {id_column}, {label} FROM {source} ORDER BY {id_column} LIMIT %s', (threshold + 1,))
+        rows = cur.fetchall()
+
+        lookup = Lookup(None, True) if len(rows) > threshold else Lookup(rows, False)
+        get_cache().put(key, tag, lookup, len(lookup.rows or ()))
+    cur.close()
+    return lookup
+
+
+# function to return up to `limit` options whose label or id matches a typeahead query, cached
+def search(name, q, after=None, limit=20):
+    """Return ``(id, label)`` rows for the typeahead of long lists.
+
+    Matches on the id or a case-insensitive substring of the label (of the
+    name, email or phone number for persons); ``after`` continues an
+    incremental listing after the given id.
+    """
+    q = q.strip().lower()
+    key = ('search', name, q, after, limit)
+    cur = get_db_connection().cursor()
+    tag = lookup_tag(cur, name)
+    rows = get_cache().get(key, tag)
+    if rows is None:
+        id_column, label, source, _ = LOOKUPS[name]
+        conditions, params = [], []
+        if q:
+            text = PERSON_SEARCH_TEXT if name in PERSON_LOOKUPS else f'lower({label})'
+            conditions.append(f'({text} LIKE %s OR {id_column}::text = %s)')
+            params += ['%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%', q]
+        if after is not None:
+            conditions.append(f'{id_column} > %s')
+            params.append(after)
+        where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        cur.execute(f'SELECT {id_column}, {label} FROM {source}{where} ORDER BY {id_column} LIMIT %s', params + [limit])
+        rows = cur.fetchall()
+        get_cache().put(key, tag, rows, len(rows))
+    cur.close()
+    return rows
+
+
+# function to register the lookup cache with an app
+def init_app(app):
+    app.config.setdefault('LOOKUP_CACHE_TTL', float(os.environ.get('LOOKUP_CACHE_TTL', 60)))
+    app.config.setdefault('LOOKUP_CACHE_MAX_ENTRIES', int(os.environ.get('LOOKUP_CACHE_MAX_ENTRIES', 256)))
+    app.config.setdefault('LOOKUP_CACHE_MAX_ROWS', int(os.environ.get('LOOKUP_CACHE_MAX_ROWS', 200_000)))
+    app.config.setdefault('LOOKUP_TYPEAHEAD_THRESHOLD', int(os.environ.get('LOOKUP_TYPEAHEAD_THRESHOLD', 500)))
+    app.extensions['lookup_cache'] = LookupCache(
+        ttl=app.config['LOOKUP_CACHE_TTL'],
+        max_entries=app.config['LOOKUP_CACHE_MAX_ENTRIES'],
+        max_rows=app.config['LOOKUP_CACHE_MAX_ROWS'],
+    )
@@ -0,0 +1,199 @@
+# ----- imports -----
+import bisect
+import threading
+import time
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+import db
+
+
+# ----- settings -----
+# histogram bucket upper bounds; seconds for latencies, rows for result sizes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+# (metric, ConnectionPool.stats() key, type, help) exported from the pool counters
+POOL_METRICS = [
+    ('db_pool_connects_total', 'connects', 'counter', 'Physical connections opened.'),
+    ('db_pool_connect_seconds_total', 'connect_time', 'counter', 'Seconds spent opening connections.'),
+    ('db_pool_checkouts_total', 'checkouts', 'counter', 'Connections checked out of the pool.'),
+    ('db_pool_waits_total', 'waits', 'counter', 'Checkouts that had to wait for a free connection.'),
+    ('db_pool_wait_seconds_total', 'wait_time', 'counter', 'Seconds spent waiting for a free connection.'),
+    ('db_pool_timeouts_total', 'timeouts', 'counter', 'Checkouts that gave up waiting.'),
+    ('db_pool_health_check_failures_total', 'health_check_failures', 'counter', 'Stale connections replaced on checkout.'),
+    ('db_pool_in_use', 'in_use', 'gauge', 'Connections currently checked out.'),
+    ('db_pool_size', 'size', 'gauge', 'Open connections.'),
+    ('db_pool_max_size', 'maxconn', 'gauge', 'Upper bound of open connections.'),
+]
+
+# read replica routing counters (only with DATABASE_REPLICA_URLS)
+REPLICA_METRICS = [
+    ('db_replica_reads_total', 'reads', 'counter', 'Requests served from a read replica.'),
+    ('db_replica_failovers_total', 'failovers', 'counter', 'Replica checkouts that failed and moved on to the next replica.'),
+    ('db_replica_behind_total', 'behind', 'counter', "Replicas skipped because they had not replayed the client's last write."),
+    ('db_replica_primary_fallbacks_total', 'primary_fallbacks', 'counter', 'Read-only requests sent to the primary because no replica qualified.'),
+]
+
+
+# ----- metric types -----
+# function to escape a label value for the Prometheus text format
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# function to format label names and values, e.g. {route="show_property",le="0.1"}
+def format_labels(names, values, **extra):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra.items())]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative histogram per combination of label values.
+
+    Observing is a bisect and two additions under a lock, about a
+    microsecond, so it can stay on for every request and statement.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {} # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(values, list(counts), total) for values, (counts, total) in self._series.items()]
+        for values, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, values, le=bound)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.value}']
+
+
+# ----- registry -----
+class Metrics:
+    """The metrics of one app, kept per process (each gunicorn worker reports its own)."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = Gauge('http_requests_in_flight', 'Requests currently being handled.')
+        self.request_seconds = Histogram('http_request_duration_seconds', 'Request latency, until the response body is sent.',
+                                         ('route', 'method', 'status'))
+        self.db_seconds = Histogram('http_request_db_seconds', 'Time spent executing SQL per request.', ('route',))
+        self.render_seconds = Histogram('http_request_render_seconds', 'Time spent rendering templates per request.', ('route',))
+        self.checkout_seconds = Histogram('db_pool_checkout_seconds', 'Time to check a connection out of the pool, including waits and connects.')
+        self.query_rows = Histogram('db_query_rows', 'Rows returned per statement.', ('route',), buckets=ROW_BUCKETS)
+        self.histograms = [self.request_seconds, self.db_seconds, self.render_seconds, self.checkout_seconds, self.query_rows]
+
+    def render(self):
+        lines = ['# HELP process_start_time_seconds Start time of the process since the epoch.',
+                 '# TYPE process_start_time_seconds gauge', f'process_start_time_seconds {self.started}']
+        lines += self.in_flight.render()
+        for histogram in self.histograms:
+            lines += histogram.render()
+
+        # pool counters are kept by the pool itself and only read when scraped
+        pool = db.get_pool().stats()
+        for name, key, kind, help in POOL_METRICS:
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {pool[key]}']
+        if db.get_replicas() is not None:
+            replicas = db.get_replicas().stats()
+            for name, key, kind, help in REPLICA_METRICS:
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {replicas[key]}']
+        return '\n'.join(lines) + '\n'
+
+
+# ----- request hooks -----
+# function to return the route label of the current request (the endpoint, so unknown URLs share one label)
+def route_label():
+    return request.endpoint or 'unmatched'
+
+
+# before each request: start the clock and the per-request DB/render totals
+def start_request():
+    g.request_started = time.perf_counter()
+    g.db_seconds = 0.0
+    g.render_seconds = 0.0
+    current_app.extensions['metrics'].in_flight.add(1)
+
+
+# after each request: remember the status for the latency histogram
+def record_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+# on teardown, after streamed bodies are sent as well: record the request
+def finish_request(exception=None):
+    if 'request_started' not in g:
+        return
+    metrics = current_app.extensions['metrics']
+    route = route_label()
+    status = 500 if exception is not None else g.get('response_status', 500)
+    metrics.request_seconds.observe(time.perf_counter() - g.request_started, route, request.method, status)
+    metrics.db_seconds.observe(g.db_seconds, route)
+    metrics.render_seconds.observe(g.render_seconds, route)
+    if 'db_checkout_seconds' in g:
+        metrics.checkout_seconds.observe(g.db_checkout_seconds)
+    metrics.in_flight.add(-1)
+
+
+# template signals: time spent in render_template/stream_template
+def start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+
+def finish_render(sender, template, context, **extra):
+    if 'render_started' in g:
+        g.render_seconds = g.get('render_seconds', 0.0) + time.perf_counter() - g.pop('render_started')
+
+
+# query hook of db.InstrumentedCursor: adds the statement to the request's DB time and row histogram
+def observe_query(cursor, query, params, seconds):
+    if not has_request_context() or 'request_started' not in g:
+        return
+    g.db_seconds += seconds
+    if cursor.rowcount >= 0 and cursor.name is None: # named cursors only know their rows while fetching
+        current_app.extensions['metrics'].query_rows.observe(cursor.rowcount, route_label())
+
+
+# ----- flask integration -----
+# function to collect request, render, query and pool metrics for an app
+def init_app(app):
+    app.extensions['metrics'] = Metrics()
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    if observe_query not in db.QUERY_HOOKS:
+        db.QUERY_HOOKS.append(observe_query)
@@ -0,0 +1,963 @@
+# ----- imports -----
+import logging
+import psycopg2
+from psycopg2 import errors
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+logger = logging.getLogger(__name__)
+
+# key of the PostgreSQL advisory lock held while migrating, so only one process migrates at a time
+MIGRATION_LOCK_ID = 72_410_001
+
+
+# ----- migrations -----
+# ordered list of (version, description, statements); never edit a released migration, append a new one
+MIGRATIONS = [
+    (1, 'initial schema', [
+        # create address table
+        '''
+        CREATE TABLE IF NOT EXISTS address (
+            address_id SERIAL PRIMARY KEY,
+            street_number INTEGER,
+            address_line VARCHAR(255),
+            country VARCHAR(100),
+            postal_code VARCHAR(20)
+        );
+        ''',
+
+        # create person table
+        '''
+        CREATE TABLE IF NOT EXISTS person (
+            person_id SERIAL PRIMARY KEY,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            date_of_birth DATE NOT NULL,
+            phone_number VARCHAR(20),
+            email VARCHAR(255),
+            address_id INTEGER,
+            FOREIGN KEY (address_id) REFERENCES address(address_id)
+        );
+        ''',
+
+        # create owner table
+        '''
+        CREATE TABLE IF NOT EXISTS owner (
+            owner_id SERIAL PRIMARY KEY,
+            person_id INTEGER NOT NULL,
+            resident_status VARCHAR(50),
+            acquisition_date DATE,
+            FOREIGN KEY (person_id) REFERENCES person(person_id)
+        );
+        ''',
+
+        # create agent table
+        '''
+        CREATE TABLE IF NOT EXISTS agent (
+            agent_id SERIAL PRIMARY KEY,
+            person_id INTEGER NOT NULL,
+            employment_date DATE NOT NULL,
+            FOREIGN KEY (person_id) REFERENCES person(person_id)
+        );
+        ''',
+
+        # create client table
+        '''
+        CREATE TABLE IF NOT EXISTS client (
+            client_id SERIAL PRIMARY KEY,
+            person_id INTEGER NOT NULL,
+            purchase_date DATE,
+            FOREIGN KEY (person_id) REFERENCES person(person_id)
+        );
+        ''',
+
+        # create location table
+        '''
+        CREATE TABLE IF NOT EXISTS location (
+            location_id SERIAL PRIMARY KEY,
+            latitude DECIMAL NOT NULL,
+            longitude DECIMAL NOT NULL
+        );
+        ''',
+
+        # create property table with a foreign key reference to the location table
+        '''
+        CREATE TABLE IF NOT EXISTS property (
+            property_id SERIAL PRIMARY KEY,
+            number_of_rooms INTEGER,
+            building_year INTEGER,
+            area_size DECIMAL,
+            price DECIMAL NOT NULL,
+            location_id INTEGER, -- Foreign key reference to location table
+            owner_id INTEGER NOT NULL, -- New column for owner_id
+            FOREIGN KEY (location_id) REFERENCES location(location_id),
+            FOREIGN KEY (owner_id) REFERENCES owner(owner_id) -- Foreign key reference to owner table
+        );
+        ''',
+
+        # create contract table
+        '''
+        CREATE TABLE IF NOT EXISTS contract (
+            contract_id SERIAL PRIMARY KEY,
+            sign_date DATE NOT NULL,
+            agent_id INTEGER NOT NULL,
+            client_id INTEGER NOT NULL,
+            property_id INTEGER NOT NULL,
+            FOREIGN KEY (agent_id) REFERENCES agent(agent_id),
+            FOREIGN KEY (client_id) REFERENCES client(client_id),
+            FOREIGN KEY (property_id) REFERENCES property(property_id)
+        );
+        ''',
+
+        # create payment table
+        '''
+        CREATE TABLE IF NOT EXISTS payment (
+            payment_id SERIAL PRIMARY KEY,
+            amount DECIMAL NOT NULL,
+            date DATE NOT NULL,
+            contract_id INTEGER NOT NULL,
+            FOREIGN KEY (contract_id) REFERENCES contract(contract_id)
+        );
+        ''',
+    ]),
+
+    (2, 'foreign key and filter indexes', [
+        # foreign keys are not indexed automatically; without these every join or lookup from the referenced side is a seq scan
+        'CREATE INDEX IF NOT EXISTS person_address_id_idx ON person (address_id);',
+        'CREATE INDEX IF NOT EXISTS owner_person_id_idx ON owner (person_id);',
+        'CREATE INDEX IF NOT EXISTS agent_person_id_idx ON agent (person_id);',
+        'CREATE INDEX IF NOT EXISTS client_person_id_idx ON client (person_id);',
+        'CREATE INDEX IF NOT EXISTS property_owner_id_idx ON property (owner_id);',
+        'CREATE INDEX IF NOT EXISTS property_location_id_idx ON property (location_id);',
+        'CREATE INDEX IF NOT EXISTS contract_agent_id_idx ON contract (agent_id);',
+        'CREATE INDEX IF NOT EXISTS contract_client_id_idx ON contract (client_id);',
+        'CREATE INDEX IF NOT EXISTS contract_property_id_idx ON contract (property_id);',
+
+        # per-contract payment history, ordered by date, served from the index alone
+        'CREATE INDEX IF NOT EXISTS payment_contract_id_date_idx ON payment (contract_id, date);',
+
+        # date filters on the growing history tables
+        'CREATE INDEX IF NOT EXISTS contract_sign_date_idx ON contract (sign_date);',
+        'CREATE INDEX IF NOT EXISTS payment_date_idx ON payment (date);',
+    ]),
+
+    (3, 'person email index for bulk import lookups', [
+        # the bulk import matches owners and duplicate persons by email
+        'CREATE INDEX IF NOT EXISTS person_email_idx ON person (email);',
+    ]),
+
+    (4, 'location grid cell for proximity search', [
+        # 0.1 degree grid cell (row * 3600 + column), kept up to date by PostgreSQL itself; see geo.grid_cell()
+        '''
+        ALTER TABLE location ADD COLUMN IF NOT EXISTS grid_cell INTEGER GENERATED ALWAYS AS (
+            LEAST(floor((latitude + 90) * 10), 1799)::integer * 3600 + LEAST(floor((longitude + 180) * 10), 3599)::integer
+        ) STORED;
+        ''',
+        # coordinates are included so box filters run as index-only scans
+        'CREATE INDEX IF NOT EXISTS location_grid_cell_idx ON location (grid_cell) INCLUDE (latitude, longitude);',
+    ]),
+
+    (5, 'property facet counts and search indexes', [
+        # bucket functions shared by the trigger and the search code (edges mirror facets.PRICE_EDGES/AREA_EDGES)
+        '''
+        CREATE OR REPLACE FUNCTION property_price_bucket(price NUMERIC) RETURNS INTEGER
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT width_bucket(price, ARRAY[100000, 200000, 300000, 500000, 750000, 1000000, 1500000, 2000000, 3000000, 5000000]::NUMERIC[])
+        $$;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION property_area_bucket(area_size NUMERIC) RETURNS INTEGER
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT COALESCE(width_bucket(area_size, ARRAY[50, 75, 100, 150, 200, 300]::NUMERIC[]), -1)
+        $$;
+        ''',
+
+        # number of properties per (price bucket, area bucket, rooms, decade); unknown rooms/decade are -1
+        '''
+        CREATE TABLE IF NOT EXISTS property_facet (
+            price_bucket INTEGER NOT NULL,
+            area_bucket INTEGER NOT NULL,
+            rooms INTEGER NOT NULL,
+            decade INTEGER NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (price_bucket, area_bucket, rooms, decade)
+        );
+        ''',
+
+        # statement-level triggers see all changed rows at once, so bulk loads update each bucket only once
+        '''
+        CREATE OR REPLACE FUNCTION property_facet_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE property_facet f SET count = f.count - d.count
+                FROM (
+                    SELECT property_price_bucket(price) AS price_bucket, property_area_bucket(area_size) AS area_bucket,
+                           COALESCE(LEAST(number_of_rooms, 10), -1) AS rooms, COALESCE(building_year / 10 * 10, -1) AS decade,
+                           count(*) AS count
+                    FROM old_rows
+                    GROUP BY 1, 2, 3, 4
+                ) d
+                WHERE f.price_bucket = d.price_bucket AND f.area_bucket = d.area_bucket
+                  AND f.rooms = d.rooms AND f.decade = d.decade;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO property_facet (price_bucket, area_bucket, rooms, decade, count)
+                SELECT property_price_bucket(price), property_area_bucket(area_size),
+                       COALESCE(LEAST(number_of_rooms, 10), -1), COALESCE(building_year / 10 * 10, -1), count(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (price_bucket, area_bucket, rooms, decade) DO UPDATE SET count = property_facet.count + EXCLUDED.count;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS property_facet_insert ON property;',
+        'DROP TRIGGER IF EXISTS property_facet_update ON property;',
+        'DROP TRIGGER IF EXISTS property_facet_delete ON property;',
+        '''
+        CREATE TRIGGER property_facet_insert AFTER INSERT ON property
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION property_facet_maintain();
+        ''',
+        '''
+        CREATE TRIGGER property_facet_update AFTER UPDATE ON property
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION property_facet_maintain();
+        ''',
+        '''
+        CREATE TRIGGER property_facet_delete AFTER DELETE ON property
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION property_facet_maintain();
+        ''',
+
+        # backfill from the existing properties
+        'TRUNCATE property_facet;',
+        '''
+        INSERT INTO property_facet (price_bucket, area_bucket, rooms, decade, count)
+        SELECT property_price_bucket(price), property_area_bucket(area_size),
+               COALESCE(LEAST(number_of_rooms, 10), -1), COALESCE(building_year / 10 * 10, -1), count(*)
+        FROM property
+        GROUP BY 1, 2, 3, 4;
+        ''',
+
+        # composite indexes for the common filter combinations (equality column first, range column second)
+        'CREATE INDEX IF NOT EXISTS property_rooms_price_idx ON property (number_of_rooms, price);',
+        'CREATE INDEX IF NOT EXISTS property_year_price_idx ON property (building_year, price);',
+        'CREATE INDEX IF NOT EXISTS property_price_area_idx ON property (price, area_size);',
+        'CREATE INDEX IF NOT EXISTS person_lower_last_name_idx ON person (lower(last_name));',
+    ]),
+
+    (6, 'payment reporting aggregates', [
+        # paid-to-date per contract; the outstanding balance is property.price - paid
+        '''
+        CREATE TABLE IF NOT EXISTS contract_balance (
+            contract_id INTEGER PRIMARY KEY,
+            paid NUMERIC NOT NULL DEFAULT 0,
+            payments BIGINT NOT NULL DEFAULT 0
+        );
+        ''',
+
+        # revenue per agent and calendar month (first day of the month); month first so one month pages by agent
+        '''
+        CREATE TABLE IF NOT EXISTS agent_revenue_monthly (
+            month DATE NOT NULL,
+            agent_id INTEGER NOT NULL,
+            revenue NUMERIC NOT NULL,
+            payments BIGINT NOT NULL,
+            PRIMARY KEY (month, agent_id)
+        );
+        ''',
+        'CREATE INDEX IF NOT EXISTS agent_revenue_monthly_agent_idx ON agent_revenue_monthly (agent_id, month);',
+
+        # payments add to / subtract from both aggregates, grouped per statement like property_facet_maintain()
+        '''
+        CREATE OR REPLACE FUNCTION payment_report_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE contract_balance b SET paid = b.paid - d.amount, payments = b.payments - d.payments
+                FROM (SELECT contract_id, sum(amount) AS amount, count(*) AS payments FROM old_rows GROUP BY 1) d
+                WHERE b.contract_id = d.contract_id;
+
+                UPDATE agent_revenue_monthly r SET revenue = r.revenue - d.amount, payments = r.payments - d.payments
+                FROM (
+                    SELECT date_trunc('month', o.date)::date AS month, c.agent_id, sum(o.amount) AS amount, count(*) AS payments
+                    FROM old_rows o
+                    JOIN contract c ON c.contract_id = o.contract_id
+                    GROUP BY 1, 2
+                ) d
+                WHERE r.month = d.month AND r.agent_id = d.agent_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO contract_balance (contract_id, paid, payments)
+                SELECT contract_id, sum(amount), count(*)
+                FROM new_rows
+                GROUP BY 1
+                ON CONFLICT (contract_id) DO UPDATE
+                SET paid = contract_balance.paid + EXCLUDED.paid, payments = contract_balance.payments + EXCLUDED.payments;
+
+                INSERT INTO agent_revenue_monthly (month, agent_id, revenue, payments)
+                SELECT date_trunc('month', n.date)::date, c.agent_id, sum(n.amount), count(*)
+                FROM new_rows n
+                JOIN contract c ON c.contract_id = n.contract_id
+                GROUP BY 1, 2
+                ON CONFLICT (month, agent_id) DO UPDATE
+                SET revenue = agent_revenue_monthly.revenue + EXCLUDED.revenue,
+                    payments = agent_revenue_monthly.payments + EXCLUDED.payments;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS payment_report_insert ON payment;',
+        'DROP TRIGGER IF EXISTS payment_report_update ON payment;',
+        'DROP TRIGGER IF EXISTS payment_report_delete ON payment;',
+        '''
+        CREATE TRIGGER payment_report_insert AFTER INSERT ON payment
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER payment_report_update AFTER UPDATE ON payment
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER payment_report_delete AFTER DELETE ON payment
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+
+        # new contracts start with nothing paid; moving a contract to another agent moves its revenue along
+        '''
+        CREATE OR REPLACE FUNCTION contract_report_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO contract_balance (contract_id)
+                SELECT contract_id FROM new_rows
+                ON CONFLICT (contract_id) DO NOTHING;
+            ELSIF TG_OP = 'DELETE' THEN
+                DELETE FROM contract_balance b USING old_rows o WHERE b.contract_id = o.contract_id;
+            ELSE
+                UPDATE agent_revenue_monthly r SET revenue = r.revenue - d.amount, payments = r.payments - d.payments
+                FROM (
+                    SELECT date_trunc('month', p.date)::date AS month, o.agent_id, sum(p.amount) AS amount, count(*) AS payments
+                    FROM old_rows o
+                    JOIN new_rows n ON n.contract_id = o.contract_id AND n.agent_id <> o.agent_id
+                    JOIN payment p ON p.contract_id = o.contract_id
+                    GROUP BY 1, 2
+                ) d
+                WHERE r.month = d.month AND r.agent_id = d.agent_id;
+
+                INSERT INTO agent_revenue_monthly (month, agent_id, revenue, payments)
+                SELECT date_trunc('month', p.date)::date, n.agent_id, sum(p.amount), count(*)
+                FROM new_rows n
+                JOIN old_rows o ON o.contract_id = n.contract_id AND o.agent_id <> n.agent_id
+                JOIN payment p ON p.contract_id = n.contract_id
+                GROUP BY 1, 2
+                ON CONFLICT (month, agent_id) DO UPDATE
+                SET revenue = agent_revenue_monthly.revenue + EXCLUDED.revenue,
+                    payments = agent_revenue_monthly.payments + EXCLUDED.payments;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS contract_report_insert ON contract;',
+        'DROP TRIGGER IF EXISTS contract_report_update ON contract;',
+        'DROP TRIGGER IF EXISTS contract_report_delete ON contract;',
+        '''
+        CREATE TRIGGER contract_report_insert AFTER INSERT ON contract
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION contract_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER contract_report_update AFTER UPDATE ON contract
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION contract_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER contract_report_delete AFTER DELETE ON contract
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION contract_report_maintain();
+        ''',
+
+        # backfill from the existing contracts and payments
+        'TRUNCATE contract_balance, agent_revenue_monthly;',
+        '''
+        INSERT INTO contract_balance (contract_id, paid, payments)
+        SELECT c.contract_id, COALESCE(sum(p.amount), 0), count(p.payment_id)
+        FROM contract c
+        LEFT JOIN payment p ON p.contract_id = c.contract_id
+        GROUP BY c.contract_id;
+        ''',
+        '''
+        INSERT INTO agent_revenue_monthly (month, agent_id, revenue, payments)
+        SELECT date_trunc('month', p.date)::date, c.agent_id, sum(p.amount), count(*)
+        FROM payment p
+        JOIN contract c ON c.contract_id = p.contract_id
+        GROUP BY 1, 2;
+        ''',
+    ]),
+
+    (7, 'per-table change versions', [
+        # one counter per table, bumped by every statement that writes to it; caches and ETags compare these
+        '''
+        CREATE TABLE IF NOT EXISTS table_version (
+            table_name VARCHAR(63) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 1,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        ''',
+        '''
+        INSERT INTO table_version (table_name)
+        VALUES ('address'), ('person'), ('owner'), ('agent'), ('client'), ('location'), ('property'), ('contract'), ('payment')
+        ON CONFLICT (table_name) DO NOTHING;
+        ''',
+
+        # statement-level, so a bulk load bumps the counter once; the row lock orders concurrent writers of the same table
+        '''
+        CREATE OR REPLACE FUNCTION table_version_bump() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE table_version SET version = version + 1, changed_at = now() WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS address_version_bump ON address;',
+        'CREATE TRIGGER address_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON address FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS person_version_bump ON person;',
+        'CREATE TRIGGER person_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON person FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS owner_version_bump ON owner;',
+        'CREATE TRIGGER owner_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON owner FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS agent_version_bump ON agent;',
+        'CREATE TRIGGER agent_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON agent FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS client_version_bump ON client;',
+        'CREATE TRIGGER client_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON client FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS location_version_bump ON location;',
+        'CREATE TRIGGER location_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON location FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS property_version_bump ON property;',
+        'CREATE TRIGGER property_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON property FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS contract_version_bump ON contract;',
+        'CREATE TRIGGER contract_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON contract FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+        'DROP TRIGGER IF EXISTS payment_version_bump ON payment;',
+        'CREATE TRIGGER payment_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payment FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+    ]),
+
+    (8, 'person name, email and phone search indexes', [
+        # trigram matching; pg_trgm is a trusted extension, the database owner may create it
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm;',
+
+        # everything a person can be found by in one lower-case string, phone numbers as digits only;
+        # shared by the index and person_search.py, which must call it with exactly these arguments
+        r'''
+        CREATE OR REPLACE FUNCTION person_search_text(first_name TEXT, last_name TEXT, email TEXT, phone_number TEXT) RETURNS TEXT
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT lower(COALESCE(first_name, '') || ' ' || COALESCE(last_name, '') || ' ' || COALESCE(email, '') || ' '
+                         || COALESCE(regexp_replace(phone_number, '\D', '', 'g'), ''))
+        $$;
+        ''',
+        # substring (LIKE '%...%') and typo-tolerant (<%) matches of three or more characters
+        '''
+        CREATE INDEX IF NOT EXISTS person_search_trgm_idx ON person
+        USING gin (person_search_text(first_name, last_name, email, phone_number) gin_trgm_ops);
+        ''',
+        # one and two character queries are too short for trigrams and match last name prefixes instead
+        'CREATE INDEX IF NOT EXISTS person_last_name_prefix_idx ON person (lower(last_name) text_pattern_ops, person_id);',
+    ]),
+
+    (9, 'property and contract listing projections', [
+        # the rows of show_property / search_property, pre-joined with the owner's name and the coordinates
+        '''
+        CREATE TABLE IF NOT EXISTS property_listing (
+            property_id INTEGER PRIMARY KEY,
+            number_of_rooms INTEGER,
+            building_year INTEGER,
+            area_size DECIMAL,
+            price DECIMAL NOT NULL,
+            location_id INTEGER NOT NULL,
+            owner_id INTEGER NOT NULL,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            latitude DECIMAL NOT NULL,
+            longitude DECIMAL NOT NULL,
+            grid_cell INTEGER NOT NULL
+        );
+        ''',
+        # the search filters of migration 5 and the proximity search of migration 4, now on the projection
+        'CREATE INDEX IF NOT EXISTS property_listing_rooms_price_idx ON property_listing (number_of_rooms, price);',
+        'CREATE INDEX IF NOT EXISTS property_listing_year_price_idx ON property_listing (building_year, price);',
+        'CREATE INDEX IF NOT EXISTS property_listing_price_area_idx ON property_listing (price, area_size);',
+        'CREATE INDEX IF NOT EXISTS property_listing_owner_id_idx ON property_listing (owner_id);',
+        'CREATE INDEX IF NOT EXISTS property_listing_last_name_idx ON property_listing (lower(last_name));',
+        'CREATE INDEX IF NOT EXISTS property_listing_location_id_idx ON property_listing (location_id);',
+        'CREATE INDEX IF NOT EXISTS property_listing_grid_cell_idx ON property_listing (grid_cell) INCLUDE (latitude, longitude);',
+
+        # the rows of show_contract, with agent and client names and the coordinates of the property
+        '''
+        CREATE TABLE IF NOT EXISTS contract_listing (
+            contract_id INTEGER PRIMARY KEY,
+            sign_date DATE NOT NULL,
+            agent_id INTEGER NOT NULL,
+            client_id INTEGER NOT NULL,
+            property_id INTEGER NOT NULL,
+            agent_first_name VARCHAR(100) NOT NULL,
+            agent_last_name VARCHAR(100) NOT NULL,
+            client_first_name VARCHAR(100) NOT NULL,
+            client_last_name VARCHAR(100) NOT NULL,
+            latitude DECIMAL NOT NULL,
+            longitude DECIMAL NOT NULL
+        );
+        ''',
+        'CREATE INDEX IF NOT EXISTS contract_listing_agent_id_idx ON contract_listing (agent_id);',
+        'CREATE INDEX IF NOT EXISTS contract_listing_client_id_idx ON contract_listing (client_id);',
+        'CREATE INDEX IF NOT EXISTS contract_listing_property_id_idx ON contract_listing (property_id);',
+
+        # the joined rows of some properties / contracts; shared by the triggers and the backfill, and by listings.py
+        '''
+        CREATE OR REPLACE VIEW property_listing_source AS
+        SELECT p.property_id, p.number_of_rooms, p.building_year, p.area_size, p.price, p.location_id, p.owner_id,
+               per.first_name, per.last_name, l.latitude, l.longitude, l.grid_cell
+        FROM property p
+        JOIN location l ON p.location_id = l.location_id
+        JOIN owner o ON p.owner_id = o.owner_id
+        JOIN person per ON o.person_id = per.person_id;
+        ''',
+        '''
+        CREATE OR REPLACE VIEW contract_listing_source AS
+        SELECT c.contract_id, c.sign_date, c.agent_id, c.client_id, c.property_id,
+               a.first_name AS agent_first_name, a.last_name AS agent_last_name,
+               cl.first_name AS client_first_name, cl.last_name AS client_last_name, l.latitude, l.longitude
+        FROM contract c
+        JOIN agent ag ON c.agent_id = ag.agent_id
+        JOIN person a ON ag.person_id = a.person_id
+        JOIN client clt ON c.client_id = clt.client_id
+        JOIN person cl ON clt.person_id = cl.person_id
+        JOIN property p ON c.property_id = p.property_id
+        JOIN location l ON p.location_id = l.location_id;
+        ''',
+
+        # re-read the listing rows of some ids from their base tables; rows whose joins no longer match drop out
+        '''
+        CREATE OR REPLACE FUNCTION property_listing_refresh(ids INTEGER[]) RETURNS VOID
+        LANGUAGE sql AS $$
+            DELETE FROM property_listing WHERE property_id = ANY(ids);
+            INSERT INTO property_listing SELECT * FROM property_listing_source WHERE property_id = ANY(ids);
+        $$;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION contract_listing_refresh(ids INTEGER[]) RETURNS VOID
+        LANGUAGE sql AS $$
+            DELETE FROM contract_listing WHERE contract_id = ANY(ids);
+            INSERT INTO contract_listing SELECT * FROM contract_listing_source WHERE contract_id = ANY(ids);
+        $$;
+        ''',
+
+        # inserts are joined set-wise from the transition table (bulk loads); updates and deletes touch few rows
+        '''
+        CREATE OR REPLACE FUNCTION property_listing_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO property_listing
+                SELECT s.* FROM property_listing_source s JOIN new_rows n ON n.property_id = s.property_id;
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM property_listing_refresh(ARRAY(SELECT property_id FROM old_rows UNION SELECT property_id FROM new_rows));
+                -- a property moved to another location moves its contracts along
+                PERFORM contract_listing_refresh(ARRAY(
+                    SELECT c.contract_id FROM contract c
+                    JOIN new_rows n ON n.property_id = c.property_id
+                    JOIN old_rows o ON o.property_id = n.property_id
+                    WHERE n.location_id IS DISTINCT FROM o.location_id));
+            ELSE
+                DELETE FROM property_listing l USING old_rows o WHERE l.property_id = o.property_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION contract_listing_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO contract_listing
+                SELECT s.* FROM contract_listing_source s JOIN new_rows n ON n.contract_id = s.contract_id;
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM contract_listing_refresh(ARRAY(SELECT contract_id FROM old_rows UNION SELECT contract_id FROM new_rows));
+            ELSE
+                DELETE FROM contract_listing l USING old_rows o WHERE l.contract_id = o.contract_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+
+        # renames and moves in the referenced tables; only rows whose displayed columns changed are refreshed.
+        # Deletes of referenced rows are prevented by the foreign keys.
+        '''
+        CREATE OR REPLACE FUNCTION listing_reference_maintain() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            person_ids INTEGER[];
+            property_ids INTEGER[] := '{}';
+            contract_ids INTEGER[] := '{}';
+        BEGIN
+            IF TG_TABLE_NAME = 'person' THEN
+                person_ids := ARRAY(SELECT n.person_id FROM new_rows n JOIN old_rows o ON o.person_id = n.person_id
+                                    WHERE (n.first_name, n.last_name) IS DISTINCT FROM (o.first_name, o.last_name));
+                property_ids := ARRAY(SELECT p.property_id FROM property p JOIN owner ow ON ow.owner_id = p.owner_id
+                                      WHERE ow.person_id = ANY(person_ids));
+                contract_ids := ARRAY(SELECT c.contract_id FROM contract c JOIN agent ag ON ag.agent_id = c.agent_id
+                                      WHERE ag.person_id = ANY(person_ids)
+                                      UNION
+                                      SELECT c.contract_id FROM contract c JOIN client cl ON cl.client_id = c.client_id
+                                      WHERE cl.person_id = ANY(person_ids));
+            ELSIF TG_TABLE_NAME = 'location' THEN
+                property_ids := ARRAY(SELECT p.property_id FROM property p JOIN new_rows n ON n.location_id = p.location_id
+                                      JOIN old_rows o ON o.location_id = n.location_id
+                                      WHERE (n.latitude, n.longitude) IS DISTINCT FROM (o.latitude, o.longitude));
+                contract_ids := ARRAY(SELECT c.contract_id FROM contract c WHERE c.property_id = ANY(property_ids));
+            ELSIF TG_TABLE_NAME = 'owner' THEN
+                property_ids := ARRAY(SELECT p.property_id FROM property p JOIN new_rows n ON n.owner_id = p.owner_id
+                                      JOIN old_rows o ON o.owner_id = n.owner_id WHERE n.person_id <> o.person_id);
+            ELSIF TG_TABLE_NAME = 'agent' THEN
+                contract_ids := ARRAY(SELECT c.contract_id FROM contract c JOIN new_rows n ON n.agent_id = c.agent_id
+                                      JOIN old_rows o ON o.agent_id = n.agent_id WHERE n.person_id <> o.person_id);
+            ELSIF TG_TABLE_NAME = 'client' THEN
+                contract_ids := ARRAY(SELECT c.contract_id FROM contract c JOIN new_rows n ON n.client_id = c.client_id
+                                      JOIN old_rows o ON o.client_id = n.client_id WHERE n.person_id <> o.person_id);
+            END IF;
+            IF cardinality(property_ids) > 0 THEN
+                PERFORM property_listing_refresh(property_ids);
+            END IF;
+            IF cardinality(contract_ids) > 0 THEN
+                PERFORM contract_listing_refresh(contract_ids);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS property_listing_insert ON property;',
+        'DROP TRIGGER IF EXISTS property_listing_update ON property;',
+        'DROP TRIGGER IF EXISTS property_listing_delete ON property;',
+        'CREATE TRIGGER property_listing_insert AFTER INSERT ON property REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION property_listing_maintain();',
+        'CREATE TRIGGER property_listing_update AFTER UPDATE ON property REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION property_listing_maintain();',
+        'CREATE TRIGGER property_listing_delete AFTER DELETE ON property REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION property_listing_maintain();',
+        'DROP TRIGGER IF EXISTS contract_listing_insert ON contract;',
+        'DROP TRIGGER IF EXISTS contract_listing_update ON contract;',
+        'DROP TRIGGER IF EXISTS contract_listing_delete ON contract;',
+        'CREATE TRIGGER contract_listing_insert AFTER INSERT ON contract REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION contract_listing_maintain();',
+        'CREATE TRIGGER contract_listing_update AFTER UPDATE ON contract REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION contract_listing_maintain();',
+        'CREATE TRIGGER contract_listing_delete AFTER DELETE ON contract REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION contract_listing_maintain();',
+        'DROP TRIGGER IF EXISTS person_listing_update ON person;',
+        'CREATE TRIGGER person_listing_update AFTER UPDATE ON person REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION listing_reference_maintain();',
+        'DROP TRIGGER IF EXISTS location_listing_update ON location;',
+        'CREATE TRIGGER location_listing_update AFTER UPDATE ON location REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION listing_reference_maintain();',
+        'DROP TRIGGER IF EXISTS owner_listing_update ON owner;',
+        'CREATE TRIGGER owner_listing_update AFTER UPDATE ON owner REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION listing_reference_maintain();',
+        'DROP TRIGGER IF EXISTS agent_listing_update ON agent;',
+        'CREATE TRIGGER agent_listing_update AFTER UPDATE ON agent REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION listing_reference_maintain();',
+        'DROP TRIGGER IF EXISTS client_listing_update ON client;',
+        'CREATE TRIGGER client_listing_update AFTER UPDATE ON client REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION listing_reference_maintain();',
+
+        # backfill from the existing rows
+        'TRUNCATE property_listing, contract_listing;',
+        'INSERT INTO property_listing SELECT * FROM property_listing_source;',
+        'INSERT INTO contract_listing SELECT * FROM contract_listing_source;',
+    ]),
+
+    (10, 'yearly payment partitions', [
+        # the old table keeps the rows until they are copied; the id sequence moves over to the new table
+        'ALTER TABLE payment RENAME TO payment_unpartitioned;',
+        'ALTER SEQUENCE payment_payment_id_seq OWNED BY NONE;',
+        '''
+        CREATE TABLE payment (
+            payment_id INTEGER NOT NULL DEFAULT nextval('payment_payment_id_seq'),
+            amount DECIMAL NOT NULL,
+            date DATE NOT NULL,
+            contract_id INTEGER NOT NULL,
+            FOREIGN KEY (contract_id) REFERENCES contract(contract_id)
+        ) PARTITION BY RANGE (date);
+        ''',
+        # payments of years without a partition; payment_partition_create() moves them out once their year exists
+        'CREATE TABLE IF NOT EXISTS payment_default PARTITION OF payment DEFAULT;',
+
+        # detached partitions are moved here by `flask archive-payments`
+        'CREATE SCHEMA IF NOT EXISTS payment_archive;',
+
+        # one partition per calendar year, named payment_y<year>; false when it already exists
+        '''
+        CREATE OR REPLACE FUNCTION payment_partition_create(year INTEGER) RETURNS BOOLEAN
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            partition_name TEXT := format('payment_y%s', year);
+            lower_bound DATE := make_date(year, 1, 1);
+            upper_bound DATE := make_date(year + 1, 1, 1);
+        BEGIN
+            IF to_regclass(partition_name) IS NOT NULL THEN
+                RETURN FALSE;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE payment INCLUDING DEFAULTS)', partition_name);
+            -- statements on a partition do not fire the triggers of payment, so the aggregates are left alone
+            EXECUTE format('WITH moved AS (DELETE FROM payment_default WHERE date >= %L AND date < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+            -- attaching creates the primary key, indexes and foreign key of payment on the new table
+            EXECUTE format('ALTER TABLE payment ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, lower_bound, upper_bound);
+            RETURN TRUE;
+        END
+        $$;
+        ''',
+        '''
+        CREATE OR REPLACE FUNCTION payment_partitions_ensure(first_year INTEGER, last_year INTEGER) RETURNS INTEGER
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            created INTEGER := 0;
+        BEGIN
+            FOR year IN first_year..last_year LOOP
+                IF payment_partition_create(year) THEN
+                    created := created + 1;
+                END IF;
+            END LOOP;
+            RETURN created;
+        END
+        $$;
+        ''',
+        '''
+        SELECT payment_partitions_ensure(
+            COALESCE((SELECT extract(year FROM min(date))::integer FROM payment_unpartitioned), extract(year FROM current_date)::integer),
+            extract(year FROM current_date)::integer + 1
+        );
+        ''',
+
+        # copy before the triggers exist: contract_balance and agent_revenue_monthly already count these rows
+        'INSERT INTO payment (payment_id, amount, date, contract_id) SELECT payment_id, amount, date, contract_id FROM payment_unpartitioned;',
+        'DROP TABLE payment_unpartitioned;',
+        'ALTER SEQUENCE payment_payment_id_seq OWNED BY payment.payment_id;',
+
+        # the partition key is part of every unique index; the indexes of migration 2 again, now per partition
+        'ALTER TABLE payment ADD PRIMARY KEY (payment_id, date);',
+        'CREATE INDEX IF NOT EXISTS payment_contract_id_date_idx ON payment (contract_id, date);',
+        'CREATE INDEX IF NOT EXISTS payment_date_idx ON payment (date);',
+
+        # the triggers of migrations 6 and 7, on the partitioned table
+        '''
+        CREATE TRIGGER payment_report_insert AFTER INSERT ON payment
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER payment_report_update AFTER UPDATE ON payment
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+        '''
+        CREATE TRIGGER payment_report_delete AFTER DELETE ON payment
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION payment_report_maintain();
+        ''',
+        'CREATE TRIGGER payment_version_bump AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON payment FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump();',
+
+        # from/to filters of show_contract and the balance report
+        'CREATE INDEX IF NOT EXISTS contract_listing_sign_date_idx ON contract_listing (sign_date);',
+        'CREATE INDEX IF NOT EXISTS contract_sign_date_idx ON contract (sign_date);',
+    ]),
+
+    (11, 'monotonic table change times', [
+        # now() is the start of the transaction, so a long transaction committing last would move changed_at
+        # backwards and If-Modified-Since would hide its change; the wall clock, never going back, does not
+        '''
+        CREATE OR REPLACE FUNCTION table_version_bump() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE table_version SET version = version + 1, changed_at = GREATEST(changed_at, clock_timestamp())
+            WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+    ]),
+
+    (12, 'table versions bumped at commit', [
+        # the tables a transaction wrote to, until it commits; every transaction only ever sees its own rows here
+        '''
+        CREATE TABLE IF NOT EXISTS table_version_pending (
+            table_name VARCHAR(63) NOT NULL
+        );
+        ''',
+
+        # the statement triggers of migration 7 only note the table, once per transaction (set_config(..., true)
+        # is undone with the transaction or savepoint); no table_version row is locked while the transaction runs
+        '''
+        CREATE OR REPLACE FUNCTION table_version_bump() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF current_setting('table_version.pending_' || TG_TABLE_NAME, true) IS DISTINCT FROM 'on' THEN
+                PERFORM set_config('table_version.pending_' || TG_TABLE_NAME, 'on', true);
+                INSERT INTO table_version_pending (table_name) VALUES (TG_TABLE_NAME);
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+
+        # deferred to commit: every noted table is bumped in name order, so writers of several tables never
+        # deadlock and a row lock is only held for the commit itself; later firings find nothing left
+        '''
+        CREATE OR REPLACE FUNCTION table_version_apply() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            pending_table VARCHAR(63);
+        BEGIN
+            FOR pending_table IN SELECT DISTINCT table_name FROM table_version_pending ORDER BY 1 LOOP
+                UPDATE table_version SET version = version + 1, changed_at = GREATEST(changed_at, clock_timestamp())
+                WHERE table_name = pending_table;
+            END LOOP;
+            DELETE FROM table_version_pending;
+            RETURN NULL;
+        END
+        $$;
+        ''',
+        'DROP TRIGGER IF EXISTS table_version_apply ON table_version_pending;',
+        '''
+        CREATE CONSTRAINT TRIGGER table_version_apply AFTER INSERT ON table_version_pending
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION table_version_apply();
+        ''',
+    ]),
+
+    (13, 'payment partitions created under a lock', [
+        # migration 10 again, holding payment_default from the existence check to the ATTACH: a payment of that year
+        # committed into payment_default after its rows were moved made ATTACH fail, and two processes starting
+        # at once could both try to create the same partition. The lock conflicts with itself and with inserts
+        # routed to payment_default, not with inserts into the other partitions
+        '''
+        CREATE OR REPLACE FUNCTION payment_partition_create(year INTEGER) RETURNS BOOLEAN
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            partition_name TEXT := format('payment_y%s', year);
+            lower_bound DATE := make_date(year, 1, 1);
+            upper_bound DATE := make_date(year + 1, 1, 1);
+        BEGIN
+            LOCK TABLE payment_default IN SHARE ROW EXCLUSIVE MODE;
+            IF to_regclass(partition_name) IS NOT NULL THEN
+                RETURN FALSE;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE payment INCLUDING DEFAULTS)', partition_name);
+            -- statements on a partition do not fire the triggers of payment, so the aggregates are left alone
+            EXECUTE format('WITH moved AS (DELETE FROM payment_default WHERE date >= %L AND date < %L RETURNING *) '
+                           'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, partition_name);
+            -- attaching creates the primary key, indexes and foreign key of payment on the new table
+            EXECUTE format('ALTER TABLE payment ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, lower_bound, upper_bound);
+            RETURN TRUE;
+        END
+        $$;
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# ----- runner -----
+# function to create the database if it does not exist yet (never drops anything)
+def ensure_database(maintenance_dsn, db_name):
+    conn = psycopg2.connect(maintenance_dsn)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s', (db_name,))
+        if cur.fetchone() is None:
+            try:
+                cur.execute(f'CREATE DATABASE {db_name}')
+                logger.info('created database %s', db_name)
+            except errors.DuplicateDatabase:
+                pass # another process created it between the check and the CREATE
+    finally:
+        cur.close()
+        conn.close()
+
+
+# function to read the schema version of a database (0 when it was never migrated)
+def current_version(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        cur.close()
+        return 0
+    cur.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    version = cur.fetchone()[0]
+    cur.close()
+    return version
+
+
+# function to apply every pending migration under an advisory lock
+def migrate(conn, target=LATEST_VERSION):
+    """Bring the database behind ``conn`` up to ``target`` and return the applied versions.
+
+    Each migration runs in its own transaction together with its
+    ``schema_version`` row, so a failed migration leaves the previous version
+    intact. Concurrent callers block on the advisory lock and then find
+    nothing left to do.
+    """
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    applied = []
+    try:
+        conn.autocommit = False
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+        ''')
+        conn.commit()
+
+        # re-read the version now that we hold the lock, another process may have migrated meanwhile
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version or number > target:
+                continue
+            logger.info('applying migration %s: %s', number, description)
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)', (number, description))
+            conn.commit()
+            applied.append(number)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        cur.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+        cur.close()
+    return applied
+
+
+# function to make sure the database exists and is up to date, cheap when nothing has to change
+def migrate_if_needed(dsn, maintenance_dsn, db_name):
+    # a missing database is the only case where the maintenance database is touched
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as e:
+        if 'does not exist' not in str(e):
+            raise
+        ensure_database(maintenance_dsn, db_name)
+        conn = psycopg2.connect(dsn)
+
+    try:
+        # cold start: one version check, the lock is only taken when there is work to do
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+        conn.rollback()
+        return migrate(conn)
+    finally:
+        conn.close()
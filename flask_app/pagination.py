@@ -0,0 +1,131 @@
+# ----- imports -----
+import datetime
+from flask import request, url_for
+
+
+# ----- settings -----
+DEFAULT_PAGE_SIZE = 50 # rows per page when the request does not ask for a size
+MAX_PAGE_SIZE = 500    # upper bound so a single page can never turn back into a full-table scan
+
+
+# ----- page -----
+class Page:
+    """One keyset page of rows plus the tokens pointing at its neighbours.
+
+    ``next_token`` is the key of the last row (pass it back as ``?after=``)
+    and ``prev_token`` the key of the first row (``?before=``). Either is
+    ``None`` when there is nothing in that direction.
+    """
+
+    def __init__(self, rows, page_size, next_token=None, prev_token=None):
+        self.rows = rows
+        self.page_size = page_size
+        self.next_token = next_token
+        self.prev_token = prev_token
+
+    def _url(self, **tokens):
+        # keep every other query parameter (filters, page size) of the current request
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        args.update(tokens)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_token) if self.next_token is not None else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_token) if self.prev_token is not None else None
+
+
+# ----- helpers -----
+# function to read the pagination query parameters of the current request
+def page_args():
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    page_size = request.args.get('page_size', DEFAULT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    return after, before, page_size
+
+
+# function to read the ?from= and ?to= date filters of the current request (YYYY-MM-DD, to is exclusive)
+def date_range_args():
+    bounds = []
+    for name in ('from', 'to'):
+        value = request.args.get(name)
+        try:
+            bounds.append(datetime.date.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValueError(f'{name} must be a date (YYYY-MM-DD)') from None
+    return tuple(bounds)
+
+
+# function to translate a date range into SQL conditions on `column` and their params; with a constant range on
+# the partition key of payment, the planner only reads the partitions of the years in between
+def date_conditions(column, date_from, date_to):
+    conditions, params = [], []
+    for value, operator in ((date_from, '>='), (date_to, '<')):
+        if value is not None:
+            conditions.append(f'{column} {operator} %s')
+            params.append(value)
+    return conditions, params
+
+
+# function to fetch one keyset page of a SELECT ... FROM ... JOIN ... query
+def fetch_page(cur, query, key, params=(), conditions=()):
+    """Run ``query`` ordered by the unique integer column ``key``.
+
+    ``query`` must not contain WHERE/ORDER BY/LIMIT; extra filters are passed
+    as SQL fragments in ``conditions`` (joined with AND) with their values in
+    ``params``, either a sequence for ``%s`` placeholders or a dict for
+    ``%(name)s`` placeholders. Seeking on ``key`` instead of using OFFSET keeps
+    every page an index range scan on the primary key, however deep the user pages.
+    """
+    after, before, page_size = page_args()
+    conditions = list(conditions)
+    named = isinstance(params, dict)
+    params = dict(params) if named else list(params)
+
+    # function to add a value in the placeholder style of the caller
+    def bind(name, value):
+        if named:
+            params[name] = value
+            return f'%({name})s'
+        params.append(value)
+        return '%s'
+
+    # walk backwards from the `before` token, otherwise forwards from `after`
+    if before is not None:
+        conditions.append(f'{key} < {bind("page_before", before)}')
+        order = 'DESC'
+    else:
+        if after is not None:
+            conditions.append(f'{key} > {bind("page_after", after)}')
+        order = 'ASC'
+
+    where = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    limit = bind('page_limit', page_size + 1)
+    cur.execute(f'{query}{where} ORDER BY {key} {order} LIMIT {limit}', params)
+    rows = cur.fetchall() # at most page_size + 1 rows
+
+    # the extra row only tells whether there is another page in the walking direction
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if order == 'DESC':
+        rows.reverse()
+
+    # combine the column names and row values into a list of dictionaries
+    columns = [desc[0] for desc in cur.description]
+    rows = [dict(zip(columns, row)) for row in rows]
+
+    key_name = key.split('.')[-1]
+    first = rows[0][key_name] if rows else None
+    last = rows[-1][key_name] if rows else None
+    if order == 'DESC':
+        next_token = last
+        prev_token = first if has_more else None
+    else:
+        next_token = last if has_more else None
+        prev_token = first if after is not None and rows else None
+
+    return Page(rows, page_size, next_token=next_token, prev_token=prev_token)
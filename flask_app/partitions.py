@@ -0,0 +1,185 @@
+# ----- imports -----
+import datetime
+import json
+import os
+import statistics
+import time
+from flask import current_app
+
+
+# ----- settings -----
+# schema the detached payment partitions are moved to (migration 10)
+ARCHIVE_SCHEMA = 'payment_archive'
+
+# the yearly partitions of payment with their bounds, estimated rows and size on disk, oldest first
+PARTITIONS_QUERY = '''
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), GREATEST(c.reltuples, 0)::bigint, pg_total_relation_size(c.oid)
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'payment'::regclass
+    ORDER BY c.relname = 'payment_default', c.relname
+'''
+
+# one month of payments, as show_payment and the reports read it; only the partition of that year is scanned
+BOUNDED_QUERY = '''
+    SELECT count(*), COALESCE(sum(amount), 0) FROM payment
+    WHERE date >= %(date_from)s AND date < %(date_to)s
+'''
+
+# the same figures over the whole history, for comparison
+UNBOUNDED_QUERY = 'SELECT count(*), COALESCE(sum(amount), 0) FROM payment'
+
+
+# ----- partitions -----
+# function to return the name of the partition of one year
+def partition_name(year):
+    return f'payment_y{year}'
+
+
+# function to list the partitions of payment
+def list_partitions(cur):
+    cur.execute(PARTITIONS_QUERY)
+    return [{'name': name, 'bounds': bounds, 'rows': rows, 'bytes': size} for name, bounds, rows, size in cur.fetchall()]
+
+
+# function to create the partitions of the coming years and of every year that has rows in the default partition
+def ensure(conn, years_ahead=None, first_year=None):
+    """Create the missing yearly partitions and return their names.
+
+    Covers the current year and ``years_ahead`` more (and every year from
+    ``first_year`` on, before a bulk load of older payments), so inserts
+    never have to fall back to ``payment_default``. Rows that did land there
+    (dates far in the past or future) are moved into the partition of their
+    year, which is created for them.
+    """
+    years_ahead = current_app.config['PAYMENT_PARTITIONS_AHEAD'] if years_ahead is None else years_ahead
+    this_year = datetime.date.today().year
+    cur = conn.cursor()
+    cur.execute('SELECT DISTINCT extract(year FROM date)::integer FROM payment_default')
+    first_year = this_year if first_year is None else min(first_year, this_year)
+    years = sorted({year for year, in cur.fetchall()} | set(range(first_year, this_year + years_ahead + 1)))
+    created = []
+    for year in years:
+        cur.execute('SELECT payment_partition_create(%s)', (year,))
+        if cur.fetchone()[0]:
+            created.append(partition_name(year))
+    conn.commit()
+    cur.close()
+    return created
+
+
+# function to detach the partition of one year from payment, keeping it in the archive schema or dropping it
+def archive(conn, year, drop=False):
+    """Take the payments of ``year`` out of the live table and return their number.
+
+    The partition is detached, which takes a brief lock on ``payment`` but
+    moves no rows; it is then moved to the ``payment_archive`` schema (or
+    dropped), from where it can be exported or attached again. The reporting
+    aggregates keep counting these payments: balances stay what was paid, and
+    ``flask rebuild-reports`` would leave them out. Export the year first
+    (``flask export payment --from --to``) when it is dropped.
+    """
+    name = partition_name(year)
+    cur = conn.cursor()
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL', (name,))
+    if not cur.fetchone()[0]:
+        cur.close()
+        raise ValueError(f'there is no partition for {year}')
+    cur.execute(f'SELECT count(*) FROM {name}')
+    rows = cur.fetchone()[0]
+    cur.execute(f'ALTER TABLE payment DETACH PARTITION {name}')
+    if drop:
+        cur.execute(f'DROP TABLE {name}')
+    else:
+        cur.execute(f'ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}')
+    # detaching fires no triggers, so cached payment pages are invalidated here (the version is bumped at commit)
+    cur.execute("INSERT INTO table_version_pending (table_name) VALUES ('payment')")
+    conn.commit()
+    cur.close()
+    return rows
+
+
+# ----- benchmark -----
+# function to time a query, returning the median milliseconds of `runs` executions
+def time_query(cur, query, params=None, runs=5):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cur.execute(query, params)
+        cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+# function to count the partitions an EXPLAIN (FORMAT JSON) plan reads
+def scanned_partitions(plan):
+    found = set()
+    if plan.get('Relation Name', '').startswith('payment_'):
+        found.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        found |= scanned_partitions(child)
+    return found
+
+
+# function to measure a one-month query while the payment history grows year by year
+def benchmark(conn, years=8, rows_per_year=250000, runs=5, echo=print):
+    """Add ``years`` years of synthetic payments before the oldest one, one year at a time.
+
+    After every year the one-month query of ``BOUNDED_QUERY`` (the most
+    recent month with payments) and the full-history ``UNBOUNDED_QUERY`` are
+    timed. With partition pruning the first stays flat while the second
+    grows with the history. Everything runs in one transaction that is
+    rolled back, so this is safe to run against any database with at least
+    one contract. Returns one dict per step.
+    """
+    cur = conn.cursor()
+    results = []
+    try:
+        cur.execute('SELECT min(contract_id), max(contract_id) FROM contract')
+        first_contract, last_contract = cur.fetchone()
+        if first_contract is None:
+            raise ValueError('the benchmark needs at least one contract')
+        cur.execute('SELECT min(date), max(date) FROM payment')
+        oldest, newest = cur.fetchone()
+        newest = newest or datetime.date.today()
+        oldest_year = (oldest or newest).year
+        month = newest.replace(day=1)
+        bounds = {'date_from': month, 'date_to': (month + datetime.timedelta(days=32)).replace(day=1)}
+
+        for step in range(years + 1):
+            if step:
+                year = oldest_year - step
+                cur.execute('SELECT payment_partition_create(%s)', (year,))
+                cur.execute('''
+                    INSERT INTO payment (amount, date, contract_id)
+                    SELECT 1000 + g %% 50000, make_date(%(year)s, 1, 1) + g %% 365,
+                           %(first)s + g %% (%(last)s - %(first)s + 1)
+                    FROM generate_series(1, %(rows)s) g
+                ''', {'year': year, 'first': first_contract, 'last': last_contract, 'rows': rows_per_year})
+                cur.execute(f'ANALYZE {partition_name(year)}')
+            cur.execute('EXPLAIN (FORMAT JSON) ' + BOUNDED_QUERY, bounds)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            cur.execute('SELECT GREATEST(sum(c.reltuples), 0)::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                        "WHERE i.inhparent = 'payment'::regclass")
+            result = {
+                'years_added': step,
+                'rows': cur.fetchone()[0],
+                'partitions_scanned': len(scanned_partitions(plan[0]['Plan'])),
+                'bounded_ms': round(time_query(cur, BOUNDED_QUERY, bounds, runs), 2),
+                'unbounded_ms': round(time_query(cur, UNBOUNDED_QUERY, runs=runs), 2),
+            }
+            echo(f"+{step} year(s), ~{result['rows']:,} payments: one month {result['bounded_ms']:.2f}ms "
+                 f"({result['partitions_scanned']} partition(s)), full history {result['unbounded_ms']:.2f}ms")
+            results.append(result)
+    finally:
+        conn.rollback()
+        cur.close()
+    return results
+
+
+# ----- flask integration -----
+# function to register the partition settings with an app
+def init_app(app):
+    app.config.setdefault('PAYMENT_PARTITIONS_AHEAD', int(os.environ.get('PAYMENT_PARTITIONS_AHEAD', 1)))
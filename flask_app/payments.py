@@ -0,0 +1,226 @@
+# ----- imports -----
+import csv
+import datetime
+import io
+import os
+from decimal import Decimal, InvalidOperation
+from flask import current_app
+from psycopg2.extras import execute_values
+
+
+# ----- settings -----
+# installment frequencies of the schedule generator, as PostgreSQL intervals
+FREQUENCIES = {
+    'weekly': '1 week',
+    'monthly': '1 month',
+    'quarterly': '3 months',
+    'yearly': '1 year',
+}
+
+# smallest installment a schedule may produce
+MIN_INSTALLMENT = Decimal('0.01')
+
+# one schedule is one statement: the installments come from generate_series, the default total
+# from the price of the contract's property, and the last installment takes the remainder of cutting
+# the others to cents; totals below one cent per installment insert nothing
+SCHEDULE_QUERY = '''
+    INSERT INTO payment (amount, date, contract_id)
+    SELECT CASE WHEN i < %(installments)s - 1 THEN trunc(t.total / %(installments)s, 2)
+                ELSE t.total - trunc(t.total / %(installments)s, 2) * (%(installments)s - 1) END,
+           (%(start)s::date + i * %(step)s::interval)::date,
+           c.contract_id
+    FROM contract c
+    JOIN property pr ON pr.property_id = c.property_id
+    CROSS JOIN LATERAL (SELECT COALESCE(%(total)s::numeric, pr.price) AS total) t
+    CROSS JOIN generate_series(0, %(installments)s - 1) i
+    WHERE c.contract_id = %(contract_id)s AND t.total >= %(installments)s * %(min_installment)s
+    ORDER BY i
+    RETURNING payment_id, amount, date
+'''
+
+
+# ----- reading -----
+# function to read the payment rows of a batch form (parallel amount/date/contract_id lists, blank rows skipped)
+def rows_from_form(form):
+    columns = zip(form.getlist('amount'), form.getlist('date'), form.getlist('contract_id'))
+    return [{'amount': amount, 'date': date, 'contract_id': contract_id}
+            for amount, date, contract_id in columns if amount.strip() or date.strip() or contract_id.strip()]
+
+
+# function to read the payment rows of a JSON body, either a list of objects or {"payments": [...]}
+def rows_from_json(data):
+    if isinstance(data, dict):
+        data = data.get('payments')
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise ValueError('expected a list of payments or {"payments": [...]}')
+    return data
+
+
+# function to read the payment rows of CSV text with an amount,date,contract_id header
+def rows_from_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [name for name in ('amount', 'date', 'contract_id') if name not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+    return list(reader)
+
+
+# ----- validation -----
+# function to return one value of a row as stripped text; only a missing value is blank, so 0 stays 0
+def field(row, name):
+    value = row.get(name)
+    return '' if value is None else str(value).strip()
+
+
+# function to convert one payment row, returning ((amount, date, contract_id), None) or (None, reason)
+def parse_row(row):
+    try:
+        amount = Decimal(field(row, 'amount'))
+    except InvalidOperation:
+        return None, 'invalid amount'
+    if not amount.is_finite() or amount <= 0:
+        return None, 'amount must be positive'
+    try:
+        date = datetime.date.fromisoformat(field(row, 'date'))
+    except ValueError:
+        return None, 'invalid date (YYYY-MM-DD)'
+    try:
+        contract_id = int(field(row, 'contract_id'))
+    except ValueError:
+        return None, 'invalid contract_id'
+    return (amount, date, contract_id), None
+
+
+# function to validate a batch; every problem is reported, as (row number, reason) pairs counting from 1
+def validate(cur, rows):
+    values, rejected = [], []
+    for number, row in enumerate(rows, start=1):
+        parsed, reason = parse_row(row)
+        if reason:
+            rejected.append((number, reason))
+        else:
+            values.append((number, parsed))
+
+    # one lookup for every contract of the batch instead of one per row
+    contract_ids = sorted({parsed[2] for _, parsed in values})
+    if contract_ids:
+        cur.execute('SELECT contract_id FROM contract WHERE contract_id = ANY(%s)', (contract_ids,))
+        known = {row[0] for row in cur.fetchall()}
+        rejected += [(number, 'unknown contract_id') for number, parsed in values if parsed[2] not in known]
+    rejected.sort()
+    return [parsed for _, parsed in values], rejected
+
+
+# ----- writing -----
+# function to insert a batch of payments with one multi-row INSERT in one transaction
+def insert_batch(conn, rows):
+    """Validate ``rows`` (dicts with amount, date and contract_id) and insert them.
+
+    The batch is all or nothing: if any row is invalid nothing is inserted
+    and every rejected row is returned with its reason, so the whole batch
+    can be corrected and sent again. Returns a dict with the inserted
+    payment ids and the rejected ``(row, reason)`` pairs.
+    """
+    max_rows = current_app.config['PAYMENT_BATCH_MAX_ROWS']
+    if not rows:
+        return {'inserted': [], 'rejected': [(None, 'no payments given')]}
+    if len(rows) > max_rows:
+        return {'inserted': [], 'rejected': [(None, f'at most {max_rows} payments per batch')]}
+
+    cur = conn.cursor()
+    try:
+        values, rejected = validate(cur, rows)
+        if rejected:
+            conn.rollback()
+            return {'inserted': [], 'rejected': rejected}
+        # page_size covers the whole batch, so execute_values sends a single statement
+        inserted = execute_values(cur, 'INSERT INTO payment (amount, date, contract_id) VALUES %s RETURNING payment_id',
+                                  values, page_size=len(values), fetch=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {'inserted': [row[0] for row in inserted], 'rejected': []}
+
+
+# function to check the parameters of a schedule, returning (params, []) or (None, reasons)
+def schedule_params(contract_id, installments, start, frequency, total=None):
+    errors = []
+    try:
+        contract_id = int(contract_id)
+    except (TypeError, ValueError):
+        errors.append('invalid contract_id')
+    max_installments = current_app.config['PAYMENT_SCHEDULE_MAX_INSTALLMENTS']
+    try:
+        installments = int(installments)
+        if not 1 <= installments <= max_installments:
+            errors.append(f'installments must be between 1 and {max_installments}')
+    except (TypeError, ValueError):
+        errors.append('invalid installments')
+    try:
+        start = datetime.date.fromisoformat(str(start or '').strip())
+    except ValueError:
+        errors.append('invalid start date (YYYY-MM-DD)')
+    if not isinstance(frequency, str) or frequency not in FREQUENCIES:
+        errors.append(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    if total not in (None, ''):
+        try:
+            total = Decimal(str(total).strip())
+            if not total.is_finite() or total <= 0:
+                errors.append('total must be positive')
+            elif isinstance(installments, int) and total < installments * MIN_INSTALLMENT:
+                # every installment must be at least one cent
+                errors.append(f'total must be at least {MIN_INSTALLMENT} per installment')
+        except InvalidOperation:
+            errors.append('invalid total')
+    else:
+        total = None
+    if errors:
+        return None, errors
+    return {'contract_id': contract_id, 'installments': installments, 'start': start,
+            'step': FREQUENCIES.get(frequency), 'total': total, 'min_installment': MIN_INSTALLMENT}, []
+
+
+# function to create the installments of a contract in a single round trip
+def create_schedule(conn, contract_id, installments, start, frequency, total=None):
+    """Insert ``installments`` payments for a contract, ``frequency`` apart from ``start``.
+
+    The amounts split ``total`` (the property price by default) into equal
+    parts cut to cents, the last one taking the remainder; a total below one
+    cent per installment is rejected. Returns a dict with the inserted ``(payment_id,
+    amount, date)`` rows and the list of errors, all reported together.
+    """
+    params, errors = schedule_params(contract_id, installments, start, frequency, total)
+    if errors:
+        return {'inserted': [], 'errors': errors}
+
+    cur = conn.cursor()
+    try:
+        cur.execute(SCHEDULE_QUERY, params)
+        inserted = cur.fetchall()
+        if not inserted:
+            conn.rollback()
+            # nothing was inserted: either there is no such contract or its property price is too small
+            cur.execute('SELECT pr.price FROM contract c JOIN property pr ON pr.property_id = c.property_id '
+                        'WHERE c.contract_id = %s', (params['contract_id'],))
+            found = cur.fetchone()
+            conn.rollback()
+            if found is None:
+                return {'inserted': [], 'errors': ['unknown contract_id']}
+            return {'inserted': [], 'errors': [f'the property price ({found[0]}) is below {MIN_INSTALLMENT} per installment']}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return {'inserted': inserted, 'errors': []}
+
+
+# ----- flask integration -----
+# function to register the batch limits with an app
+def init_app(app):
+    app.config.setdefault('PAYMENT_BATCH_MAX_ROWS', int(os.environ.get('PAYMENT_BATCH_MAX_ROWS', 10000)))
+    app.config.setdefault('PAYMENT_SCHEDULE_MAX_INSTALLMENTS', int(os.environ.get('PAYMENT_SCHEDULE_MAX_INSTALLMENTS', 600)))
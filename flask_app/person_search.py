@@ -0,0 +1,95 @@
+# ----- imports -----
+import re
+
+
+# ----- settings -----
+# the indexed search text of a person (see migration 8); must stay identical to the index expression
+SEARCH_TEXT = 'person_search_text(p.first_name, p.last_name, p.email, p.phone_number)'
+
+# roles a search can be restricted to, each the name of its table
+ROLES = ('owner', 'agent', 'client')
+
+# shortest query served by the trigram index; shorter ones match last name prefixes
+MIN_TRIGRAM_LENGTH = 3
+
+# matches ranked per search; a very common name or fragment is ranked among its first matches only,
+# which keeps the cost of a search bounded however many persons share it
+MAX_CANDIDATES = 1000
+
+# a query made of digits and phone punctuation only is matched as a phone number
+PHONE_QUERY = re.compile(r'^[\d\s+()./-]+$')
+
+
+# ----- query building -----
+# function to reduce a query to the form of the search text: lower case, phone numbers as digits only
+def normalize(q):
+    q = ' '.join(q.lower().split())
+    if PHONE_QUERY.match(q) and sum(c.isdigit() for c in q) >= MIN_TRIGRAM_LENGTH:
+        q = re.sub(r'\D', '', q)
+    return q
+
+
+# function to escape the LIKE wildcards of user input
+def like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# function to build the search statement for a normalized query, returning (sql, params)
+def build_query(q, role=None, limit=20):
+    """Build the ranked search for ``q`` (already normalized).
+
+    Queries of three or more characters match a substring of the search
+    text or, for typos, a word similar to the query (``<%``); both are
+    served by the trigram GIN index. Prefix matches of a name, the email or
+    the phone number rank first, then substring matches, then by word
+    similarity. Shorter queries match last name prefixes through a B-tree.
+    At most ``MAX_CANDIDATES`` matches are ranked.
+    """
+    conditions, params = [], []
+    prefix = like_escape(q) + '%'
+    if len(q) >= MIN_TRIGRAM_LENGTH:
+        conditions.append(f'({SEARCH_TEXT} LIKE %s OR %s <%% {SEARCH_TEXT})')
+        params += ['%' + like_escape(q) + '%', q]
+        rank = f'''(lower(p.first_name) LIKE %s OR lower(p.last_name) LIKE %s OR lower(p.email) LIKE %s
+                    OR regexp_replace(p.phone_number, '\\D', '', 'g') LIKE %s) DESC,
+                   {SEARCH_TEXT} LIKE %s DESC,
+                   word_similarity(%s, {SEARCH_TEXT}) DESC, p.person_id'''
+        rank_params = [prefix] * 4 + ['%' + like_escape(q) + '%', q]
+    else:
+        conditions.append('lower(p.last_name) LIKE %s')
+        params.append(prefix)
+        rank, rank_params = 'lower(p.last_name), p.person_id', []
+    # short queries are ranked by last name alone, so their candidates must be the first ones in that order
+    candidates_order = '' if rank_params else f'ORDER BY {rank}'
+
+    if role in ROLES:
+        conditions.append(f'EXISTS (SELECT 1 FROM {role} r WHERE r.person_id = p.person_id)')
+
+    # the role subqueries are evaluated after the sort, for the rows of the page only
+    sql = f'''
+        SELECT p.person_id, p.first_name, p.last_name, p.email, p.phone_number,
+               (SELECT min(o.owner_id) FROM owner o WHERE o.person_id = p.person_id) AS owner_id,
+               (SELECT min(ag.agent_id) FROM agent ag WHERE ag.person_id = p.person_id) AS agent_id,
+               (SELECT min(cl.client_id) FROM client cl WHERE cl.person_id = p.person_id) AS client_id
+        FROM (
+            SELECT * FROM person p
+            WHERE {' AND '.join(conditions)}
+            {candidates_order}
+            LIMIT %s
+        ) p
+        ORDER BY {rank}
+        LIMIT %s
+    '''
+    return sql, params + [MAX_CANDIDATES] + rank_params + [limit]
+
+
+# ----- search -----
+# function to find persons by name, email or phone number, best matches first
+def search(cur, q, role=None, limit=20):
+    q = normalize(q)
+    if not q:
+        return []
+    sql, params = build_query(q, role, limit)
+    cur.execute(sql, params)
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
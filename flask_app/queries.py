@@ -0,0 +1,88 @@
+# ----- list queries -----
+# the SELECT ... FROM ... JOIN ... part of every show_* route; WHERE/ORDER BY/LIMIT are added by the caller
+
+# select address entries
+ADDRESS_LIST_QUERY = 'SELECT * FROM address a'
+
+# select person entries and relevant columns from the address table, joining them on the address_id
+PERSON_LIST_QUERY = '''
+    SELECT p.*, a.address_line, a.country, a.postal_code
+    FROM person p
+    JOIN address a ON p.address_id = a.address_id
+'''
+
+# select owner entries and relevant columns from the person and address table, joining them on the person_id and address_id
+OWNER_LIST_QUERY = '''
+    SELECT o.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line
+    FROM owner o
+    JOIN person p ON o.person_id = p.person_id
+    JOIN address a ON p.address_id = a.address_id
+'''
+
+# select agent entries and relevant columns from the person and address table, joining them on the person_id and address_id
+AGENT_LIST_QUERY = '''
+    SELECT ag.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line
+    FROM agent ag
+    JOIN person p ON ag.person_id = p.person_id
+    JOIN address a ON p.address_id = a.address_id
+'''
+
+# select client entries and relevant columns from the person and address table, joining them on the person_id and address_id
+CLIENT_LIST_QUERY = '''
+    SELECT cl.*, p.first_name, p.last_name, p.email, p.date_of_birth, p.phone_number, a.address_line
+    FROM client cl
+    JOIN person p ON cl.person_id = p.person_id
+    JOIN address a ON p.address_id = a.address_id
+'''
+
+# select location entries
+LOCATION_LIST_QUERY = 'SELECT * FROM location l'
+
+# select property entries with the owner name and coordinates from the property_listing projection (migration 9),
+# which the triggers keep joined with the location, owner, and person tables
+PROPERTY_LIST_QUERY = '''
+    SELECT p.property_id, p.number_of_rooms, p.building_year, p.area_size, p.price, p.location_id, p.owner_id,
+           p.first_name, p.last_name, p.latitude, p.longitude
+    FROM property_listing p
+'''
+
+# select contract entries with the agent and client names and the property coordinates from the contract_listing projection (migration 9)
+CONTRACT_LIST_QUERY = '''
+    SELECT c.contract_id, c.sign_date, c.agent_first_name, c.agent_last_name,
+           c.client_first_name, c.client_last_name, c.property_id, c.latitude, c.longitude
+    FROM contract_listing c
+'''
+
+# select payment entries and relevant columns from the contract table, joining them on the contract_id
+PAYMENT_LIST_QUERY = '''
+    SELECT p.*, c.contract_id
+    FROM payment p
+    JOIN contract c ON p.contract_id = c.contract_id
+'''
+
+# entity name -> (list query, keyset pagination column)
+LIST_QUERIES = {
+    'address': (ADDRESS_LIST_QUERY, 'a.address_id'),
+    'person': (PERSON_LIST_QUERY, 'p.person_id'),
+    'owner': (OWNER_LIST_QUERY, 'o.owner_id'),
+    'agent': (AGENT_LIST_QUERY, 'ag.agent_id'),
+    'client': (CLIENT_LIST_QUERY, 'cl.client_id'),
+    'location': (LOCATION_LIST_QUERY, 'l.location_id'),
+    'property': (PROPERTY_LIST_QUERY, 'p.property_id'),
+    'contract': (CONTRACT_LIST_QUERY, 'c.contract_id'),
+    'payment': (PAYMENT_LIST_QUERY, 'p.payment_id'),
+}
+
+# entity name -> tables read by its list query; a write to any of them changes the list
+# (for property and contract: the base tables of their listing projection)
+LIST_TABLES = {
+    'address': ('address',),
+    'person': ('person', 'address'),
+    'owner': ('owner', 'person', 'address'),
+    'agent': ('agent', 'person', 'address'),
+    'client': ('client', 'person', 'address'),
+    'location': ('location',),
+    'property': ('property', 'location', 'owner', 'person'),
+    'contract': ('contract', 'agent', 'client', 'person', 'property', 'location'),
+    'payment': ('payment', 'contract'),
+}
@@ -0,0 +1,186 @@
+# ----- imports -----
+import collections
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from flask import current_app, has_app_context, has_request_context, request
+import db
+
+
+logger = logging.getLogger(__name__)
+
+
+# ----- normalization -----
+# literals that vary between calls of the same statement
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+WHITESPACE = re.compile(r'\s+')
+
+# statements a slow-query EXPLAIN ANALYZE may run a second time: plain reads, without data-modifying CTEs
+READ_STATEMENT = re.compile(r'^\(*\s*(SELECT|WITH)\b', re.IGNORECASE)
+WRITE_KEYWORD = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE)\b', re.IGNORECASE)
+
+
+# function to reduce a statement to its shape: literals become ?, whitespace and comments collapse
+def normalize(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = re.sub(r'--[^\n]*', ' ', str(query))
+    query = STRING_LITERAL.sub('?', query)
+    query = NUMBER_LITERAL.sub('?', query)
+    return WHITESPACE.sub(' ', query).strip()
+
+
+# function to fingerprint the parameters of a call without keeping their values
+def fingerprint(params):
+    if params is None:
+        return None
+    return hashlib.sha1(repr(params).encode('utf-8', 'replace')).hexdigest()[:12]
+
+
+# function to tell whether a statement is a read that EXPLAIN ANALYZE can execute again
+def is_read(query):
+    sql = normalize(query)
+    return bool(READ_STATEMENT.match(sql)) and not WRITE_KEYWORD.search(sql)
+
+
+# ----- log -----
+class QueryLog:
+    """Per-statement timing statistics plus a ring buffer of slow statements.
+
+    Statements are grouped by their normalized text; at most ``max_statements``
+    groups are kept, dropping the one with the least total time when full.
+    Statements slower than ``slow_seconds`` go into the ring buffer; a sample
+    of them (``explain_sample``, at most one per ``explain_interval`` seconds)
+    is explained so the log shows the plan: reads are re-run under
+    ``EXPLAIN (ANALYZE, BUFFERS)`` inside a savepoint that is rolled back,
+    anything else only gets a plain ``EXPLAIN``.
+    """
+
+    def __init__(self, slow_seconds=0.2, size=100, explain_sample=0.1, explain_interval=10.0, max_statements=500):
+        self.slow_seconds = slow_seconds
+        self.explain_sample = explain_sample
+        self.explain_interval = explain_interval
+        self.max_statements = max_statements
+        self.slow = collections.deque(maxlen=size)
+        self._statements = {} # normalized sql -> [calls, total seconds, max seconds, rows]
+        self._normalized = {} # raw sql -> normalized sql, the same few strings are executed over and over
+        self._last_explain = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, cursor, query, params, seconds):
+        # the EXPLAIN statements of the log itself are not recorded
+        if getattr(self._local, 'explaining', False):
+            return
+        sql = self._normalized.get(query)
+        if sql is None:
+            sql = normalize(query)
+            if len(self._normalized) < 4 * self.max_statements:
+                self._normalized[query] = sql
+        rows = max(cursor.rowcount, 0)
+
+        with self._lock:
+            stats = self._statements.get(sql)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    del self._statements[min(self._statements, key=lambda key: self._statements[key][1])]
+                stats = self._statements[sql] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] += rows
+
+        if seconds >= self.slow_seconds:
+            self._record_slow(cursor, query, params, sql, seconds, rows)
+
+    def _record_slow(self, cursor, query, params, sql, seconds, rows):
+        entry = {
+            'at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'sql': sql,
+            'params': fingerprint(params),
+            'ms': round(seconds * 1000, 1),
+            'rows': rows,
+            'route': request.endpoint if has_request_context() else None,
+            'plan': None,
+        }
+        now = time.monotonic()
+        with self._lock:
+            explain = now - self._last_explain >= self.explain_interval and random.random() < self.explain_sample
+            if explain:
+                self._last_explain = now
+        if explain and cursor.name is None:
+            entry['plan'] = self._explain(cursor.connection, query, params)
+        self.slow.append(entry)
+        logger.warning('slow query (%.1f ms, %s rows): %s', entry['ms'], rows, sql)
+
+    def _explain(self, conn, query, params):
+        # only inside a healthy transaction, and only reads are analyzed, since ANALYZE executes the statement
+        # again; everything else gets a plain EXPLAIN. The savepoint is always rolled back, which undoes
+        # whatever the second run did (row locks, functions with side effects) and a failing EXPLAIN alike
+        if conn.autocommit or conn.get_transaction_status() != extensions.TRANSACTION_STATUS_INTRANS:
+            return None
+        options = '(ANALYZE, BUFFERS)' if is_read(query) else ''
+        self._local.explaining = True
+        cur = conn.cursor()
+        try:
+            cur.execute('SAVEPOINT query_log_explain')
+            try:
+                cur.execute(f'EXPLAIN {options} {query}', params)
+                return '\n'.join(row[0] for row in cur.fetchall())
+            except psycopg2.Error as e:
+                return f'EXPLAIN failed: {e}'
+            finally:
+                cur.execute('ROLLBACK TO SAVEPOINT query_log_explain')
+                cur.execute('RELEASE SAVEPOINT query_log_explain')
+        finally:
+            cur.close()
+            self._local.explaining = False
+
+    def top(self, order='total', limit=20):
+        with self._lock:
+            statements = [{'sql': sql, 'calls': calls, 'total_ms': round(total * 1000, 1),
+                           'mean_ms': round(total / calls * 1000, 3), 'max_ms': round(longest * 1000, 1),
+                           'rows': rows, 'rows_per_call': round(rows / calls, 1)}
+                          for sql, (calls, total, longest, rows) in self._statements.items()]
+        key = 'mean_ms' if order == 'mean' else 'total_ms'
+        return sorted(statements, key=lambda statement: statement[key], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.slow.clear()
+
+
+# ----- flask integration -----
+# query hook of db.InstrumentedCursor
+def record_query(cursor, query, params, seconds):
+    if has_app_context() and 'query_log' in current_app.extensions:
+        current_app.extensions['query_log'].record(cursor, query, params, seconds)
+
+
+# function to return the query log of the current app
+def get_log():
+    return current_app.extensions['query_log']
+
+
+# function to register the query log with an app
+def init_app(app):
+    app.config.setdefault('QUERY_LOG_SLOW_MS', float(os.environ.get('QUERY_LOG_SLOW_MS', 200)))
+    app.config.setdefault('QUERY_LOG_SIZE', int(os.environ.get('QUERY_LOG_SIZE', 100)))
+    app.config.setdefault('QUERY_LOG_EXPLAIN_SAMPLE', float(os.environ.get('QUERY_LOG_EXPLAIN_SAMPLE', 0.1)))
+    app.config.setdefault('QUERY_LOG_EXPLAIN_INTERVAL', float(os.environ.get('QUERY_LOG_EXPLAIN_INTERVAL', 10)))
+    app.extensions['query_log'] = QueryLog(
+        slow_seconds=app.config['QUERY_LOG_SLOW_MS'] / 1000,
+        size=app.config['QUERY_LOG_SIZE'],
+        explain_sample=app.config['QUERY_LOG_EXPLAIN_SAMPLE'],
+        explain_interval=app.config['QUERY_LOG_EXPLAIN_INTERVAL'],
+    )
+    if record_query not in db.QUERY_HOOKS:
+        db.QUERY_HOOKS.append(record_query)
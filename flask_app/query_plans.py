@@ -0,0 +1,178 @@
+# ----- imports -----
+import json
+import person_search
+from queries import LIST_QUERIES
+from reports import AGENT_REVENUE_QUERY, CONTRACT_BALANCE_QUERY
+
+
+# ----- plan checks -----
+# (name, query, params) of every statement whose plan must not fall back to a sequential scan;
+# the page queries are built exactly like fetch_page() builds them for the show_* routes
+PLAN_CHECKS = []
+for entity, (query, key) in LIST_QUERIES.items():
+    PLAN_CHECKS.append((f'show_{entity} first page', f'{query} ORDER BY {key} ASC LIMIT %s', (51,)))
+    PLAN_CHECKS.append((f'show_{entity} deep page', f'{query} WHERE {key} > %s ORDER BY {key} ASC LIMIT %s', (f'middle:{key.split(".")[-1][:-3]}', 51)))
+
+# lookups from the referenced side of every foreign key
+PLAN_CHECKS += [
+    ('persons at an address', 'SELECT * FROM person WHERE address_id = %s', (1,)),
+    ('owner of a person', 'SELECT * FROM owner WHERE person_id = %s', (1,)),
+    ('agent of a person', 'SELECT * FROM agent WHERE person_id = %s', (1,)),
+    ('client of a person', 'SELECT * FROM client WHERE person_id = %s', (1,)),
+    ('properties of an owner', 'SELECT * FROM property WHERE owner_id = %s', (1,)),
+    ('properties at a location', 'SELECT * FROM property WHERE location_id = %s', (1,)),
+    ('contracts of an agent', 'SELECT * FROM contract WHERE agent_id = %s', (1,)),
+    ('contracts of a client', 'SELECT * FROM contract WHERE client_id = %s', (1,)),
+    ('contracts of a property', 'SELECT * FROM contract WHERE property_id = %s', (1,)),
+    ('payments of a contract', 'SELECT * FROM payment WHERE contract_id = %s ORDER BY date', (1,)),
+]
+
+# date-bounded contract list (payments are pruned to the partitions of the range instead, see flask benchmark-partitions)
+PLAN_CHECKS += [
+    ('show_contract one month', "SELECT * FROM contract_listing c WHERE c.sign_date >= %s AND c.sign_date < %s ORDER BY c.contract_id ASC LIMIT %s",
+     ('2010-03-01', '2010-04-01', 51)),
+]
+
+# property search filters backed by the composite indexes of the property_listing projection
+PLAN_CHECKS += [
+    ('search rooms and price', 'SELECT * FROM property_listing WHERE number_of_rooms = %s AND price BETWEEN %s AND %s', (3, 200000, 250000)),
+    ('search year and price', 'SELECT * FROM property_listing WHERE building_year = %s AND price <= %s', (1990, 300000)),
+    ('search owner last name', 'SELECT * FROM property_listing WHERE lower(last_name) = %s', ('last42',)),
+    ('search grid cells', 'SELECT * FROM property_listing WHERE grid_cell BETWEEN %s AND %s', (1000, 1010)),
+    ('listing contracts of an agent', 'SELECT * FROM contract_listing WHERE agent_id = %s', (1,)),
+]
+
+# person search through the trigram index (substring, typo, phone digits) and the last name prefix index
+PLAN_CHECKS += [
+    ('search person substring', *person_search.build_query('last42')),
+    ('search person typo', *person_search.build_query('lsat4217')),
+    ('search person phone', *person_search.build_query('0000012345')),
+    ('search person short prefix', *person_search.build_query('la')),
+    ('search owner substring', *person_search.build_query('first42', role='owner')),
+]
+
+# reports read the aggregate tables by their keys
+PLAN_CHECKS += [
+    ('report balances first page', f'{CONTRACT_BALANCE_QUERY} ORDER BY b.contract_id ASC LIMIT %s', (51,)),
+    ('report balances deep page', f'{CONTRACT_BALANCE_QUERY} WHERE b.contract_id > %s ORDER BY b.contract_id ASC LIMIT %s',
+     ('middle:contract', 51)),
+    ('report agent revenue of a month', f'{AGENT_REVENUE_QUERY} WHERE r.month = %s AND r.payments > 0 ORDER BY r.agent_id ASC LIMIT %s',
+     ('2010-01-01', 51)),
+    ('report agent revenue history', f'{AGENT_REVENUE_QUERY} WHERE r.agent_id = %s AND r.payments > 0 ORDER BY r.month DESC LIMIT %s',
+     (1, 120)),
+]
+
+
+# ----- synthetic data -----
+# statements filling every table with `n` rows (fewer owners, agents and clients, more payments), each referencing the rows inserted just before it;
+# %(base_<table>)s is the id of the first row inserted into <table> by this run
+SYNTHETIC_DATA = [
+    ('address', '''
+        INSERT INTO address (street_number, address_line, country, postal_code)
+        SELECT g %% 1000, 'Street ' || g, 'Country ' || (g %% 50), lpad((g %% 100000)::text, 5, '0')
+        FROM generate_series(1, %(n)s) g
+    '''),
+    ('person', '''
+        INSERT INTO person (first_name, last_name, date_of_birth, phone_number, email, address_id)
+        SELECT 'First' || g, 'Last' || (g %% 5000), DATE '1950-01-01' + (g %% 20000), lpad(g::text, 10, '0'),
+               'person' || g || '@example.com', %(base_address)s + g - 1
+        FROM generate_series(1, %(n)s) g
+    '''),
+    ('owner', '''
+        INSERT INTO owner (person_id, resident_status, acquisition_date)
+        SELECT %(base_person)s + g - 1, 'Permanent', DATE '2000-01-01' + (g %% 8000)
+        FROM generate_series(1, %(n)s / 3) g
+    '''),
+    ('agent', '''
+        INSERT INTO agent (person_id, employment_date)
+        SELECT %(base_person)s + %(n)s / 3 + g - 1, DATE '2000-01-01' + (g %% 8000)
+        FROM generate_series(1, %(n)s / 10) g
+    '''),
+    ('client', '''
+        INSERT INTO client (person_id, purchase_date)
+        SELECT %(base_person)s + %(n)s / 2 + g - 1, DATE '2000-01-01' + (g %% 8000)
+        FROM generate_series(1, %(n)s / 3) g
+    '''),
+    ('location', '''
+        INSERT INTO location (latitude, longitude)
+        SELECT 45.8 + (g %% 1000) * 0.001, 5.9 + (g / 1000) %% 1000 * 0.005
+        FROM generate_series(1, %(n)s) g
+    '''),
+    ('property', '''
+        INSERT INTO property (number_of_rooms, building_year, area_size, price, location_id, owner_id)
+        SELECT 1 + g %% 8, 1900 + g %% 124, 30 + g %% 300, 100000 + (g %% 900) * 1000,
+               %(base_location)s + g - 1, %(base_owner)s + g %% (%(n)s / 3)
+        FROM generate_series(1, %(n)s) g
+    '''),
+    ('contract', '''
+        INSERT INTO contract (sign_date, agent_id, client_id, property_id)
+        SELECT DATE '2000-01-01' + (g %% 8000), %(base_agent)s + g %% (%(n)s / 10),
+               %(base_client)s + g %% (%(n)s / 3), %(base_property)s + g - 1
+        FROM generate_series(1, %(n)s) g
+    '''),
+    ('payment', '''
+        INSERT INTO payment (amount, date, contract_id)
+        SELECT 1000 + g %% 50000, DATE '2000-01-01' + (g %% 8000), %(base_contract)s + g %% %(n)s
+        FROM generate_series(1, %(n)s * 3) g
+    '''),
+]
+
+
+# ----- helpers -----
+# function to fill the tables with synthetic rows inside the caller's (uncommitted) transaction
+def insert_synthetic_data(cur, n):
+    values = {'n': n}
+    for table, statement in SYNTHETIC_DATA:
+        # ids continue from the sequence, so remember where this run starts
+        cur.execute(f"SELECT last_value + CASE WHEN is_called THEN 1 ELSE 0 END FROM {table}_{table}_id_seq")
+        values[f'base_{table}'] = cur.fetchone()[0]
+        cur.execute(statement, values)
+    return values
+
+
+# function to return the tables read by a sequential scan anywhere in an EXPLAIN (FORMAT JSON) plan
+def seq_scans(plan):
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found += seq_scans(child)
+    return found
+
+
+# function to check every statement in PLAN_CHECKS against a large synthetic dataset
+def check_plans(conn, n=50000):
+    """Return a list of (check name, tables read by seq scan) for every failing check.
+
+    The synthetic rows are inserted and analyzed inside a transaction that is
+    always rolled back, so no row is left behind, but this is meant for CI or
+    a scratch database, not production. Until the rollback the inserts keep
+    the aggregate and listing projection rows they touch locked, and the
+    ANALYZE blocks vacuum and schema changes on those tables. The sequence
+    values of the ``n`` rows per table are used up for good, and the row
+    estimates ANALYZE writes to ``pg_class`` are not rolled back.
+    """
+    cur = conn.cursor()
+    failures = []
+    try:
+        values = insert_synthetic_data(cur, n)
+        cur.execute('ANALYZE address, person, owner, agent, client, location, property, contract, payment, '
+                    'contract_balance, agent_revenue_monthly, property_listing, contract_listing')
+        # payment partitions without synthetic rows (future years, the default partition) cost nothing to scan
+        cur.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND relispartition AND reltuples = 0")
+        empty = {name for name, in cur.fetchall()}
+
+        for name, query, params in PLAN_CHECKS:
+            # deep pages seek from the middle of the synthetic rows of the driving table
+            params = tuple(values['base_' + p[7:]] + n // 4 if str(p).startswith('middle:') else p for p in params)
+            cur.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            tables = [table for table in seq_scans(plan[0]['Plan']) if table not in empty]
+            if tables:
+                failures.append((name, tables))
+    finally:
+        conn.rollback()
+        cur.close()
+    return failures
@@ -0,0 +1,90 @@
+# ----- imports -----
+import datetime
+from pagination import date_conditions
+
+
+# ----- queries -----
+# paid-to-date and outstanding balance per contract, read from the trigger-maintained contract_balance table
+CONTRACT_BALANCE_QUERY = '''
+    SELECT b.contract_id, c.sign_date, c.property_id, pr.price, b.paid, pr.price - b.paid AS outstanding, b.payments
+    FROM contract_balance b
+    JOIN contract c ON b.contract_id = c.contract_id
+    JOIN property pr ON c.property_id = pr.property_id
+'''
+
+# revenue per agent and month, read from the trigger-maintained agent_revenue_monthly table
+AGENT_REVENUE_QUERY = '''
+    SELECT r.agent_id, per.first_name, per.last_name, r.month, r.revenue, r.payments
+    FROM agent_revenue_monthly r
+    JOIN agent ag ON r.agent_id = ag.agent_id
+    JOIN person per ON ag.person_id = per.person_id
+'''
+
+
+# ----- helpers -----
+# function to parse a YYYY-MM month into the first day of that month (None when missing or malformed)
+def read_month(value):
+    try:
+        return datetime.datetime.strptime(value or '', '%Y-%m').date()
+    except ValueError:
+        return None
+
+
+# function to return the most recent month with revenue, from the primary key alone
+def latest_month(cur):
+    cur.execute('SELECT max(month) FROM agent_revenue_monthly')
+    return cur.fetchone()[0]
+
+
+# function to return the revenue and number of payments of one month over all agents
+def month_total(cur, month):
+    cur.execute('SELECT COALESCE(sum(revenue), 0), COALESCE(sum(payments), 0) FROM agent_revenue_monthly WHERE month = %s',
+                (month,))
+    revenue, payments = cur.fetchone()
+    return {'revenue': revenue, 'payments': payments}
+
+
+# function to return the monthly revenue of one agent, most recent month first, optionally only the months
+# starting in [date_from, date_to)
+def agent_history(cur, agent_id, months=120, date_from=None, date_to=None):
+    conditions, params = date_conditions('r.month', date_from, date_to)
+    where = ''.join(f' AND {condition}' for condition in conditions)
+    cur.execute(f'{AGENT_REVENUE_QUERY} WHERE r.agent_id = %s AND r.payments > 0{where} ORDER BY r.month DESC LIMIT %s',
+                (agent_id, *params, months))
+
+    # combine the column names and row values into a list of dictionaries
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+# ----- maintenance -----
+# function to recompute both aggregates from payment/contract, e.g. after triggers were disabled for a bulk load
+def rebuild(conn):
+    """Recompute ``contract_balance`` and ``agent_revenue_monthly`` from scratch.
+
+    Runs in one transaction with payments and contracts locked against
+    concurrent writers; report readers wait for the new totals to commit.
+    Returns the number of contract and agent/month rows written.
+    """
+    cur = conn.cursor()
+    cur.execute('LOCK TABLE payment, contract IN SHARE MODE')
+    cur.execute('TRUNCATE contract_balance, agent_revenue_monthly')
+    cur.execute('''
+        INSERT INTO contract_balance (contract_id, paid, payments)
+        SELECT c.contract_id, COALESCE(sum(p.amount), 0), count(p.payment_id)
+        FROM contract c
+        LEFT JOIN payment p ON p.contract_id = c.contract_id
+        GROUP BY c.contract_id
+    ''')
+    contracts = cur.rowcount
+    cur.execute('''
+        INSERT INTO agent_revenue_monthly (month, agent_id, revenue, payments)
+        SELECT date_trunc('month', p.date)::date, c.agent_id, sum(p.amount), count(*)
+        FROM payment p
+        JOIN contract c ON c.contract_id = p.contract_id
+        GROUP BY 1, 2
+    ''')
+    months = cur.rowcount
+    conn.commit()
+    cur.close()
+    return contracts, months
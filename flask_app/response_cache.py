@@ -0,0 +1,103 @@
+# ----- imports -----
+import functools
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, make_response, request
+import versions
+from db import get_db_connection
+from queries import LIST_TABLES
+
+
+# ----- cache -----
+class ResponseCache:
+    """Rendered responses of the read routes, bounded by the total body size.
+
+    An entry is keyed on the endpoint and its query parameters and remembers
+    the version tag of the tables it was rendered from. A lookup with a newer
+    tag is a miss and the re-rendered page replaces the stale entry, so old
+    versions never pile up. Least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (tag, body, mimetype)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def get(self, key, tag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != tag:
+                self._stats['stale' if entry is not None else 'misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, tag, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[1])
+            self._entries[key] = (tag, body, mimetype)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses'] + self._stats['stale']
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                        hit_ratio=round(self._stats['hits'] / lookups, 3) if lookups else None)
+
+
+# ----- flask integration -----
+# function to return the response cache of the current app
+def get_cache():
+    return current_app.extensions['response_cache']
+
+
+# decorator caching the rendered page of a show_* route until a table of its list query changes
+def cached(entity):
+    tables = LIST_TABLES[entity]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # streamed full-table views are never buffered
+            if not current_app.config['RESPONSE_CACHE_ENABLED'] or request.args.get('all') == '1':
+                return view(*args, **kwargs)
+
+            # one primary key lookup instead of the joins and the template
+            cur = get_db_connection().cursor()
+            tag = versions.version_tag(versions.table_versions(cur, tables))
+            cur.close()
+
+            key = (request.endpoint, tuple(sorted(request.args.items(multi=True))))
+            entry = get_cache().get(key, tag)
+            if entry is not None:
+                return Response(entry[1], mimetype=entry[2])
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                get_cache().put(key, tag, response.get_data(), response.mimetype)
+            return response
+        return wrapper
+    return decorator
+
+
+# function to register the response cache with an app
+def init_app(app):
+    app.config.setdefault('RESPONSE_CACHE_ENABLED', os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1')
+    app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+    app.extensions['response_cache'] = ResponseCache(max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
@@ -0,0 +1,233 @@
+# ----- imports -----
+import datetime
+import io
+import random
+import time
+
+
+# ----- settings -----
+# named dataset sizes (number of properties); every other table is derived from it
+SCALES = {
+    'small': 10_000,
+    'medium': 1_000_000,
+    'large': 10_000_000,
+}
+
+FIRST_NAMES = ['Anna', 'Luca', 'Mia', 'Noah', 'Lea', 'Elias', 'Sofia', 'Leon', 'Emma', 'Louis', 'Lina', 'David',
+               'Laura', 'Jonas', 'Sara', 'Marco', 'Julia', 'Nico', 'Alice', 'Peter', 'Hermione', 'Harry', 'Wendy', 'Ron']
+LAST_NAMES = ['Müller', 'Meier', 'Schmid', 'Keller', 'Weber', 'Huber', 'Schneider', 'Meyer', 'Steiner', 'Fischer',
+              'Gerber', 'Brunner', 'Baumann', 'Frei', 'Zimmermann', 'Moser', 'Widmer', 'Wyss', 'Graf', 'Roth',
+              'Montani', 'Kozmer', 'Potter', 'Granger']
+STREETS = ['Bahnhofstrasse', 'Hauptstrasse', 'Dorfstrasse', 'Seestrasse', 'Kirchweg', 'Schulstrasse', 'Bergstrasse',
+           'Gartenweg', 'Industriestrasse', 'Rosenweg']
+
+# first day contracts are signed on; payments follow within the next years
+FIRST_SIGN_DATE = datetime.date(2005, 1, 1)
+
+# (city, country, latitude, longitude, price per square metre)
+CITIES = [
+    ('Zurich', 'Switzerland', 47.3769, 8.5417, 14000),
+    ('Geneva', 'Switzerland', 46.2044, 6.1432, 15000),
+    ('Basel', 'Switzerland', 47.5596, 7.5886, 10000),
+    ('Bern', 'Switzerland', 46.9480, 7.4474, 9000),
+    ('Lausanne', 'Switzerland', 46.5197, 6.6323, 11000),
+    ('Lucerne', 'Switzerland', 47.0502, 8.3093, 10500),
+    ('St. Gallen', 'Switzerland', 47.4245, 9.3767, 7500),
+    ('Lugano', 'Switzerland', 46.0037, 8.9511, 9500),
+    ('Munich', 'Germany', 48.1351, 11.5820, 9000),
+    ('Milan', 'Italy', 45.4642, 9.1900, 5500),
+]
+
+
+# ----- copy streams -----
+# file-like object feeding COPY FROM STDIN from a generator of text lines, one chunk at a time
+class LineStream(io.RawIOBase):
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = b''
+        self.rows = 0 # lines handed to COPY so far
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        # fill the buffer with whole lines until the requested size is available
+        while len(self._buffer) < len(target):
+            lines = [line for _, line in zip(range(1000), self._lines)]
+            if not lines:
+                break
+            self.rows += len(lines)
+            self._buffer += ''.join(lines).encode('utf-8')
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+# ----- generator -----
+class DatasetGenerator:
+    """Referentially consistent synthetic rows for every table.
+
+    Ids are assigned explicitly, starting after the highest existing id of
+    each table, so a dataset can be loaded into an empty or a seeded database.
+    Sizes are derived from the number of properties: half as many owners,
+    one agent per 200 properties, 60% of the properties sold (one contract
+    and 1-6 payments each) and one client per contract.
+    """
+
+    def __init__(self, properties, seed=1, start_ids=None):
+        self.properties = properties
+        self.owners = max(1, properties // 2)
+        self.agents = max(1, properties // 200)
+        self.contracts = properties * 6 // 10
+        self.clients = max(1, self.contracts)
+        self.persons = self.owners + self.agents + self.clients
+        self.seed = seed
+        self.start = start_ids or {}
+
+    def _first(self, table):
+        return self.start.get(table, 1)
+
+    def counts(self):
+        return {
+            'address': self.persons,
+            'person': self.persons,
+            'owner': self.owners,
+            'agent': self.agents,
+            'client': self.clients,
+            'location': self.properties,
+            'property': self.properties,
+            'contract': self.contracts,
+            'payment': 'about ' + str(self.contracts * 7 // 2),
+        }
+
+    def _sign_date(self, i):
+        # contract dates are a pure function of the index so payments can be generated after their contract
+        return FIRST_SIGN_DATE + datetime.timedelta(days=(i * 2654435761 + self.seed) % 6800)
+
+    def address(self):
+        rnd = random.Random(self.seed)
+        first = self._first('address')
+        for i in range(self.persons):
+            city, country = CITIES[i % len(CITIES)][:2]
+            yield (f'{first + i}\t{rnd.randint(1, 200)}\t{rnd.choice(STREETS)} ({city})\t{country}'
+                   f'\t{rnd.randint(1000, 9999)}\n')
+
+    def person(self):
+        rnd = random.Random(self.seed + 1)
+        first, first_address = self._first('person'), self._first('address')
+        birth = datetime.date(1940, 1, 1)
+        for i in range(self.persons):
+            first_name, last_name = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+            dob = birth + datetime.timedelta(days=rnd.randint(0, 23000))
+            yield (f'{first + i}\t{first_name}\t{last_name}\t{dob}\t07{rnd.randint(10000000, 99999999)}'
+                   f'\t{first_name.lower()}.{last_name.lower()}.{first + i}@example.com\t{first_address + i}\n')
+
+    def owner(self):
+        rnd = random.Random(self.seed + 2)
+        first, first_person = self._first('owner'), self._first('person')
+        for i in range(self.owners):
+            status = 'Permanent' if rnd.random() < 0.8 else 'Temporary'
+            acquired = datetime.date(1980, 1, 1) + datetime.timedelta(days=rnd.randint(0, 16000))
+            yield f'{first + i}\t{first_person + i}\t{status}\t{acquired}\n'
+
+    def agent(self):
+        rnd = random.Random(self.seed + 3)
+        first, first_person = self._first('agent'), self._first('person') + self.owners
+        for i in range(self.agents):
+            employed = datetime.date(2000, 1, 1) + datetime.timedelta(days=rnd.randint(0, 8000))
+            yield f'{first + i}\t{first_person + i}\t{employed}\n'
+
+    def client(self):
+        rnd = random.Random(self.seed + 4)
+        first, first_person = self._first('client'), self._first('person') + self.owners + self.agents
+        for i in range(self.clients):
+            purchased = datetime.date(2005, 1, 1) + datetime.timedelta(days=rnd.randint(0, 6500))
+            yield f'{first + i}\t{first_person + i}\t{purchased}\n'
+
+    def location(self):
+        rnd = random.Random(self.seed + 5)
+        first = self._first('location')
+        for i in range(self.properties):
+            _, _, lat, lon, _ = CITIES[i % len(CITIES)]
+            # scatter around the city centre, roughly within 15 km
+            yield f'{first + i}\t{lat + rnd.gauss(0, 0.06):.6f}\t{lon + rnd.gauss(0, 0.08):.6f}\n'
+
+    def property(self):
+        rnd = random.Random(self.seed + 6)
+        first, first_location, first_owner = self._first('property'), self._first('location'), self._first('owner')
+        for i in range(self.properties):
+            price_per_m2 = CITIES[i % len(CITIES)][4]
+            rooms = max(1, min(10, int(rnd.gauss(4, 1.5))))
+            area = max(20, round(rooms * rnd.uniform(18, 32)))
+            year = max(1850, min(2024, int(rnd.gauss(1985, 25))))
+            # newer buildings are worth more, and prices are rounded like real listings
+            price = round(area * price_per_m2 * rnd.uniform(0.75, 1.25) * (1 + (year - 1985) / 400), -3)
+            owner = first_owner + rnd.randrange(self.owners)
+            yield f'{first + i}\t{rooms}\t{year}\t{area}\t{price:.0f}\t{first_location + i}\t{owner}\n'
+
+    def contract(self):
+        rnd = random.Random(self.seed + 7)
+        first, first_agent, first_client = self._first('contract'), self._first('agent'), self._first('client')
+        first_property = self._first('property')
+        # every sold property gets exactly one contract
+        for i in range(self.contracts):
+            yield (f'{first + i}\t{self._sign_date(i)}\t{first_agent + rnd.randrange(self.agents)}\t{first_client + i}'
+                   f'\t{first_property + i * self.properties // max(1, self.contracts)}\n')
+
+    def payment(self):
+        rnd = random.Random(self.seed + 8)
+        first, first_contract = self._first('payment'), self._first('contract')
+        payment_id = first
+        for i in range(self.contracts):
+            # installments never precede the signature
+            signed = self._sign_date(i)
+            for n in range(rnd.randint(1, 6)):
+                paid = signed + datetime.timedelta(days=30 * n + rnd.randint(0, 10))
+                yield f'{payment_id}\t{rnd.randint(5, 200) * 1000}\t{paid}\t{first_contract + i}\n'
+                payment_id += 1
+
+
+# (table, COPY column list) in foreign key order
+TABLES = [
+    ('address', 'address_id, street_number, address_line, country, postal_code'),
+    ('person', 'person_id, first_name, last_name, date_of_birth, phone_number, email, address_id'),
+    ('owner', 'owner_id, person_id, resident_status, acquisition_date'),
+    ('agent', 'agent_id, person_id, employment_date'),
+    ('client', 'client_id, person_id, purchase_date'),
+    ('location', 'location_id, latitude, longitude'),
+    ('property', 'property_id, number_of_rooms, building_year, area_size, price, location_id, owner_id'),
+    ('contract', 'contract_id, sign_date, agent_id, client_id, property_id'),
+    ('payment', 'payment_id, amount, date, contract_id'),
+]
+
+
+# ----- loader -----
+# function to generate a dataset and COPY it into the database, one table per transaction
+def load_dataset(conn, properties, seed=1, echo=print):
+    cur = conn.cursor()
+
+    # continue after the ids already in use so seeded or earlier synthetic rows are kept
+    start_ids = {}
+    for table, _ in TABLES:
+        cur.execute(f'SELECT COALESCE(MAX({table}_id), 0) + 1 FROM {table}')
+        start_ids[table] = cur.fetchone()[0]
+    generator = DatasetGenerator(properties, seed=seed, start_ids=start_ids)
+
+    loaded = {}
+    for table, columns in TABLES:
+        started = time.perf_counter()
+        lines = LineStream(getattr(generator, table)())
+        cur.copy_expert(f'COPY {table} ({columns}) FROM STDIN', io.BufferedReader(lines, buffer_size=1 << 16))
+        loaded[table] = lines.rows
+
+        # explicit ids bypass the sequence, move it past the new rows
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{table}_id'), (SELECT MAX({table}_id) FROM {table}))")
+        conn.commit()
+        seconds = time.perf_counter() - started
+        echo(f'{table}: {loaded[table]} rows in {seconds:.1f}s ({loaded[table] / max(seconds, 1e-9):,.0f} rows/s)')
+
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+    return loaded
@@ -0,0 +1,30 @@
+# ----- imports -----
+import hashlib
+
+
+# ----- table versions -----
+# function to read the change versions of some tables: {table: (version, changed_at)}
+def table_versions(cur, tables):
+    """Return the ``table_version`` rows of ``tables``.
+
+    Statement-level triggers (migration 7) note every table a transaction
+    writes to, and a deferred trigger bumps their counters when it commits
+    (migration 12), so a version is visible exactly when the change it
+    stands for is. The ``table_version`` rows are only locked during the
+    commit; writers of the same table do not wait on each other's open
+    transactions. Inside a writing transaction the versions read are still
+    the old ones.
+    """
+    cur.execute('SELECT table_name, version, changed_at FROM table_version WHERE table_name = ANY(%s)', (list(tables),))
+    return {name: (version, changed_at) for name, version, changed_at in cur.fetchall()}
+
+
+# function to derive a short, stable tag from the versions of some tables and any extra request details
+def version_tag(versions, *extra):
+    parts = [f'{name}:{versions[name][0]}' for name in sorted(versions)] + [str(value) for value in extra]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:20]
+
+
+# function to return when the newest of some tables last changed (None without versions)
+def last_changed(versions):
+    return max((changed_at for _, changed_at in versions.values()), default=None)